@@ -0,0 +1,324 @@
+# A deterministic stand-in for the `flatpak` command line, used by run_benchmarks.py.
+#
+# FakeFlatpakHost is installed with terminal.set_backend() and answers the commands
+# Boutique runs with generated data: the number of installed apps, the latency of every
+# command and the size of the outputs can be configured. It can also write the same data
+# to disk, with the layout of a real installation, so that the native reader and the
+# appstream index can be measured too.
+
+import os
+import gzip
+import time
+import struct
+import threading
+import subprocess
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+_NAME_WORDS = ['Editor', 'Player', 'Viewer', 'Browser', 'Studio', 'Notes', 'Terminal', 'Paint', 'Mail', 'Chat']
+
+# commands that need to reach a remote, their latency can be configured separately
+_REMOTE_COMMANDS = ['search', 'remote-ls', 'remote-info', 'update', 'install']
+
+
+class FakeFlatpakHost():
+    def __init__(self, apps=50, runtimes=10, remote_apps=500, updates: Optional[int]=None,
+            latency_ms=0.0, remote_latency_ms=0.0, description_size=60, arch='x86_64'):
+
+        self.arch = arch
+        self.latency = latency_ms / 1000
+        self.remote_latency = remote_latency_ms / 1000
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+        updates = (apps // 10) if updates is None else updates
+        description = ('lorem ipsum dolor sit amet ' * (description_size // 27 + 1))[0:description_size].strip()
+
+        # the installed apps are the first ones of the remote
+        self.remote_refs = []
+        for i in range(max(apps, remote_apps)):
+            app_id = f'org.fake.App{i:05d}'
+            self.remote_refs.append({
+                'kind': 'app',
+                'name': f'{_NAME_WORDS[i % len(_NAME_WORDS)]} {i}',
+                'description': f'{_NAME_WORDS[i % len(_NAME_WORDS)]} {description}',
+                'application': app_id,
+                'version': f'1.{i % 7}.{i % 3}',
+                'branch': 'stable',
+                'arch': arch,
+                'runtime': f'org.fake.Platform/{arch}/{i % max(runtimes, 1)}',
+                'origin': 'flathub',
+                'installation': 'user',
+                'ref': f'{app_id}/{arch}/stable',
+                # like real commits, an update differs from the deployed commit in its abbreviated form too
+                'commit': 'c0ffee' + f'{i:012x}' * 5,
+                'latest': ('beef00' if i < updates else 'c0ffee') + f'{i:012x}' * 5,
+                'installed_size': (i % 200 + 1) * 1024 * 1024,
+            })
+
+        self.installed_refs = self.remote_refs[0:apps]
+
+        for i in range(runtimes):
+            app_id = 'org.fake.Platform'
+            self.installed_refs.append({
+                'kind': 'runtime',
+                'name': f'Fake Platform {i}',
+                'description': description,
+                'application': app_id,
+                'version': '',
+                'branch': str(i),
+                'arch': arch,
+                'runtime': '',
+                'origin': 'flathub',
+                'installation': 'user',
+                'ref': f'{app_id}/{arch}/{i}',
+                'commit': f'{i:064x}',
+                'latest': f'{i:064x}',
+                'installed_size': 300 * 1024 * 1024,
+            })
+
+        self.updatable_refs = [r for r in self.installed_refs if r['commit'] != r['latest']]
+
+    def __call__(self, args: List[str]) -> subprocess.CompletedProcess:
+        if not args or args[0] != 'flatpak':
+            # xdg-open, ps, ...
+            return self._output(args, '')
+
+        options = [a for a in args[1:] if a.startswith('-')]
+        positional = [a for a in args[1:] if not a.startswith('-')]
+
+        if '--default-arch' in options:
+            return self._output(args, self.arch + '\n')
+
+        command = positional[0] if positional else ''
+        self._count(command)
+        time.sleep(self.remote_latency if command in _REMOTE_COMMANDS else self.latency)
+
+        handler = getattr(self, '_' + command.replace('-', '_'), None)
+        if not handler:
+            return self._output(args, '', f'error: Unknown command \'{command}\'\n', 1)
+
+        return handler(args, options, positional[1:])
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    def count_calls(self) -> int:
+        with self.lock:
+            return sum(self.calls.values())
+
+    def _count(self, command: str):
+        with self.lock:
+            self.calls[command] = self.calls.get(command, 0) + 1
+
+    def _output(self, args, stdout: str, stderr='', returncode=0) -> subprocess.CompletedProcess:
+        return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+    def _get_columns(self, options: List[str], default: List[str]) -> List[str]:
+        for o in options:
+            if o.startswith('--columns='):
+                return o.split('=', maxsplit=1)[1].split(',')
+
+        return default
+
+    def _table(self, refs: List[Dict], columns: List[str]) -> str:
+        rows = []
+        for r in refs:
+            row = []
+            for c in columns:
+                if c in ['size', 'installed-size']:
+                    row.append(f'{r["installed_size"] / 1000000:.1f} MB')
+                elif c == 'download-size':
+                    row.append(f'{r["installed_size"] / 10000000:.1f} MB')
+                elif c in ['active', 'commit']:
+                    row.append(r['commit'][0:12])
+                elif c == 'latest':
+                    row.append(r['latest'][0:12])
+                elif c == 'remotes':
+                    row.append(r['origin'])
+                else:
+                    row.append(str(r.get(c, '')))
+
+            rows.append('\t'.join(row))
+
+        return '\n'.join(rows) + '\n'
+
+    def _filter_installation(self, refs: List[Dict], options: List[str]) -> List[Dict]:
+        for installation in ['user', 'system']:
+            if f'--{installation}' in options:
+                return [r for r in refs if r['installation'] == installation]
+
+        return refs
+
+    def _find_installed(self, ref: str, options: List[str]=[]) -> Optional[Dict]:
+        ref = ref.split('/', maxsplit=1)[1] if ref.startswith(('app/', 'runtime/')) else ref
+        for r in self._filter_installation(self.installed_refs, options):
+            if ref in [r['application'], r['ref']]:
+                return r
+
+        return None
+
+    def _list(self, args, options, positional):
+        refs = self._filter_installation(self.installed_refs, options)
+        if '--app' in options:
+            refs = [r for r in refs if r['kind'] == 'app']
+        elif '--runtime' in options:
+            refs = [r for r in refs if r['kind'] == 'runtime']
+
+        return self._output(args, self._table(refs, self._get_columns(options, ['name', 'application', 'version', 'branch'])))
+
+    def _search(self, args, options, positional):
+        terms = [t.lower() for t in positional]
+        refs = [r for r in self.remote_refs if all([(t in r['name'].lower() or t in r['application'].lower()) for t in terms])]
+
+        if not refs:
+            return self._output(args, 'No matches found\n')
+
+        return self._output(args, self._table(refs, self._get_columns(options, ['name', 'description', 'application'])))
+
+    def _remotes(self, args, options, positional):
+        remote = {'name': 'flathub', 'title': 'Flathub', 'url': 'https://dl.flathub.org/repo/', 'priority': '1', 'options': 'user'}
+        return self._output(args, self._table([remote], self._get_columns(options, ['name', 'options'])))
+
+    def _info(self, args, options, positional):
+        ref = self._find_installed(positional[0], options) if positional else None
+        if not ref:
+            return self._output(args, '', f'error: {positional[0] if positional else ""} not installed\n', 1)
+
+        if '-r' in options:
+            return self._output(args, f'{ref["kind"]}/{ref["ref"]}\n')
+
+        if '-o' in options:
+            return self._output(args, ref['origin'] + '\n')
+
+        return self._output(args, '\n'.join([
+            f'{ref["name"]} - {ref["description"]}',
+            '',
+            f'          ID: {ref["application"]}',
+            f'         Ref: {ref["kind"]}/{ref["ref"]}',
+            f'        Arch: {ref["arch"]}',
+            f'      Branch: {ref["branch"]}',
+            f'     Version: {ref["version"]}',
+            f'     License: GPL-3.0',
+            f'      Origin: {ref["origin"]}',
+            f'  Collection: ',
+            f'Installation: {ref["installation"]}',
+            f'   Installed: {ref["installed_size"] / 1000000:.1f} MB',
+            f'     Runtime: {ref["runtime"]}',
+            f'         Sdk: ',
+            '',
+            f'      Commit: {ref["commit"]}',
+            f'     Subject: Update to {ref["version"]}',
+            f'        Date: 2022-10-01 10:00:00 +0000',
+        ]) + '\n')
+
+    def _remote_ls(self, args, options, positional):
+        # the commit listed by the remote is the latest one
+        refs = self.updatable_refs if '--updates' in options else self.remote_refs
+        refs = [dict(r, commit=r['latest']) for r in refs]
+
+        return self._output(args, self._table(refs, self._get_columns(options, ['name', 'application', 'version', 'branch'])))
+
+    def _remote_info(self, args, options, positional):
+        history = ''.join([f'\n        Commit: {i:064x}\n        Subject: Update ({i})\n        Date: 2022-10-{i + 1:02d} 10:00:00 +0000\n' for i in range(10)])
+        return self._output(args, f'        Ref: {positional[-1] if positional else ""}\n\nHistory:\n{history}')
+
+    def _transaction_output(self, refs: List[Dict], operation: str, noninteractive: bool) -> str:
+        """The output printed by flatpak while it runs a transaction, progress bars included"""
+        if noninteractive:
+            return ''.join([f'{operation} {r["kind"]}/{r["ref"]}\n' for r in refs])
+
+        rows = ['', '        ID\tBranch\tOp\tRemote\tDownload']
+        for i, r in enumerate(refs):
+            rows.append(f' {i + 1}.\t\t{r["application"]}\t{r["branch"]}\tu\t{r["origin"]}\t< {r["installed_size"] / 10000000:.1f}\xa0MB')
+
+        output = '\n'.join(rows) + '\n\n'
+        for i, r in enumerate(refs):
+            output += ''.join([f'\r{operation} {i + 1}/{len(refs)}… {p:>3}%  1.2\xa0MB/s  00:0{9 - p // 20}' for p in range(0, 101, 20)])
+            output += '\n'
+
+        return output + 'Changes complete.\n'
+
+    def _update(self, args, options, positional):
+        if '--appstream' in options:
+            return self._output(args, '')
+
+        if '-y' in options or '--noninteractive' in options:
+            refs = [r for r in self.updatable_refs if (not positional) or (self._find_installed(positional[0]) is r)]
+            return self._output(args, self._transaction_output(refs, 'Updating', '--noninteractive' in options))
+
+        if not self.updatable_refs:
+            return self._output(args, 'Looking for updates…\nNothing to do.\n')
+
+        rows = ['Looking for updates…', '', '        ID\tBranch\tOp\tRemote\tDownload']
+        for i, r in enumerate(self.updatable_refs):
+            rows.append(f' {i + 1}.\t\t{r["application"]}\t{r["branch"]}\tu\t{r["origin"]}\t< {r["installed_size"] / 10000000:.1f} MB')
+
+        return self._output(args, '\n'.join(rows) + '\n\nProceed with these changes to the user installation? [Y/n]: n\n')
+
+    def _install(self, args, options, positional):
+        return self._output(args, '')
+
+    def _remove(self, args, options, positional):
+        return self._output(args, '')
+
+    def _kill(self, args, options, positional):
+        return self._output(args, '')
+
+    def _run(self, args, options, positional):
+        return self._output(args, '')
+
+    def write_installation(self, installation_path: str):
+        """Writes the installed refs to disk, with the same layout used by flatpak"""
+        from gi.repository import GLib
+
+        os.makedirs(f'{installation_path}/app', exist_ok=True)
+        os.makedirs(f'{installation_path}/runtime', exist_ok=True)
+
+        for r in self.installed_refs:
+            deploy_path = f'{installation_path}/{r["kind"]}/{r["ref"]}/active'
+            os.makedirs(deploy_path, exist_ok=True)
+
+            metadata = {'appdata-name': GLib.Variant('s', r['name']), 'appdata-summary': GLib.Variant('s', r['description'])}
+            if r['version']:
+                metadata['appdata-version'] = GLib.Variant('s', r['version'])
+
+            # like flatpak, the installed size is stored big-endian
+            installed_size = struct.unpack('=Q', struct.pack('>Q', r['installed_size']))[0]
+
+            deploy = GLib.Variant('(ssasta{sv})', (r['origin'], r['commit'], [], installed_size, metadata))
+            with open(f'{deploy_path}/deploy', 'wb') as f:
+                f.write(deploy.get_data_as_bytes().get_data())
+
+            with open(f'{deploy_path}/metadata', 'w') as f:
+                if r['kind'] == 'app':
+                    f.write(f'[Application]\nname={r["application"]}\nruntime={r["runtime"]}\n')
+                else:
+                    f.write(f'[Runtime]\nname={r["application"]}\n')
+
+            if r['latest'] != r['commit']:
+                remote_ref_path = f'{installation_path}/repo/refs/remotes/{r["origin"]}/{r["kind"]}/{r["ref"]}'
+                os.makedirs(os.path.dirname(remote_ref_path), exist_ok=True)
+
+                with open(remote_ref_path, 'w') as f:
+                    f.write(r['latest'] + '\n')
+
+    def write_appstream(self, installation_path: str):
+        """Writes the appstream data of the remote apps, as downloaded by `flatpak update --appstream`"""
+        appstream_path = f'{installation_path}/appstream/flathub/{self.arch}/active'
+        os.makedirs(appstream_path, exist_ok=True)
+
+        with gzip.open(f'{appstream_path}/appstream.xml.gz', 'wt', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<components version="0.8" origin="flathub">\n')
+
+            for r in self.remote_refs:
+                f.write(
+                    f'<component type="desktop-application"><id>{r["application"]}</id>'
+                    f'<name>{escape(r["name"])}</name><summary>{escape(r["description"])}</summary>'
+                    f'<developer_name>Fake developer</developer_name>'
+                    f'<bundle type="flatpak">app/{r["ref"]}</bundle>'
+                    f'<releases><release version="{r["version"]}"/></releases></component>\n'
+                )
+
+            f.write('</components>\n')
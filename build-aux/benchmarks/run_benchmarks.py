@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+# Measures how Boutique performs with a given number of installed refs and a given
+# latency of the flatpak command line, replacing it with the deterministic FakeFlatpakHost.
+#
+# Usage: run_benchmarks.py [--apps 2000] [--latency-ms 20] [--remote-latency-ms 500] [--output results.json]
+#        run_benchmarks.py --replay trace.jsonl [--replay-latency 0]
+#        run_benchmarks.py --compare old.json new.json
+#
+# --replay answers the commands from a trace recorded with BOUTIQUE_TRACE_RECORD=trace.jsonl
+# instead of the fake host, the replayed installation is always read through the command line.
+#
+# Every benchmark runs in a temporary home (XDG_DATA_HOME, XDG_CACHE_HOME, ...) containing
+# the fake installation, so the real one is never read nor modified.
+# A display is needed, run it with `xvfb-run` or GDK_BACKEND=broadway on a headless machine.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+from fake_flatpak import FakeFlatpakHost
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BENCHMARKS = ['cold_start', 'refresh_list', 'refresh_list_warm', 'search', 'search_fuzzy', 'list_updatables', 'app_details_load']
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pkgdatadir', default=None, help='the folder containing the "boutique" package, defaults to this source tree')
+parser.add_argument('--gresource', default=None, help='defaults to <pkgdatadir>/boutique.gresource, or is compiled from the sources')
+parser.add_argument('--apps', type=int, default=50)
+parser.add_argument('--runtimes', type=int, default=10)
+parser.add_argument('--remote-apps', type=int, default=500)
+parser.add_argument('--updates', type=int, default=None)
+parser.add_argument('--latency-ms', type=float, default=0)
+parser.add_argument('--remote-latency-ms', type=float, default=0)
+parser.add_argument('--description-size', type=int, default=60)
+parser.add_argument('--query', default='editor')
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--cli-only', action='store_true', help='disable the native installation reader and the appstream index')
+parser.add_argument('--replay', default=None, help='a trace recorded with BOUTIQUE_TRACE_RECORD')
+parser.add_argument('--replay-latency', type=float, default=1, help='1 keeps the recorded latency, 0 removes it')
+parser.add_argument('--only', action='append', choices=BENCHMARKS, default=None)
+parser.add_argument('--output', default=None)
+parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), default=None)
+parser.add_argument('--home', default=None, help=argparse.SUPPRESS)
+parser.add_argument('--cold-start-child', action='store_true', help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, 'r') as f:
+        old = json.load(f)
+
+    with open(new_path, 'r') as f:
+        new = json.load(f)
+
+    print(f'{"benchmark":<20} {"old":>10} {"new":>10} {"change":>8}')
+    for name, result in new['results'].items():
+        if not name in old['results']:
+            continue
+
+        old_ms = old['results'][name]['median_ms']
+        change = ((result['median_ms'] - old_ms) / old_ms * 100) if old_ms else 0
+        print(f'{name:<20} {old_ms:>8.1f}ms {result["median_ms"]:>8.1f}ms {change:>+7.1f}%')
+
+
+def create_host() -> FakeFlatpakHost:
+    return FakeFlatpakHost(
+        apps=args.apps,
+        runtimes=args.runtimes,
+        remote_apps=args.remote_apps,
+        updates=args.updates,
+        latency_ms=args.latency_ms,
+        remote_latency_ms=args.remote_latency_ms,
+        description_size=args.description_size,
+    )
+
+
+class CommandCounter():
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, command_args):
+        with self.lock:
+            self.calls += 1
+
+        return self.backend(command_args)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = 0
+
+    def count_calls(self) -> int:
+        with self.lock:
+            return self.calls
+
+
+def setup_home(home: str):
+    """Points every XDG folder to the temporary home, must be called before GLib is imported"""
+    for var, folder in [('XDG_DATA_HOME', 'data'), ('XDG_CACHE_HOME', 'cache'), ('XDG_CONFIG_HOME', 'config')]:
+        os.environ[var] = f'{home}/{folder}'
+        os.makedirs(f'{home}/{folder}', exist_ok=True)
+
+    os.environ['GSETTINGS_BACKEND'] = 'memory'
+    if os.path.exists(f'{REPO_DIR}/data/gschemas.compiled'):
+        os.environ['GSETTINGS_SCHEMA_DIR'] = f'{REPO_DIR}/data'
+
+    if not args.pkgdatadir:
+        # the package is installed as "boutique" by meson, while it lives in "src" here
+        args.pkgdatadir = f'{home}/pkgdatadir'
+        if not os.path.exists(f'{home}/pkgdatadir/boutique'):
+            os.makedirs(args.pkgdatadir, exist_ok=True)
+            os.symlink(f'{REPO_DIR}/src', f'{args.pkgdatadir}/boutique')
+
+    sys.path.insert(1, args.pkgdatadir)
+
+
+def load_resources(home: str):
+    from gi.repository import Gio
+
+    gresource = args.gresource or f'{args.pkgdatadir}/boutique.gresource'
+
+    if not os.path.exists(gresource) and shutil.which('glib-compile-resources'):
+        gresource = f'{home}/boutique.gresource'
+        subprocess.run([
+            'glib-compile-resources', f'--sourcedir={REPO_DIR}/src', f'--target={gresource}', f'{REPO_DIR}/src/boutique.gresource.xml'
+        ], check=True)
+
+    if os.path.exists(gresource):
+        Gio.resources_register(Gio.Resource.load(gresource))
+    else:
+        print(f'Warning: {gresource} not found, icons and styles will not be loaded', file=sys.stderr)
+
+
+def install_backend(home: str) -> CommandCounter:
+    from boutique.lib import terminal, flatpak, flatpak_installation, command_trace
+
+    flatpak_installation.SYSTEM_INSTALLATION_PATH = f'{home}/system'
+
+    if args.replay:
+        flatpak.native_reader_enabled = False
+        flatpak.appstream_index_enabled = False
+
+        backend = CommandCounter(command_trace.TraceReplay(args.replay, args.replay_latency))
+        terminal.set_backend(backend)
+        return backend
+
+    host = create_host()
+    backend = CommandCounter(host)
+    terminal.set_backend(backend)
+
+    if args.cli_only:
+        flatpak.native_reader_enabled = False
+        flatpak.appstream_index_enabled = False
+    else:
+        host.write_installation(f'{home}/data/flatpak')
+        host.write_appstream(f'{home}/data/flatpak')
+        os.makedirs(f'{home}/system/app', exist_ok=True)
+        os.makedirs(f'{home}/system/runtime', exist_ok=True)
+
+    return backend
+
+
+def drain_main_loop():
+    from gi.repository import GLib
+
+    context = GLib.MainContext.default()
+    while context.iteration(False):
+        pass
+
+
+def wait_background_threads(before: set, timeout=60):
+    """Waits for the threads started by the @_async functions, the shared pools are not waited"""
+    for thread in set(threading.enumerate()) - before:
+        if thread.name.startswith('Thread-'):
+            thread.join(timeout)
+
+    drain_main_loop()
+
+
+def measure(name: str, backend: CommandCounter, run, setup=None) -> dict:
+    runs = []
+    backend.reset_calls()
+
+    for i in range(args.repeat):
+        if setup:
+            setup()
+
+        start = time.perf_counter()
+        run()
+        runs.append((time.perf_counter() - start) * 1000)
+
+    result = {
+        'runs_ms': [round(r, 3) for r in runs],
+        'median_ms': round(statistics.median(runs), 3),
+        'min_ms': round(min(runs), 3),
+        'max_ms': round(max(runs), 3),
+        'commands_per_run': backend.count_calls() / args.repeat,
+    }
+
+    print(f'{name:<20} {result["median_ms"]:>10.1f}ms  (min {result["min_ms"]:.1f}ms, {result["commands_per_run"]:.1f} commands)')
+    return result
+
+
+def run_cold_start_child():
+    """Starts the application and quits as soon as the first window is shown"""
+    setup_home(args.home)
+
+    import gi
+    gi.require_version('Gtk', '4.0')
+    gi.require_version('Adw', '1')
+    from gi.repository import Gio, GLib
+
+    load_resources(args.home)
+    install_backend(args.home)
+
+    from boutique.main import BoutiqueApplication
+
+    app = BoutiqueApplication()
+    # do not hand the activation over to a running instance of Boutique
+    app.set_flags(app.get_flags() | Gio.ApplicationFlags.NON_UNIQUE)
+    app.connect('window-added', lambda app, window: window.connect('map', lambda w: GLib.idle_add(app.quit)))
+    app.run([])
+
+
+def bench_cold_start() -> dict:
+    runs = []
+
+    for i in range(args.repeat):
+        # every run starts from an empty cache, like the first start after a login
+        home = tempfile.mkdtemp(prefix='boutique-benchmark-')
+        command = [sys.executable, __file__, '--cold-start-child', '--home', home, *sys.argv[1:]]
+
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        runs.append((time.perf_counter() - start) * 1000)
+
+        shutil.rmtree(home, ignore_errors=True)
+
+    result = {
+        'runs_ms': [round(r, 3) for r in runs],
+        'median_ms': round(statistics.median(runs), 3),
+        'min_ms': round(min(runs), 3),
+        'max_ms': round(max(runs), 3),
+    }
+
+    print(f'{"cold_start":<20} {result["median_ms"]:>10.1f}ms  (min {result["min_ms"]:.1f}ms)')
+    return result
+
+
+def run_benchmarks(home: str) -> dict:
+    setup_home(home)
+
+    import gi
+    gi.require_version('Gtk', '4.0')
+    gi.require_version('Adw', '1')
+    from gi.repository import Gtk, Adw
+
+    Adw.init()
+    load_resources(home)
+
+    backend = install_backend(home)
+
+    from boutique.lib import flatpak
+    from boutique.providers.providers_list import providers
+    from boutique.InstalledAppsList import InstalledAppsList
+    from boutique.AppDetails import AppDetails
+
+    selected = args.only or BENCHMARKS
+    results = {}
+
+    if 'cold_start' in selected:
+        results['cold_start'] = bench_cold_start()
+
+    before = set(threading.enumerate())
+    installed_apps_list = InstalledAppsList()
+    window = Gtk.Window(child=installed_apps_list, default_width=700, default_height=700)
+    window.present()
+    wait_background_threads(before)
+
+    def refresh_list():
+        installed_apps_list.reconcile_list(installed_apps_list.list_installed_apps())
+        drain_main_loop()
+
+    def clear_list():
+        flatpak.cache.clear()
+        installed_apps_list.installed_apps_store.remove_all()
+        drain_main_loop()
+
+    if 'refresh_list' in selected:
+        results['refresh_list'] = measure('refresh_list', backend, refresh_list, setup=clear_list)
+
+    if 'refresh_list_warm' in selected:
+        results['refresh_list_warm'] = measure('refresh_list_warm', backend, refresh_list)
+
+    flatpak_provider = providers['flatpak']
+
+    if 'search' in selected:
+        results['search'] = measure('search', backend, lambda: flatpak_provider.search(args.query), setup=flatpak.cache.clear)
+
+    if 'search_fuzzy' in selected:
+        # a typo, which does not match anything exactly
+        typo = args.query[0:-1] + args.query[-1] * 2 + 'x'
+        results['search_fuzzy'] = measure('search_fuzzy', backend, lambda: flatpak_provider.search(typo), setup=flatpak.cache.clear)
+
+    def clear_updatables():
+        flatpak.cache.clear()
+        flatpak_provider.invalidate_updatables()
+
+    if 'list_updatables' in selected:
+        results['list_updatables'] = measure('list_updatables', backend, flatpak_provider.list_updatables, setup=clear_updatables)
+
+    if 'app_details_load' in selected:
+        app_details = AppDetails()
+        window.set_child(app_details)
+        list_element = installed_apps_list.list_installed_items()[0].app
+
+        def app_details_load():
+            app_details.set_app_list_element(list_element)
+            drain_main_loop()
+
+        results['app_details_load'] = measure('app_details_load', backend, app_details_load, setup=clear_updatables)
+
+    window.destroy()
+    return results
+
+
+def get_commit() -> str:
+    result = subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', 'HEAD'], capture_output=True, encoding='utf-8')
+    return result.stdout.strip() if result.returncode == 0 else ''
+
+
+if args.compare:
+    compare(*args.compare)
+    sys.exit(0)
+
+if args.cold_start_child:
+    run_cold_start_child()
+    sys.exit(0)
+
+home = tempfile.mkdtemp(prefix='boutique-benchmark-')
+
+try:
+    results = run_benchmarks(home)
+finally:
+    shutil.rmtree(home, ignore_errors=True)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump({
+            'commit': get_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': sys.version.split(' ')[0],
+            'params': dict([(k, v) for k, v in vars(args).items() if not k in ['output', 'compare', 'home', 'cold_start_child', 'pkgdatadir', 'gresource']]),
+            'results': results,
+        }, f, indent=2)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Measures the time spent importing Boutique's entry point with `python3 -X importtime`
+# and fails when it goes over the budget, so that startup regressions can be tracked.
+#
+# Usage: startup_budget.py [--pkgdatadir /app/share/boutique | --source-dir src] [--budget-ms 300] [--json results.json]
+#
+# pkgdatadir is the folder containing the installed "boutique" package,
+# --source-dir measures the sources instead, it is used by the meson test.
+
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+_IMPORTTIME_ROW = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pkgdatadir', default='/app/share/boutique')
+parser.add_argument('--source-dir', default=None, help='the "src" folder of the repository, imported as the "boutique" package')
+parser.add_argument('--module', default='boutique.main')
+parser.add_argument('--budget-ms', type=float, default=300)
+parser.add_argument('--top', type=int, default=15)
+parser.add_argument('--json', default=None)
+args = parser.parse_args()
+
+if args.source_dir:
+    # the package is imported by its installed name, through a symlink
+    args.pkgdatadir = tempfile.mkdtemp(prefix='boutique-startup-budget-')
+    os.symlink(os.path.realpath(args.source_dir), f'{args.pkgdatadir}/boutique')
+
+result = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(1, {args.pkgdatadir!r}); import {args.module}'],
+    capture_output=True,
+    encoding='utf-8'
+)
+
+if args.source_dir:
+    os.unlink(f'{args.pkgdatadir}/boutique')
+    os.rmdir(args.pkgdatadir)
+
+if result.returncode != 0:
+    print(result.stderr)
+    sys.exit(result.returncode)
+
+modules = []
+for row in result.stderr.split('\n'):
+    match = _IMPORTTIME_ROW.match(row)
+    if match:
+        modules.append({
+            'module': match.group(4),
+            'self_ms': int(match.group(1)) / 1000,
+            'cumulative_ms': int(match.group(2)) / 1000,
+            # nested imports are indented by two spaces for every level
+            'depth': len(match.group(3)) // 2,
+        })
+
+total_ms = sum([m['self_ms'] for m in modules])
+slowest = sorted(modules, key=lambda m: m['self_ms'], reverse=True)[0:args.top]
+
+print(f'Total import time: {total_ms:.1f}ms (budget: {args.budget_ms:.1f}ms)\n')
+for m in slowest:
+    print(f'{m["self_ms"]:>8.1f}ms  {m["module"]}')
+
+if args.json:
+    with open(args.json, 'w') as f:
+        json.dump({'total_ms': total_ms, 'budget_ms': args.budget_ms, 'modules': modules}, f, indent=2)
+
+sys.exit(0 if total_ms <= args.budget_ms else 1)
@@ -1,3 +1,4 @@
+import asyncio
 import threading
 import time
 import logging
@@ -7,9 +8,12 @@ from gi.repository import Gtk, GObject, Adw, Gdk, Gio, Pango, GLib
 from .State import state
 from .models.AppListElement import AppListElement, InstalledStatus
 from .models.Provider import Provider
+from .models.Models import TransactionProgress
 from .providers import FlatpakProvider
 from .providers.providers_list import providers
-from .lib.async_utils import _async, idle
+from .lib.async_utils import _async, idle, run_coroutine
+from .lib.command_metrics import tracked
+from .lib.job_queue import job_queue, Job, JobState
 from .lib.utils import cleanhtml, key_in_dict, set_window_cursor, get_application_window
 from .components.CustomComponents import CenteringBox, LabelStart
 
@@ -93,18 +97,24 @@ class AppDetails(Gtk.ScrolledWindow):
 
         self.loading_thread = False
 
+        # the job started from this page, it can be cancelled while it is waiting in the queue
+        self.current_job: Optional[Job] = None
+        job_queue.connect('job-changed', self.on_job_changed)
+
+    @tracked('app-details')
     def set_app_list_element(self, el: AppListElement, load_icon_from_network=False, local_file=False, alt_sources: list[AppListElement] = []):
         self.app_list_element = el
+        self.current_job = None
         self.active_alt_source = None
         self.alt_sources = alt_sources
         self.local_file = local_file
         self.provider = providers[el.provider]
         self.load_icon_from_network = load_icon_from_network
 
-        is_installed, alt_list_element_installed = self.provider.is_installed(self.app_list_element, self.alt_sources)
-        self.load(is_installed, False)
+        # the installed status is checked in the background by load()
+        self.load()
 
-    def load(self, is_installed: bool, alt_list_element_installed):
+    def load(self):
         icon = self.provider.get_icon(self.app_list_element, load_from_network=self.load_icon_from_network)
 
         self.details_row.remove(self.icon_slot)
@@ -164,12 +174,26 @@ class AppDetails(Gtk.ScrolledWindow):
         logging.debug('Trying to open an unsupported file')
         return False
 
+    @tracked('app-details-primary-action')
     def on_primary_action_button_clicked(self, button: Gtk.Button):
+        if self.current_job and job_queue.cancel(self.current_job):
+            self.current_job = None
+
+            previous_status = {
+                InstalledStatus.INSTALLING: InstalledStatus.NOT_INSTALLED,
+                InstalledStatus.UPDATING: InstalledStatus.UPDATE_AVAILABLE,
+                InstalledStatus.UNINSTALLING: InstalledStatus.INSTALLED,
+            }
+
+            self.app_list_element.set_installed_status(previous_status.get(self.app_list_element.installed_status, InstalledStatus.UNKNOWN))
+            self.update_installation_status(check_installed=True)
+            return
+
         if self.app_list_element.installed_status == InstalledStatus.INSTALLED:
             self.app_list_element.set_installed_status(InstalledStatus.UNINSTALLING)
             self.update_installation_status()
 
-            self.provider.uninstall(
+            self.current_job = self.provider.uninstall(
                 self.app_list_element,
                 self.update_status_callback
             )
@@ -187,28 +211,54 @@ class AppDetails(Gtk.ScrolledWindow):
                     self.update_status_callback
                 )
             else:
-                self.provider.install(
+                self.current_job = self.provider.install(
                     self.active_alt_source or self.app_list_element,
-                    self.update_status_callback
+                    self.update_status_callback,
+                    self.on_transaction_progress
                 )
 
         elif self.app_list_element.installed_status == InstalledStatus.UPDATE_AVAILABLE:
-            self.provider.uninstall(
+            self.current_job = self.provider.uninstall(
                 self.app_list_element,
                 self.update_status_callback
             )
 
+    @tracked('app-details-secondary-action')
     def on_secondary_action_button_clicked(self, button: Gtk.Button):
         if self.app_list_element.installed_status == InstalledStatus.INSTALLED:
             self.provider.run(self.app_list_element)
         elif self.app_list_element.installed_status == InstalledStatus.UPDATE_AVAILABLE:
             self.app_list_element.set_installed_status(InstalledStatus.UPDATING)
             self.update_installation_status()
-            self.provider.update(
+            self.current_job = self.provider.update(
                 self.app_list_element,
-                lambda result: self.update_installation_status()
+                lambda result: self.update_installation_status(),
+                self.on_transaction_progress
             )
 
+    def on_job_changed(self, queue, job: Job):
+        if job is not self.current_job:
+            return
+
+        if job.state == JobState.QUEUED:
+            self.primary_action_button.set_label('Queued')
+            self.primary_action_button.set_tooltip_text('Click to cancel')
+        else:
+            self.primary_action_button.set_tooltip_text(None)
+
+            if job.state == JobState.RUNNING:
+                self.update_installation_status()
+
+    def on_transaction_progress(self, progress: TransactionProgress):
+        if progress.finished:
+            return
+
+        if self.app_list_element.installed_status == InstalledStatus.INSTALLING:
+            self.primary_action_button.set_label(f'Installing... {round(progress.get_fraction() * 100)}%')
+
+        elif self.app_list_element.installed_status == InstalledStatus.UPDATING:
+            self.primary_action_button.set_label(f'Updating {round(progress.get_fraction() * 100)}%')
+
     def update_status_callback(self, status: bool):
         if not status:
             self.app_list_element.set_installed_status(InstalledStatus.ERROR)
@@ -222,12 +272,7 @@ class AppDetails(Gtk.ScrolledWindow):
         self.source_selector.set_visible(False)
 
         if check_installed:
-            if self.provider.is_updatable(self.app_list_element.id):
-                self.app_list_element.installed_status = InstalledStatus.UPDATE_AVAILABLE
-
-            else:
-                is_installed, _ = self.provider.is_installed(self.app_list_element)
-                self.app_list_element.installed_status = qq(is_installed, InstalledStatus.INSTALLED, InstalledStatus.NOT_INSTALLED)
+            self.check_installed_status()
 
         if self.app_list_element.installed_status == InstalledStatus.INSTALLED:
             self.secondary_action_button.set_label('Open')
@@ -266,6 +311,29 @@ class AppDetails(Gtk.ScrolledWindow):
             self.primary_action_button.set_label('Error')
             self.primary_action_button.set_css_classes(['destructive-action'])
 
+    def check_installed_status(self):
+        """Asks the provider for the installed status without blocking the main loop, the buttons are updated when it is known"""
+        app_list_element = self.app_list_element
+        provider = self.provider
+        previous_status = app_list_element.installed_status
+
+        def check() -> InstalledStatus:
+            if provider.is_updatable(app_list_element.id):
+                return InstalledStatus.UPDATE_AVAILABLE
+
+            is_installed, _ = provider.is_installed(app_list_element)
+            return qq(is_installed, InstalledStatus.INSTALLED, InstalledStatus.NOT_INSTALLED)
+
+        def on_checked(status: Optional[InstalledStatus], error: Optional[Exception]):
+            # another app is shown, or a job changed the status in the meantime
+            if error or (self.app_list_element is not app_list_element) or (app_list_element.installed_status != previous_status):
+                return
+
+            app_list_element.installed_status = status
+            self.update_installation_status()
+
+        run_coroutine(asyncio.to_thread(check), on_checked)
+
     # Loads the description text from external sources, like an HTTP request
     @_async
     def load_description(self):
@@ -302,6 +370,8 @@ class AppDetails(Gtk.ScrolledWindow):
         if status:
             self.app_list_element.installed_status = status
 
+        # the provider may have filled in the id in the meantime, e.g. the checksum of an AppImage
+        self.app_id.set_markup(f'<small>{self.app_list_element.id}</small>')
         self.update_installation_status()
 
         if final:
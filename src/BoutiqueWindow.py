@@ -16,8 +16,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .InstalledAppsList import InstalledAppsList
-from .BrowseApps import BrowseApps
-from .UpdatesList import UpdatesList
 from .AppDetails import AppDetails
 from .models.AppListElement import AppListElement
 from .State import state
@@ -61,15 +59,13 @@ class BoutiqueWindow(Gtk.ApplicationWindow):
 
         self.installed_stack.set_visible_child(self.installed_apps_list)
 
-        # Create the "stack" widget for the browse view
+        # Create the "stack" widget for the browse view,
+        # the Browse and Updates pages are built the first time they are shown
         self.browse_stack = Gtk.Stack()
-        self.browse_apps = BrowseApps()
+        self.browse_apps = None
 
-        self.browse_stack.add_child(self.browse_apps)
-        
         self.updates_stack = Gtk.Stack()
-        self.updates_list = UpdatesList()
-        self.updates_stack.add_child(self.updates_list)
+        self.updates_list = None
         
         # Add content to the main_stack
         utils.add_page_to_adw_stack(self.app_lists_stack, self.installed_stack, 'installed', 'Installed', 'computer-symbolic' )
@@ -82,10 +78,8 @@ class BoutiqueWindow(Gtk.ApplicationWindow):
         
         # Show details of an installed app
         self.installed_apps_list.connect('selected-app', self.on_selected_installed_app)
-        self.app_details.connect('refresh-updatable', lambda _: self.installed_apps_list.refresh_upgradable())
-        # Show details of an app from global search
-        self.browse_apps.connect('selected-app', self.on_selected_browsed_app)
-        
+        # a transaction only changed the installed refs, what the remotes offer is still known
+        self.app_details.connect('refresh-updatable', lambda _: self.installed_apps_list.refresh_upgradable(force=True, refresh_remotes=False))
         # # come back to the list from the app details window
         # self.app_details.connect('show_list', self.on_show_installed_list)
 
@@ -148,8 +142,24 @@ class BoutiqueWindow(Gtk.ApplicationWindow):
 
     def on_app_lists_stack_change(self, widget, _):
         if self.app_lists_stack.get_visible_child() == self.updates_stack:
+            if not self.updates_list:
+                from .UpdatesList import UpdatesList
+
+                self.updates_list = UpdatesList()
+                self.updates_stack.add_child(self.updates_list)
+
             self.updates_list.on_show()
 
+        elif self.app_lists_stack.get_visible_child() == self.browse_stack:
+            if not self.browse_apps:
+                from .BrowseApps import BrowseApps
+
+                self.browse_apps = BrowseApps()
+                self.browse_stack.add_child(self.browse_apps)
+
+                # Show details of an app from global search
+                self.browse_apps.connect('selected-app', self.on_selected_browsed_app)
+
     def on_container_stack_change(self, widget, _):
         in_app_details = self.container_stack.get_visible_child() == self.app_details
         self.left_button.set_visible(in_app_details)
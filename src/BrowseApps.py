@@ -1,7 +1,8 @@
 import time
-import threading
-from typing import List, Dict
+from typing import List, Dict, Optional
 from .lib import flatpak, utils, async_utils
+from .lib.fan_out import fan_out
+from .lib.command_metrics import tracked
 from .models.AppListElement import AppListElement
 from .models.Models import SearchResultsItems
 from .models.Provider import Provider
@@ -9,7 +10,7 @@ from .providers.providers_list import providers
 from .components.AppListBoxItem import AppListBoxItem
 from .components.CustomComponents import CenteringBox, NoAppsFoundRow
 
-from gi.repository import Gtk, Adw, GObject, Gio, Gdk
+from gi.repository import Gtk, Adw, GObject, Gio, Gdk, GLib
 
 
 class BrowseApps(Gtk.ScrolledWindow):
@@ -17,28 +18,25 @@ class BrowseApps(Gtk.ScrolledWindow):
         "selected-app": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object, )),
     }
 
+    # milliseconds to wait after the last keystroke before searching, set as the search-delay of the entry
+    SEARCH_DELAY_MS = 300
+    # seconds after which the results of a slow provider are ignored
+    SEARCH_PROVIDER_DEADLINE = 10
+
     def __init__(self):
         super().__init__()
         self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, margin_top=20, margin_bottom=20)
 
-        self.search_entry = Gtk.SearchEntry()
-        self.search_results: Gtk.ListBox = None
-        self.search_results_items = []
+        self.search_entry = Gtk.SearchEntry(search_delay=self.SEARCH_DELAY_MS)
+        self.search_query = ''
+        self.search_cancellable: Optional[Gio.Cancellable] = None
 
-        self.search_placeholder_text = 'Press "Enter" to search'
-        self.search_entry.props.placeholder_text = self.search_placeholder_text
+        self.search_entry.props.placeholder_text = 'Search for apps'
         self.search_entry.connect('activate', self.on_search_entry_activated)
         self.search_entry.connect('search-changed', self.on_search_entry_changed)
 
         self.main_box.append(self.search_entry)
-        self.search_tip_revealer = Gtk.Revealer(
-            transition_type=Gtk.RevealerTransitionType.SLIDE_UP,
-            child=Gtk.Label(label=self.search_placeholder_text, opacity=0.7),
-            reveal_child=False
-        )
-
-        self.main_box.append(self.search_tip_revealer)
 
         self.search_results_slot = Gtk.Box(hexpand=True, vexpand=True, orientation=Gtk.Orientation.VERTICAL)
         self.spinner = Gtk.Box(hexpand=True, halign=Gtk.Align.CENTER, margin_top=10, visible=False)
@@ -51,6 +49,16 @@ class BrowseApps(Gtk.ScrolledWindow):
 
         self.search_results_slot.append(self.search_results_slot_placeholder)
 
+        # the list is created once, rows are added and removed as the results come in
+        self.search_results = Gtk.ListBox(hexpand=True, margin_top=10, css_classes=['boxed-list'], visible=False)
+        self.search_results_rows: Dict[str, AppListBoxItem] = {}
+        self.no_apps_found_row = NoAppsFoundRow(visible=False)
+        self.no_apps_found_row.rank = -1
+        self.search_results.append(self.no_apps_found_row)
+        self.search_results.set_sort_func(lambda r1, r2: r1.rank - r2.rank)
+        self.search_results.connect('row-activated', self.on_activated_row)
+        self.search_results_slot.append(self.search_results)
+
         self.main_box.append(self.search_results_slot)
 
         clamp = Adw.Clamp(child=self.main_box, maximum_size=600, margin_top=10, margin_bottom=20)
@@ -64,62 +72,87 @@ class BrowseApps(Gtk.ScrolledWindow):
         self.emit('selected-app', (row._app, row._alt_sources))
 
     def on_search_entry_activated(self, widget: Gtk.SearchEntry):
-        query = widget.get_text()
+        self.start_search(widget.get_text())
 
-        if self.search_results_slot_placeholder.get_visible():
-            self.search_results_slot_placeholder.set_visible(False)
-            self.search_results_slot.remove(self.search_results_slot_placeholder)
+    def on_search_entry_changed(self, widget: Gtk.SearchEntry):
+        # emitted search-delay milliseconds after the last keystroke, or right away when the entry is activated
+        self.start_search(widget.get_text())
 
-        if self.search_results:
-            self.search_results_slot.remove(self.search_results)
+    @tracked('search')
+    def start_search(self, query: str):
+        query = query.strip()
 
-        if not len(query):
+        # activating the entry emits both search-changed and activate
+        if query == self.search_query:
             return
 
-        widget.set_text('')
+        self.search_query = query
 
-        # Perform search across all the providers
-        Gio.Application.get_default().mark_busy()
+        if self.search_cancellable:
+            self.search_cancellable.cancel()
+            self.search_cancellable = None
 
+        if not len(query):
+            self.clear_search_results()
+            self.spinner.set_visible(False)
+            self.search_results.set_visible(False)
+            self.search_results_slot_placeholder.set_visible(True)
+            return
+
+        self.search_results_slot_placeholder.set_visible(False)
         self.spinner.set_visible(True)
-        utils.set_window_cursor('wait')
-        self.search_entry.set_editable(False)
-        self.populate_search(query)
 
-    def on_search_entry_changed(self, widget):
-        query = widget.get_text()
+        self.search_cancellable = Gio.Cancellable()
+        self.populate_search(query, self.search_cancellable)
 
-        if not self.search_results_slot_placeholder.get_visible():
-            self.search_tip_revealer.set_reveal_child(len(query) > 0)
+    def clear_search_results(self):
+        for row in self.search_results_rows.values():
+            self.search_results.remove(row)
 
-    # @async_utils.idle
-    @async_utils._async
-    def populate_search(self, query: str):
-        """Async function to populate the listbox without affecting the main thread"""
-        provider_results: List[AppListElement] = []
-        for p, provider in providers.items():
-            provider_results.extend(provider.search(query))
+        self.search_results_rows = {}
+        self.no_apps_found_row.set_visible(False)
 
+    @async_utils._async
+    def populate_search(self, query: str, cancellable: Gio.Cancellable):
+        """Async function to search across all the providers, in parallel, without affecting the main thread"""
         results_dict: dict[str, List[AppListElement]] = {}
-        results: list[SearchResultsItems] = []
-        for app in provider_results:
-            if (not app.id in results_dict):
-                results_dict[app.id] = []
-            results_dict[app.id].append(app)
 
-        for a, apps in results_dict.items():
-            results.append(SearchResultsItems(a, apps))
+        def snapshot() -> dict[str, List[AppListElement]]:
+            # the main loop gets its own copy of every list, this thread keeps appending to results_dict
+            return dict([(app_id, list(apps)) for app_id, apps in results_dict.items()])
 
-        self.search_results = Gtk.ListBox(hexpand=True, margin_top=10)
-        self.search_results.set_css_classes(['boxed-list'])
+        def on_provider_result(name: str, provider_results: Optional[List[AppListElement]], error: Optional[Exception]):
+            if error or cancellable.is_cancelled():
+                return
 
-        if not results:
-            self.search_results.append(NoAppsFoundRow())
+            for app in provider_results:
+                if (not app.id in results_dict):
+                    results_dict[app.id] = []
+                results_dict[app.id].append(app)
 
-        else:
-            load_img_threads: List[threading.Thread] = []
+            # stream what we have so far, results of the other providers are merged later
+            GLib.idle_add(self.merge_search_results, snapshot(), cancellable, False)
 
-            for search_results_items in results:
+        tasks = dict([(f'search:{p}', (lambda provider=provider: provider.search(query, cancellable.is_cancelled))) for p, provider in providers.items()])
+        fan_out(tasks, self.SEARCH_PROVIDER_DEADLINE, on_provider_result, cancellable.is_cancelled)
+
+        GLib.idle_add(self.merge_search_results, snapshot(), cancellable, True)
+
+    def merge_search_results(self, results_dict: dict[str, List[AppListElement]], cancellable: Gio.Cancellable, final: bool):
+        """Updates the existing rows with the new results, only the rows of new apps are created"""
+        if cancellable.is_cancelled():
+            return False
+
+        results: list[SearchResultsItems] = [SearchResultsItems(a, apps) for a, apps in results_dict.items()]
+        stale_rows = dict(self.search_results_rows)
+
+        for rank, search_results_items in enumerate(results):
+            list_row = stale_rows.pop(search_results_items.id, None)
+
+            if list_row:
+                list_row._app = search_results_items.list_elements[0]
+                list_row._alt_sources = search_results_items.list_elements[1:]
+            else:
                 list_row = AppListBoxItem(
                     search_results_items.list_elements[0],
                     alt_sources=search_results_items.list_elements[1:],
@@ -129,18 +162,27 @@ class BrowseApps(Gtk.ScrolledWindow):
                     visible=True
                 )
 
+                # the sort function runs as soon as the row is appended
+                list_row.rank = rank
                 self.search_results.append(list_row)
-                self.search_results_items.append(list_row)
-                load_img_threads.append(threading.Thread(target=lambda r: r.load_icon(load_from_network=True), args=(list_row, )))
+                self.search_results_rows[search_results_items.id] = list_row
+                list_row.load_icon(load_from_network=True)
 
-            for t in load_img_threads:
-                t.start()
-            for t in load_img_threads:
-                t.join()
+            list_row.rank = rank
 
-        results.clear()
-        self.spinner.set_visible(False)
-        self.search_results.connect('row-activated', self.on_activated_row)
-        self.search_results_slot.append(self.search_results)
-        self.search_entry.set_editable(True)
-        utils.set_window_cursor('default')
+        for app_id, list_row in stale_rows.items():
+            if final:
+                self.search_results.remove(list_row)
+                del self.search_results_rows[app_id]
+            else:
+                # rows of the previous query stay at the bottom until every provider answered
+                list_row.rank = len(results) + list_row.rank
+
+        self.search_results.invalidate_sort()
+        self.search_results.set_visible(True)
+
+        if final:
+            self.spinner.set_visible(False)
+            self.no_apps_found_row.set_visible(not results)
+
+        return False
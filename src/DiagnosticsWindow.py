@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Tuple
+from gi.repository import Gtk, Adw, Gdk, GLib
+
+from .lib import command_metrics, flatpak, flatpak_prefetch, fan_out, installed_snapshot
+from .lib.icon_service import get_icon_service
+from .lib.texture_cache import get_texture_cache
+from .lib.watchdog import watchdog
+from .lib.job_queue import job_queue
+
+
+class DiagnosticsWindow(Adw.Window):
+    """Live numbers about commands, caches and threads, to triage performance problems without a profiler"""
+
+    REFRESH_INTERVAL_MS = 1000
+
+    def __init__(self, parent: Gtk.Window):
+        super().__init__(title='Diagnostics', default_width=600, default_height=700, transient_for=parent)
+
+        self.groups: Dict[str, Adw.PreferencesGroup] = {}
+        self.rows: Dict[str, Dict[str, Adw.ActionRow]] = {}
+
+        self.page = Adw.PreferencesPage()
+        for name, title in [
+            ('commands', 'Commands'),
+            ('actions', 'Slowest recent actions'),
+            ('http', 'HTTP requests'),
+            ('jobs', 'Jobs'),
+            ('caches', 'Caches'),
+            ('threads', 'Threads'),
+            ('main_loop', 'Main loop'),
+        ]:
+            self.groups[name] = Adw.PreferencesGroup(title=title)
+            self.rows[name] = {}
+            self.page.add(self.groups[name])
+
+        copy_button = Gtk.Button(label='Copy report')
+        copy_button.connect('clicked', self.on_copy_button_clicked)
+
+        titlebar = Adw.HeaderBar()
+        titlebar.pack_start(copy_button)
+
+        container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        container.append(titlebar)
+        container.append(self.page)
+        self.set_content(container)
+
+        self.refresh()
+        self.refresh_id = GLib.timeout_add(self.REFRESH_INTERVAL_MS, self.refresh)
+        self.connect('close-request', self.on_close_request)
+
+    def on_close_request(self, window):
+        GLib.source_remove(self.refresh_id)
+        return False
+
+    def set_rows(self, group_name: str, rows: List[Tuple[str, str]], empty_label='Nothing recorded yet'):
+        """Updates the rows of a group in place, so that the page does not scroll back on every refresh"""
+        group = self.groups[group_name]
+        current = self.rows[group_name]
+
+        if not rows:
+            rows = [(empty_label, '')]
+
+        titles = [title for title, subtitle in rows]
+        for title in [t for t in current.keys() if not t in titles]:
+            group.remove(current.pop(title))
+
+        for title, subtitle in rows:
+            subtitle = GLib.markup_escape_text(subtitle)
+
+            if title in current:
+                current[title].set_subtitle(subtitle)
+            else:
+                current[title] = Adw.ActionRow(title=GLib.markup_escape_text(title), subtitle=subtitle)
+                group.add(current[title])
+
+    def get_report(self) -> dict:
+        return {
+            'metrics': command_metrics.get_stats(),
+            'query_cache': {**flatpak.cache.stats(), 'size_bytes': flatpak.cache.estimate_size()},
+            'icon_service': get_icon_service().stats(),
+            'texture_cache': get_texture_cache().stats(),
+            'fan_out': dict([(name, list(t)) for name, t in fan_out.timings.items()]),
+            'jobs': [job.to_dict() for job in job_queue.get_jobs()],
+            'threads': [t.name for t in threading.enumerate()],
+            'watchdog': watchdog.get_stats(),
+        }
+
+    def refresh(self):
+        stats = command_metrics.get_stats()
+
+        self.set_rows('commands', [
+            (name, f'{c["count"]} runs, {c["errors"]} errors · avg {c["avg_ms"]:.0f}ms · p95 {c["p95_ms"]:.0f}ms · max {c["max_ms"]:.0f}ms')
+            for name, c in sorted(stats['commands'].items(), key=lambda c: c[1]['total_ms'], reverse=True)
+        ])
+
+        slowest_actions = sorted(stats['recent_actions'], key=lambda a: a['duration_ms'], reverse=True)[0:10]
+        self.set_rows('actions', [
+            (f'{i + 1}. {a["name"]}', f'{a["duration_ms"]:.0f}ms · {a["commands"]} commands, {a["command_ms"]:.0f}ms')
+            for i, a in enumerate(slowest_actions)
+        ])
+
+        self.set_rows('http', [
+            (host, f'{c["count"]} requests, {c["errors"]} errors · avg {c["avg_ms"]:.0f}ms · max {c["max_ms"]:.0f}ms')
+            for host, c in stats['http'].items()
+        ])
+
+        self.set_rows('jobs', [
+            (f'{job.kind} {job.title}', f'{job.domain} · {job.state.name.lower()}')
+            for job in job_queue.get_jobs()
+        ], 'No jobs running')
+
+        query_cache = flatpak.cache.stats()
+        query_cache_size = flatpak.cache.estimate_size()
+        icon_service = get_icon_service().stats()
+        texture_cache = get_texture_cache().stats()
+
+        caches = [
+            ('Catalog cache', f'{query_cache["entries"]} queries, {GLib.format_size(query_cache_size)} · {self.format_hit_rate(query_cache)}'),
+            ('Icon files', f'{GLib.format_size(icon_service["cache_bytes"])} on disk, {icon_service["downloads"]} downloads, {icon_service["errors"]} errors · {self.format_hit_rate(icon_service)}'),
+            ('Decoded icons', f'{texture_cache["entries"]} textures, {GLib.format_size(texture_cache["size_bytes"])} · {self.format_hit_rate(texture_cache)}'),
+        ]
+
+        prefetched = flatpak_prefetch.get_stats()
+        if prefetched['refs']:
+            caches.append(('Updates downloaded in advance', f'{prefetched["refs"]} refs, {GLib.format_size(prefetched["size_bytes"])}'))
+
+        if flatpak._fuzzy_index:
+            caches.append(('Fuzzy search index', f'{len(flatpak._fuzzy_index.keys)} apps, {GLib.format_size(flatpak._fuzzy_index.size_bytes)}'))
+
+        for title, path in [
+            ('Appstream index', f'{GLib.get_user_cache_dir()}/boutique/appstream-index.sqlite'),
+            ('Installed apps snapshot', installed_snapshot.get_snapshot_path()),
+        ]:
+            if os.path.exists(path):
+                caches.append((title, GLib.format_size(os.path.getsize(path))))
+
+        self.set_rows('caches', caches)
+
+        threads: Dict[str, int] = {}
+        for t in threading.enumerate():
+            # group the workers of the same pool: fan-out_0, fan-out_1, Thread-4 (refresh_list)...
+            name = re.sub(r'[-_]?\d+.*$', '', t.name) or t.name
+            threads[name] = threads.get(name, 0) + 1
+
+        self.set_rows('threads', [(name, f'{count} running') for name, count in sorted(threads.items())])
+
+        watchdog_stats = watchdog.get_stats()
+        if watchdog_stats['running']:
+            main_loop_rows = [('Watchdog', f'{watchdog_stats["stalls"]} stalls over {watchdog_stats["threshold_ms"]}ms · max latency {watchdog_stats["max_latency_ms"]:.0f}ms')]
+            main_loop_rows.extend([
+                (s['callback'], f'{s["duration_ms"]:.0f}ms, most of the time in {s["hot_frame"]}')
+                for s in list(reversed(watchdog_stats['recent_stalls']))[0:5]
+            ])
+
+            self.set_rows('main_loop', main_loop_rows)
+        else:
+            self.set_rows('main_loop', [], 'Start Boutique with BOUTIQUE_WATCHDOG=200 to detect stalls')
+
+        return True
+
+    def format_hit_rate(self, stats: dict) -> str:
+        total = stats['hits'] + stats['misses']
+        return f'{round(stats["hits"] / total * 100)}% hit rate' if total else 'no lookups'
+
+    def on_copy_button_clicked(self, button: Gtk.Button):
+        report = json.dumps(self.get_report(), indent=2, default=str)
+        content = Gdk.ContentProvider.new_for_bytes('text/plain;charset=utf-8', GLib.Bytes.new(report.encode('utf-8')))
+
+        self.get_clipboard().set_content(content)
@@ -1,7 +1,7 @@
 import threading
 import asyncio
 from urllib import request
-from gi.repository import Gtk, Adw, Gdk, GObject, Pango
+from gi.repository import Gtk, Adw, Gdk, GObject, Pango, Gio, GLib
 from typing import Dict, List, Optional
 import re
 
@@ -9,32 +9,59 @@ from .providers.providers_list import providers
 from .models.AppListElement import AppListElement, InstalledStatus
 from .models.Provider import Provider
 from .models.Models import AppUpdateElement
+from .models.AppListItem import AppListItem
 from .components.FilterEntry import FilterEntry
 from .components.CustomComponents import NoAppsFoundRow
 from .components.AppListBoxItem import AppListBoxItem
+from .components.AppListViewRow import AppListViewRow
 from .lib.utils import set_window_cursor, key_in_dict, log
+from .lib.async_utils import _async
+from .lib import installed_snapshot
+from .lib.command_metrics import tracked
+from .lib.update_checker import update_checker
 
-class InstalledAppsList(Gtk.ScrolledWindow):
+class InstalledAppsList(Gtk.Box):
     __gsignals__ = {
         "selected-app": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object, )),
     }
 
     def __init__(self):
-        super().__init__()
-        self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        super().__init__(orientation=Gtk.Orientation.VERTICAL)
 
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 
-        self.installed_apps_list_slot = Gtk.Box()
-        self.installed_apps_list: Optional[Gtk.ListBox] = None
-        self.installed_apps_list_rows: List[Gtk.ListBoxRow] = []
-        self.no_apps_found_row = NoAppsFoundRow(visible=False)
+        # The installed apps are stored in a model and rendered by a Gtk.ListView,
+        # which only creates the rows that are visible and recycles them while scrolling
+        self.installed_apps_store = Gio.ListStore(item_type=AppListItem)
+        self.installed_apps_filter = Gtk.CustomFilter.new(self.filter_installed_app, None)
+        self.installed_apps_filter_model = Gtk.FilterListModel(model=self.installed_apps_store, filter=self.installed_apps_filter)
+        self.installed_apps_sorter = Gtk.CustomSorter.new(self.sort_installed_apps_list, None)
+        self.installed_apps_sort_model = Gtk.SortListModel(model=self.installed_apps_filter_model, sorter=self.installed_apps_sorter)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', lambda f, list_item: list_item.set_child(AppListViewRow()))
+        factory.connect('bind', lambda f, list_item: list_item.get_child().bind(list_item.get_item().app))
+
+        self.installed_apps_list = Gtk.ListView(
+            model=Gtk.NoSelection(model=self.installed_apps_sort_model),
+            factory=factory,
+            single_click_activate=True,
+            css_classes=['card', 'installed-apps-list'],
+        )
+
+        self.installed_apps_list.connect('activate', self.on_activated_list_item)
+
+        self.no_apps_found_row = Gtk.ListBox(css_classes=["boxed-list"], visible=False)
+        self.no_apps_found_row.append(NoAppsFoundRow())
+        self.installed_apps_sort_model.connect('items-changed', lambda *_: self.no_apps_found_row.set_visible(self.installed_apps_sort_model.get_n_items() == 0))
 
         # Create the filter search bar
         self.filter_query: str = ''
         self.filter_entry = FilterEntry('Filter installed applications', capture=self, margin_bottom=20)
         self.filter_entry.connect('search-changed', self.trigger_filter_list)
 
+        # show the last known state immediately, then check it against the providers
+        self.installed_apps_store.splice(0, 0, [AppListItem(el) for el in installed_snapshot.load()])
         self.refresh_list()
 
         # updates row
@@ -60,19 +87,35 @@ class InstalledAppsList(Gtk.ScrolledWindow):
 
         updates_title_row.append(self.update_all_btn)
         self.updates_row.append(updates_title_row)
-        self.updates_row.append(self.updates_row_list)
+
+        # the header does not scroll with the installed apps, so a long list of updates gets its own scrollbar
+        updates_scrolled_window = Gtk.ScrolledWindow(child=self.updates_row_list, propagate_natural_height=True, max_content_height=300)
+        updates_scrolled_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.updates_row.append(updates_scrolled_window)
 
         # title row
         title_row = Gtk.Box(margin_bottom=5)
         title_row.append( Gtk.Label(label='Installed applications', css_classes=['title-2']) )
 
-        for el in [self.filter_entry, self.updates_revealter, title_row, self.installed_apps_list_slot]:
+        for el in [self.filter_entry, self.updates_revealter, title_row, self.no_apps_found_row]:
             self.main_box.append(el)
 
-        clamp = Adw.Clamp(child=self.main_box, maximum_size=600, margin_top=20, margin_bottom=20)
+        clamp = Adw.Clamp(child=self.main_box, maximum_size=600, margin_top=20)
+
+        # the list has its own scrolled window, otherwise every row would be allocated at once
+        list_clamp = Adw.ClampScrollable(child=self.installed_apps_list, maximum_size=600)
+        list_scrolled_window = Gtk.ScrolledWindow(child=list_clamp, vexpand=True)
+        list_scrolled_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+
+        self.append(clamp)
+        self.append(list_scrolled_window)
+
+        # the checks are started by the update checker or by the Updates page, this section only shows their results
+        update_checker.connect('updates-changed', lambda checker, updatable_elements: self.render_updatables(updatable_elements))
+        update_checker.connect('checking', self.on_checking)
 
-        self.refresh_upgradable()
-        self.set_child(clamp)
+        if update_checker.updates is not None:
+            self.render_updatables(update_checker.updates)
 
     def on_activated_row(self, listbox, row: Gtk.ListBoxRow):
         """Emit and event that changes the active page of the Stack in the parent widget"""
@@ -81,144 +124,110 @@ class InstalledAppsList(Gtk.ScrolledWindow):
 
         self.emit('selected-app', row._app)
 
+    def on_activated_list_item(self, list_view: Gtk.ListView, position: int):
+        # installed apps can be opened before the first update check, which may never complete when offline
+        if not self.update_all_btn.get_sensitive():
+            return
+
+        self.emit('selected-app', self.installed_apps_sort_model.get_item(position).app)
+
+    def list_installed_items(self) -> List[AppListItem]:
+        return [self.installed_apps_store.get_item(i) for i in range(self.installed_apps_store.get_n_items())]
+
+    @tracked('refresh-installed')
+    @_async
     def refresh_list(self):
-        set_window_cursor('wait')
-        if self.installed_apps_list:
-            self.installed_apps_list_slot.remove(self.installed_apps_list)
+        """Loads the installed apps in the background, then updates only the rows that changed"""
+        installed = self.list_installed_apps()
 
-        self.installed_apps_list= Gtk.ListBox(css_classes=["boxed-list"])
-        self.installed_apps_list_rows = []
+        installed_snapshot.save(installed)
+        GLib.idle_add(self.reconcile_list, installed)
+
+    def list_installed_apps(self) -> List[AppListElement]:
+        installed: List[AppListElement] = []
 
         for p, provider in providers.items():
-            installed: List[AppListElement] = provider.list_installed()
+            try:
+                installed.extend(provider.list_installed())
+            except Exception as e:
+                log(f'Cannot list installed apps for {p}: {e}')
 
-            for i in installed:
-                list_row = AppListBoxItem(i, activatable=True, selectable=True, hexpand=True)
-                list_row.set_update_version(key_in_dict(i.extra_data, 'version'))
+        return installed
 
-                list_row.load_icon(load_from_network=False)
-                self.installed_apps_list_rows.append(list_row)
-                self.installed_apps_list.append(list_row)
+    def reconcile_list(self, installed: List[AppListElement]):
+        current: Dict[tuple, tuple[int, AppListItem]] = {}
+        for i, item in enumerate(self.list_installed_items()):
+            current[installed_snapshot.get_key(item.app)] = (i, item)
 
-        self.installed_apps_list.append(self.no_apps_found_row)
-        self.no_apps_found_row.set_visible(False)
-        self.installed_apps_list_slot.append(self.installed_apps_list)
-        
-        self.installed_apps_list.set_sort_func(lambda r1, r2: self.sort_installed_apps_list(r1, r2))
-        self.installed_apps_list.invalidate_sort()
+        new_keys = set()
+        new_items: List[AppListItem] = []
 
-        self.installed_apps_list.connect('row-activated', self.on_activated_row)
-        set_window_cursor('default')
+        for el in installed:
+            key = installed_snapshot.get_key(el)
+            new_keys.add(key)
 
-    def trigger_filter_list(self, widget):
-        """ Implements a custom filter function"""
-        if not self.installed_apps_list:
-            return
+            if not key in current:
+                new_items.append(AppListItem(el))
+                continue
 
-        self.filter_query = widget.get_text()
-        # self.installed_apps_list.invalidate_filter()
+            position, item = current[key]
+            if installed_snapshot.get_fingerprint(item.app) != installed_snapshot.get_fingerprint(el):
+                self.installed_apps_store.splice(position, 1, [AppListItem(el)])
+            else:
+                # nothing visible changed, the row is kept and just points to the fresh element
+                item.app = el
 
-        for row in self.installed_apps_list_rows:
-            if not getattr(row, 'force_show', False) and row._app.installed_status != InstalledStatus.INSTALLED:
-                row.set_visible(False)
-                continue
+        removed = [position for key, (position, item) in current.items() if not key in new_keys]
+        for position in sorted(removed, reverse=True):
+            self.installed_apps_store.remove(position)
 
-            if not len(self.filter_query):
-                row.set_visible(True)
-                continue
+        self.installed_apps_store.splice(self.installed_apps_store.get_n_items(), 0, new_items)
+        return False
 
-            visible = self.filter_query.lower().replace(' ', '') in row._app.name.lower()
-            row.set_visible(visible)
-            continue
+    def filter_installed_app(self, item: AppListItem, *args) -> bool:
+        if item.app.installed_status != InstalledStatus.INSTALLED:
+            return False
 
-        self.no_apps_found_row.set_visible(True)
-        for row in self.installed_apps_list_rows:
-            if row.get_visible():
-                self.no_apps_found_row.set_visible(False)
-                break
+        if not len(self.filter_query):
+            return True
 
-    def _refresh_upgradable_thread(self, only_provider: Optional[str]=None):
-        """Runs the background task to check for app updates"""
+        return self.filter_query.lower().replace(' ', '') in item.app.name.lower()
+
+    def trigger_filter_list(self, widget):
+        """ Implements a custom filter function"""
+        self.filter_query = widget.get_text()
+        self.installed_apps_filter.changed(Gtk.FilterChange.DIFFERENT)
+
+    def on_checking(self, checker, checking: bool):
+        self.updates_row_list_spinner.set_visible(checking)
+
+    def render_updatables(self, updatable_elements: List[AppUpdateElement]):
         for widget in self.updates_row_list_items:
             self.updates_row_list.remove(widget)
 
         self.updates_row_list_items = []
 
-        if self.installed_apps_list:
-            self.installed_apps_list.set_opacity(0.5)
+        for upg in updatable_elements:
+            app_list_item = AppListBoxItem(upg.extra_data['app_list_element'], activatable=True, selectable=True, hexpand=True)
+            app_list_item.force_show = True
 
-        self.updates_revealter.set_reveal_child(not self.updates_fetched)
-        self.updates_title_label.set_label('Searching for updates...')
-
-        upgradable = 0
-        self.updates_row_list_spinner.set_visible(True)
-
-        for p, provider in providers.items():
-            updatable_elements = provider.list_updatables()
-
-            updatable_libs: list[AppUpdateElement] = []
-            for upg in updatable_elements:
-                update_is_an_app = False
-
-                for row in self.installed_apps_list_rows:
-                    if row._app.id == upg.id:
-                        update_is_an_app = True
-
-                        upgradable += 1
-                        app_list_item = AppListBoxItem(row._app, activatable=True, selectable=True, hexpand=True)
-                        app_list_item.force_show = True
-                        
-                        if upg.to_version and ('version' in row._app.extra_data):
-                            app_list_item.set_update_version(f'{row._app.extra_data["version"]} > {upg.to_version}')
-
-                        app_list_item.load_icon()
-                        self.updates_row_list.append( app_list_item )
-                        self.updates_row_list_items.append( app_list_item )
-                        row._app.set_installed_status(InstalledStatus.UPDATE_AVAILABLE)
-                        break
-
-                if not update_is_an_app:
-                    updatable_libs.append(upg)
-
-            if updatable_libs:
-                upgradable += 1
-                updatable_libs_desc = ', '.join([upl.id for upl in updatable_libs])
-
-                lib_list_element = AppListElement(
-                    'System libraries', 
-                    'The following libraries can be updated: ' + updatable_libs_desc, 
-                    '__updatable_libs__', 
-                    'flatpak', 
-                    InstalledStatus.UPDATE_AVAILABLE
-                )
-
-                app_list_item = AppListBoxItem(lib_list_element, activatable=False, selectable=False, hexpand=True)
-                app_list_item.force_show = True
-                
-                if upg.to_version and ('version' in row._app.extra_data):
-                    app_list_item.set_update_version(f'{row._app.extra_data["version"]} > {upg.to_version}')
-
-                app_list_item.load_icon()
-                self.updates_row_list.append( app_list_item )
-                self.updates_row_list_items.append( app_list_item )
-                row._app.set_installed_status(InstalledStatus.UPDATE_AVAILABLE)
+            if upg.to_version:
+                app_list_item.set_update_version(upg.to_version)
 
+            GLib.idle_add(app_list_item.load_icon)
+            self.updates_row_list.append(app_list_item)
+            self.updates_row_list_items.append(app_list_item)
 
         self.updates_fetched = True
-        self.updates_row_list_spinner.set_visible(False)
-        self.installed_apps_list.set_opacity(1)
-        self.updates_revealter.set_reveal_child(upgradable > 0)
+        self.updates_revealter.set_reveal_child(len(updatable_elements) > 0)
         self.updates_title_label.set_label('Available updates')
-        self.trigger_filter_list(self.filter_entry)
 
-    def refresh_upgradable(self, only_provider: Optional[str]=None):
+    def refresh_upgradable(self, only_provider: Optional[str]=None, force=False, refresh_remotes=True):
+        """Asks the update checker for a new check, only when the last one is too old unless `force` is set"""
         self.updates_fetched = True
-        # for p, provider in providers.items():
-        #     if provider.updates_need_refresh():
-        #         thread = threading.Thread(target=self._refresh_upgradable_thread, args=(only_provider, ), daemon=True)
-        #         thread.start()
 
-        #         break
+        if force or update_checker.is_stale():
+            update_checker.check_now(refresh_remotes=refresh_remotes)
 
     def after_update_all(self, result: bool, prov: str):
         if result and (not self.update_all_btn.has_css_class('destructive-action')):
@@ -233,6 +242,7 @@ class InstalledAppsList(Gtk.ScrolledWindow):
 
         self.refresh_upgradable(only_provider=prov)
 
+    @tracked('update-all')
     def on_update_all_btn_clicked(self, widget: Gtk.Button):
         if not self.updates_row_list:
             return
@@ -242,13 +252,13 @@ class InstalledAppsList(Gtk.ScrolledWindow):
         self.update_all_btn.set_label('Updating...')
 
         for p, provider in providers.items():
-            provider.update_all(self.after_update_all)
+            provider.update_all(self.after_update_all, lambda progress: self.update_all_btn.set_label(f'Updating {progress.index}/{progress.total}...'))
 
-    def sort_installed_apps_list(self, row: AppListBoxItem, row1: AppListBoxItem):
-        if (not hasattr(row1, '_app')):
-            return 1
+    def sort_installed_apps_list(self, item: AppListItem, item1: AppListItem, *args):
+        name = item.app.name.lower()
+        name1 = item1.app.name.lower()
 
-        if (not hasattr(row, '_app')) or (row._app.name.lower() < row1._app.name.lower()):
-            return -1
+        if name == name1:
+            return 0
 
-        return 1
\ No newline at end of file
+        return -1 if name < name1 else 1
\ No newline at end of file
@@ -8,11 +8,13 @@ import re
 from .providers.providers_list import providers
 from .models.AppListElement import AppListElement, InstalledStatus
 from .models.Provider import Provider
-from .models.Models import AppUpdateElement
+from .models.Models import AppUpdateElement, TransactionProgress
 from .components.FilterEntry import FilterEntry
 from .components.CustomComponents import NoAppsFoundRow
 from .components.AppListBoxItem import AppListBoxItem
 from .lib.utils import set_window_cursor, key_in_dict, log
+from .lib.command_metrics import tracked
+from .lib.update_checker import update_checker
 
 
 class UpdatesList(Gtk.ScrolledWindow):
@@ -20,7 +22,6 @@ class UpdatesList(Gtk.ScrolledWindow):
         super().__init__()
         self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
 
-        self.busy = False
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.no_apps_found_row = NoAppsFoundRow(visible=False)
 
@@ -60,44 +61,38 @@ class UpdatesList(Gtk.ScrolledWindow):
         clamp = Adw.Clamp(child=self.main_box, maximum_size=600, margin_top=20, margin_bottom=20)
         self.set_child(clamp)
 
-    def on_show(self, only_provider: Optional[str] = None):
-        if self.busy:
-            return
-
-        self.busy = True
+        # the last known updates are shown right away, the checker updates them in the background
+        update_checker.connect('updates-changed', lambda checker, updatable_elements: self.render_updatables(updatable_elements))
+        update_checker.connect('checking', self.on_checking)
+        update_checker.connect('check-failed', self.on_check_failed)
 
-        for widget in self.updates_row_list_items:
-            self.updates_row_list.remove(widget)
+        if update_checker.updates is not None:
+            self.render_updatables(update_checker.updates)
 
-        self.toggle_updates_title_label_state('Searching for updates...', True)
-        self.updates_row_list_spinner.set_visible(True)
-        self.updates_row_list.set_css_classes(["boxed-list"])
-
-        threading.Thread(target=self.async_load_upgradable, daemon=True).start()
-
-    # Runs the background task to check for app updates
-    def async_load_upgradable(self, only_provider: Optional[str] = None):
-        updatable_elements = []
-
-        for p, provider in providers.items():
-            apps = provider.list_installed()
+    @tracked('list-updates')
+    def on_show(self, only_provider: Optional[str] = None):
+        if update_checker.updates is None:
+            self.toggle_updates_title_label_state('Searching for updates...', True)
+            self.updates_row_list.set_css_classes(["boxed-list"])
 
-            for upg in provider.list_updatables():
-                for a in apps:
-                    if (a.id == upg.id):
-                        upg.extra_data['app_list_element'] = a
+        if update_checker.is_stale():
+            update_checker.check_now()
 
-                        if a.extra_data and upg.to_version:
-                            if ('version' in a.extra_data) and (a.extra_data['version'] != upg.to_version):
-                                upg.to_version = a.extra_data['version'] + ' > ' + upg.to_version
+        self.updates_row_list_spinner.set_visible(update_checker.checking)
 
-                        updatable_elements.append(upg)
-                        break
+    def on_checking(self, checker, checking: bool):
+        self.updates_row_list_spinner.set_visible(checking)
 
-        GLib.idle_add(self.render_updatables, updatable_elements)
+    def on_check_failed(self, checker):
+        # the updates that were already listed are most likely still there
+        if not update_checker.updates:
+            self.toggle_updates_title_label_state('Couldn\'t check for updates', True)
 
     def render_updatables(self, updatable_elements: List[AppUpdateElement]):
-        upgradable_count = 0
+        for widget in self.updates_row_list_items:
+            self.updates_row_list.remove(widget)
+
+        self.updates_row_list_items = []
 
         for upg in updatable_elements:
             update_is_an_app = False
@@ -114,15 +109,12 @@ class UpdatesList(Gtk.ScrolledWindow):
             self.updates_row_list_items.append(app_list_item)
 
         self.updates_fetched = True
-        self.updates_row_list_spinner.set_visible(False)
 
         if updatable_elements:
             self.toggle_updates_title_label_state('Available updates', False)
         else:
             self.toggle_updates_title_label_state('Everything is up to date!', True)
 
-        self.busy = False
-
     def toggle_updates_title_label_state(self, label: str, show_as_title: bool):
         self.updates_title_label.set_label(label)
 
@@ -147,7 +139,19 @@ class UpdatesList(Gtk.ScrolledWindow):
 
             self.update_all_btn.set_visible(True)
 
+    def on_update_all_progress(self, progress: TransactionProgress):
+        # refs that are not listed, like runtimes, only move the label of the button
+        for app_list_item in self.updates_row_list_items:
+            if app_list_item._app.id == progress.id:
+                app_list_item.set_progress(None if progress.finished else progress.percent / 100)
+                break
+
+        self.update_all_btn.set_label(f'Updating {progress.index}/{progress.total}...')
+
     def after_update_all(self, result: bool, prov: str):
+        for app_list_item in self.updates_row_list_items:
+            app_list_item.set_progress(None)
+
         if result and (not self.update_all_btn.has_css_class('destructive-action')):
             if self.updates_row_list and prov == [*providers.keys()][-1]:
                 self.updates_row_list.set_opacity(1)
@@ -158,8 +162,9 @@ class UpdatesList(Gtk.ScrolledWindow):
             self.update_all_btn.set_label('Error')
             self.update_all_btn.set_css_classes(['destructive-action'])
 
-        self.refresh_upgradable(only_provider=prov)
+        update_checker.check_now()
 
+    @tracked('update-all')
     def on_update_all_btn_clicked(self, widget: Gtk.Button):
         if not self.updates_row_list:
             return
@@ -169,4 +174,4 @@ class UpdatesList(Gtk.ScrolledWindow):
         self.update_all_btn.set_label('Updating...')
 
         for p, provider in providers.items():
-            provider.update_all(self.after_update_all)
+            provider.update_all(self.after_update_all, self.on_update_all_progress)
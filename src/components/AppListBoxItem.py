@@ -53,6 +53,9 @@ class AppListBoxItem(Gtk.ListBoxRow):
         )
 
         app_details_box.append(self.update_version)
+
+        self.progress_bar = Gtk.ProgressBar(margin_top=5, visible=False)
+        app_details_box.append(self.progress_bar)
         app_details_box.set_hexpand(True)
         col.append(app_details_box)
 
@@ -74,4 +77,9 @@ class AppListBoxItem(Gtk.ListBoxRow):
 
     def set_update_version(self, text: Optional[str]):
         self.update_version.set_visible(text != None)
-        self.update_version.set_label(text if text else '')
\ No newline at end of file
+        self.update_version.set_label(text if text else '')
+
+    def set_progress(self, fraction: Optional[float]):
+        """Shows a progress bar under the app, None hides it"""
+        self.progress_bar.set_visible(fraction != None)
+        self.progress_bar.set_fraction(fraction if fraction else 0)
\ No newline at end of file
@@ -0,0 +1,90 @@
+from gi.repository import Gtk, Pango, GLib
+from typing import Optional
+from ..lib.utils import cleanhtml
+from ..lib.utils import key_in_dict
+from ..models.AppListElement import AppListElement
+from ..providers.providers_list import providers
+
+
+class AppListViewRow(Gtk.Box):
+    """
+        The same layout of AppListBoxItem, for Gtk.ListView:
+        widgets are created once by the factory and recycled with bind()
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, spacing=5, css_classes=['app-listbox-item'], **kwargs)
+
+        self.image_container = Gtk.Box()
+        self.append(self.image_container)
+
+        app_details_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, valign=Gtk.Align.CENTER, hexpand=True)
+
+        self.name_label = Gtk.Label(
+            halign=Gtk.Align.START,
+            use_markup=True,
+            max_width_chars=70,
+            ellipsize=Pango.EllipsizeMode.END
+        )
+
+        self.description_label = Gtk.Label(
+            halign=Gtk.Align.START,
+            lines=1,
+            max_width_chars=100,
+            ellipsize=Pango.EllipsizeMode.END,
+        )
+
+        self.update_version = Gtk.Label(
+            label='',
+            margin_top=3,
+            halign=Gtk.Align.START,
+            css_classes=['subtitle'],
+            visible=False
+        )
+
+        for el in [self.name_label, self.description_label, self.update_version]:
+            app_details_box.append(el)
+
+        self.append(app_details_box)
+
+        provider_icon_box = Gtk.Button(css_classes=['provider-icon'])
+        self.provider_icon = Gtk.Image(pixel_size=18)
+        provider_icon_box.set_child(self.provider_icon)
+        self.append(provider_icon_box)
+
+        self.list_element: Optional[AppListElement] = None
+
+    def bind(self, list_element: AppListElement):
+        self.list_element = list_element
+
+        self.name_label.set_label(f'<b>{cleanhtml(list_element.name).replace("&", "")}</b>')
+        self.description_label.set_label(cleanhtml(list_element.description))
+        self.set_update_version(key_in_dict(list_element.extra_data, 'version'))
+
+        # the rows of the snapshot are bound before the first frame: creating the provider
+        # and loading the icons would delay it, so a placeholder is shown until the main loop is idle
+        self.provider_icon.clear()
+        self.set_image(Gtk.Image(icon_name='application-x-executable-symbolic'))
+
+        GLib.idle_add(self.load_icons, list_element)
+
+    def load_icons(self, list_element: AppListElement):
+        # the row has been recycled for another app in the meantime
+        if self.list_element is not list_element:
+            return False
+
+        provider = providers[list_element.provider]
+        self.provider_icon.set_from_resource(provider.small_icon)
+        self.set_image(provider.get_icon(list_element, load_from_network=False))
+        return False
+
+    def set_image(self, image: Gtk.Image):
+        if self.image_container.get_first_child():
+            self.image_container.remove(self.image_container.get_first_child())
+
+        image.set_pixel_size(45)
+        self.image_container.append(image)
+
+    def set_update_version(self, text: Optional[str]):
+        self.update_version.set_visible(text != None)
+        self.update_version.set_label(text if text else '')
@@ -14,7 +14,7 @@ class LabelCenter(Gtk.Label):
 
 class NoAppsFoundRow(Gtk.ListBoxRow):
     def __init__(self, **kwargs):
-        super().__init__(hexpand=True)
+        super().__init__(hexpand=True, **kwargs)
         self.set_child(
             Gtk.Label(
                 label="No apps found", 
@@ -0,0 +1,263 @@
+import os
+import re
+import gzip
+import sqlite3
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+from .utils import log
+from .flatpak_installation import get_installation_path, USER_INSTALLATION
+from gi.repository import GLib
+
+_XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+_INDEXED_COMPONENT_TYPES = ['desktop', 'desktop-application', 'console-application', 'web-application']
+
+# bm25() weights, in the same order as the columns of the "apps" table
+_RANK_WEIGHTS = '0, 0, 5.0, 10.0, 2.0, 3.0, 1.0, 1.0, 0, 0'
+
+
+class AppstreamIndex():
+    """
+        A full-text index of the appstream data downloaded by flatpak for every remote,
+        stored in a SQLite FTS5 database in the user cache folder.
+        A remote is indexed again only when the commit of its appstream data changes.
+    """
+
+    def __init__(self, db_path: str, appstream_path: str):
+        self.db_path = db_path
+        self.appstream_path = appstream_path
+        self.lock = threading.Lock()
+        self.connection: Optional[sqlite3.Connection] = None
+
+        # incremented every time update() changes the indexed data
+        self.generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.connection:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS sources (remote TEXT, arch TEXT, checksum TEXT, PRIMARY KEY (remote, arch));
+                CREATE VIRTUAL TABLE IF NOT EXISTS apps USING fts5(
+                    remote UNINDEXED, arch UNINDEXED, app_id, name, summary, keywords, categories, developer, version UNINDEXED, branch UNINDEXED
+                );
+            ''')
+
+        return self.connection
+
+    def _list_sources(self) -> Dict[Tuple[str, str], str]:
+        sources = {}
+
+        if not os.path.isdir(self.appstream_path):
+            return sources
+
+        for remote in os.listdir(self.appstream_path):
+            remote_path = f'{self.appstream_path}/{remote}'
+            if not os.path.isdir(remote_path):
+                continue
+
+            for arch in os.listdir(remote_path):
+                active_path = f'{remote_path}/{arch}/active'
+                xml_path = f'{active_path}/appstream.xml.gz'
+
+                if not os.path.exists(xml_path):
+                    continue
+
+                # "active" is a symlink to a folder named after the appstream commit
+                if os.path.islink(active_path):
+                    checksum = os.readlink(active_path)
+                else:
+                    stat = os.stat(xml_path)
+                    checksum = f'{stat.st_size}-{stat.st_mtime_ns}'
+
+                sources[(remote, arch)] = checksum
+
+        return sources
+
+    def update(self) -> bool:
+        """Indexes every remote whose appstream data changed since the last update, returns True if something changed"""
+        with self.lock:
+            connection = self._connect()
+            indexed = dict([((r, a), c) for r, a, c in connection.execute('SELECT remote, arch, checksum FROM sources')])
+            available = self._list_sources()
+            changed = False
+
+            for (remote, arch), checksum in available.items():
+                if indexed.get((remote, arch), None) == checksum:
+                    continue
+
+                log(f'Indexing appstream data for {remote} ({arch})')
+
+                try:
+                    rows = list(self._parse_appstream(f'{self.appstream_path}/{remote}/{arch}/active/appstream.xml.gz', remote, arch))
+                except Exception as e:
+                    logging.error(f'Cannot index appstream data for {remote}: {e}')
+                    continue
+
+                with connection:
+                    connection.execute('DELETE FROM apps WHERE remote = ? AND arch = ?', (remote, arch))
+                    connection.executemany('INSERT INTO apps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                    connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', (remote, arch, checksum))
+
+                changed = True
+
+            for (remote, arch) in set(indexed.keys()).difference(available.keys()):
+                with connection:
+                    connection.execute('DELETE FROM apps WHERE remote = ? AND arch = ?', (remote, arch))
+                    connection.execute('DELETE FROM sources WHERE remote = ? AND arch = ?', (remote, arch))
+
+                changed = True
+
+            if changed:
+                self.generation += 1
+
+            return changed
+
+    def _parse_appstream(self, path: str, remote: str, arch: str):
+        with gzip.open(path, 'rb') as f:
+            for event, el in ET.iterparse(f, events=['end']):
+                if el.tag != 'component':
+                    continue
+
+                if el.get('type', 'desktop') in _INDEXED_COMPONENT_TYPES:
+                    app_id = (el.findtext('id') or '').strip()
+                    branch = ''
+
+                    bundle = el.find("bundle[@type='flatpak']")
+                    if bundle is not None and bundle.text:
+                        # app/<id>/<arch>/<branch>
+                        ref = bundle.text.strip().split('/')
+                        if len(ref) == 4:
+                            app_id, branch = ref[1], ref[3]
+
+                    release = el.find('releases/release')
+
+                    yield (
+                        remote,
+                        arch,
+                        app_id,
+                        self._untranslated_text(el, 'name'),
+                        self._untranslated_text(el, 'summary'),
+                        ' '.join([k.text for k in el.findall('keywords/keyword') if k.text and (_XML_LANG not in k.attrib)]),
+                        ' '.join([c.text for c in el.findall('categories/category') if c.text]),
+                        self._untranslated_text(el, 'developer_name') or self._untranslated_text(el, 'developer/name'),
+                        release.get('version', '') if release is not None else '',
+                        branch,
+                    )
+
+                el.clear()
+
+    def _untranslated_text(self, el: ET.Element, path: str) -> str:
+        for child in el.findall(path):
+            if _XML_LANG not in child.attrib:
+                return (child.text or '').strip()
+
+        return ''
+
+    def search(self, query: str, arch: Optional[str]=None, limit=200) -> List[Dict[str, str]]:
+        """
+            Returns a list of dicts with the same keys of `flatpak search --columns=name,description,application,version,branch,remotes`,
+            sorted by relevance. Every token of the query must match, the last one can be a prefix.
+        """
+        tokens = re.findall(r'\w+', query.lower())
+        if not tokens:
+            return []
+
+        fts_query = ' '.join([f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+
+        sql = 'SELECT remote, app_id, name, summary, version, branch FROM apps WHERE apps MATCH ?'
+        params: list = [fts_query]
+
+        if arch:
+            sql += ' AND arch = ?'
+            params.append(arch)
+
+        sql += f' ORDER BY bm25(apps, {_RANK_WEIGHTS}) LIMIT ?'
+        params.append(limit)
+
+        with self.lock:
+            rows = self._connect().execute(sql, params).fetchall()
+
+        output: Dict[Tuple[str, str], Dict[str, str]] = {}
+        for remote, app_id, name, summary, version, branch in rows:
+            key = (app_id, branch)
+
+            if key in output:
+                output[key]['remotes'] += f',{remote}'
+            else:
+                output[key] = {
+                    'name': name,
+                    'description': summary,
+                    'application': app_id,
+                    'version': version,
+                    'branch': branch,
+                    'remotes': remote,
+                }
+
+        return list(output.values())
+
+    def list_remotes(self, arch: Optional[str]=None) -> List[str]:
+        """Returns the remotes whose appstream data has been indexed"""
+        sql = 'SELECT DISTINCT remote FROM sources'
+        params = []
+
+        if arch:
+            sql += ' WHERE arch = ?'
+            params.append(arch)
+
+        with self.lock:
+            return [remote for remote, in self._connect().execute(sql, params).fetchall()]
+
+    def list_names(self, arch: Optional[str]=None) -> List[Tuple[str, str]]:
+        """Returns a (app_id, name) tuple for every indexed app"""
+        sql = 'SELECT DISTINCT app_id, name FROM apps'
+        params = []
+
+        if arch:
+            sql += ' WHERE arch = ?'
+            params.append(arch)
+
+        with self.lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def get_apps(self, app_ids: List[str], arch: Optional[str]=None) -> List[Dict[str, str]]:
+        """Returns the same dicts as search() for the given app ids, keeping their order"""
+        output = []
+
+        for app_id in app_ids:
+            sql = 'SELECT remote, app_id, name, summary, version, branch FROM apps WHERE app_id = ?'
+            params = [app_id]
+
+            if arch:
+                sql += ' AND arch = ?'
+                params.append(arch)
+
+            with self.lock:
+                rows = self._connect().execute(sql, params).fetchall()
+
+            by_branch: Dict[str, Dict[str, str]] = {}
+            for remote, app_id, name, summary, version, branch in rows:
+                if branch in by_branch:
+                    by_branch[branch]['remotes'] += f',{remote}'
+                else:
+                    by_branch[branch] = {'name': name, 'description': summary, 'application': app_id, 'version': version, 'branch': branch, 'remotes': remote}
+
+            output.extend(by_branch.values())
+
+        return output
+
+
+_index: Optional[AppstreamIndex] = None
+
+def get_index() -> AppstreamIndex:
+    global _index
+
+    if not _index:
+        _index = AppstreamIndex(
+            f'{GLib.get_user_cache_dir()}/boutique/appstream-index.sqlite',
+            f'{get_installation_path(USER_INSTALLATION)}/appstream'
+        )
+
+    return _index
@@ -1,4 +1,9 @@
+import asyncio
+import logging
 import threading
+import contextvars
+import concurrent.futures
+from typing import Any, Callable, Coroutine, Optional
 
 import gi
 
@@ -10,7 +15,9 @@ from gi.repository import GLib, GObject
 # Used as a decorator to run things in the background
 def _async(func):
     def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+        # context variables, like the current action of command_metrics, are inherited by the thread
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(func, *args), kwargs=kwargs)
         thread.daemon = True
         thread.start()
         return thread
@@ -20,4 +27,48 @@ def _async(func):
 def idle(func):
     def wrapper(*args, **kwargs):
         GLib.idle_add(func, *args)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+# A single asyncio loop, running in a background thread, shared by every coroutine
+# started from the GTK side; results are delivered back to the GLib main loop
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _event_loop
+
+    with _event_loop_lock:
+        if not _event_loop:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, daemon=True, name='asyncio-loop').start()
+
+    return _event_loop
+
+def run_coroutine(coro: Coroutine, callback: Optional[Callable[[Any, Optional[Exception]], None]]=None) -> concurrent.futures.Future:
+    """
+        Schedules a coroutine on the shared asyncio loop and returns a concurrent Future,
+        which can be cancelled with future.cancel().
+        If a callback is provided, it is called in the GLib main loop as callback(result, error)
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+    def on_done(f: concurrent.futures.Future):
+        if f.cancelled():
+            return
+
+        error = f.exception()
+        if error:
+            logging.error(error)
+
+        if callback:
+            result = None if error else f.result()
+
+            # the idle source must run only once, whatever the callback returns
+            def dispatch():
+                callback(result, error)
+                return GLib.SOURCE_REMOVE
+
+            GLib.idle_add(dispatch)
+
+    future.add_done_callback(on_done)
+    return future
@@ -0,0 +1,243 @@
+import os
+import time
+import threading
+import functools
+import contextvars
+import urllib.parse
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+from .tracing import span
+
+# Counts the commands run by terminal.py and how long they take, grouped by class
+# (the flatpak subcommand: list, search, info, remote-ls, update...) and by the UI action
+# that started them; HTTP requests are counted by host. An action is set with `with action('search'):` and is inherited by the
+# threads started with async_utils._async, so every command run in the background is attributed to it.
+
+# upper bounds (in ms) of the latency histogram buckets, the last one collects everything slower
+HISTOGRAM_BUCKETS: List[float] = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+
+class CommandStats():
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets: List[int] = [0 for b in HISTOGRAM_BUCKETS]
+
+    def add(self, duration_ms: float, failed: bool):
+        self.count += 1
+        self.errors += 1 if failed else 0
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+        for i, bucket in enumerate(HISTOGRAM_BUCKETS):
+            if duration_ms <= bucket:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, p: float) -> float:
+        """An upper bound of the given percentile, read from the histogram"""
+        target = self.count * p
+        seen = 0
+
+        for i, bucket in enumerate(HISTOGRAM_BUCKETS):
+            seen += self.buckets[i]
+            if seen >= target and seen > 0:
+                return min(bucket, self.max_ms)
+
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'histogram': dict([(str(b), c) for b, c in zip(HISTOGRAM_BUCKETS, self.buckets)]),
+        }
+
+
+class ActionStats():
+    def __init__(self):
+        self.runs = 0
+        self.commands = 0
+        self.command_ms = 0.0
+        self.max_commands = 0
+        self.commands_by_class: Dict[str, int] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'runs': self.runs,
+            'commands': self.commands,
+            'commands_per_run': round(self.commands / self.runs, 2) if self.runs else 0,
+            'max_commands': self.max_commands,
+            'command_ms': round(self.command_ms, 3),
+            'commands_by_class': dict(self.commands_by_class),
+        }
+
+
+class _ActionRun():
+    def __init__(self, name: str):
+        self.name = name
+        self.commands = 0
+        self.command_ms = 0.0
+        self.started_at = time.monotonic()
+        # updated when the action returns and when each of its commands completes,
+        # as most of the work of an action happens in background threads
+        self.ended_at = self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'duration_ms': round((self.ended_at - self.started_at) * 1000, 1),
+            'commands': self.commands,
+            'command_ms': round(self.command_ms, 3),
+        }
+
+
+_current_action: contextvars.ContextVar[Optional[_ActionRun]] = contextvars.ContextVar('boutique_action', default=None)
+
+_lock = threading.Lock()
+commands: Dict[str, CommandStats] = {}
+actions: Dict[str, ActionStats] = {}
+http: Dict[str, CommandStats] = {}
+recent_actions: Deque[_ActionRun] = deque(maxlen=50)
+
+
+def get_command_class(args: List[str]) -> str:
+    if not args:
+        return ''
+
+    # commands run at a lower priority, like the pre-download of the updates
+    if args[0] == 'nice':
+        args = args[3:] if args[1:2] == ['-n'] else args[1:]
+
+    if not args:
+        return ''
+
+    if args[0] != 'flatpak':
+        return os.path.basename(args[0])
+
+    if '--default-arch' in args:
+        return 'default-arch'
+
+    subcommands = [a for a in args[1:] if not a.startswith('-')]
+    return subcommands[0] if subcommands else 'flatpak'
+
+
+def record_command(args: List[str], duration_ms: float, failed: bool):
+    command_class = get_command_class(args)
+    action_run = _current_action.get()
+
+    with _lock:
+        commands.setdefault(command_class, CommandStats()).add(duration_ms, failed)
+
+        if action_run:
+            action_run.commands += 1
+            action_run.command_ms += duration_ms
+            action_run.ended_at = max(action_run.ended_at, time.monotonic())
+
+            action_stats = actions.setdefault(action_run.name, ActionStats())
+            action_stats.commands += 1
+            action_stats.command_ms += duration_ms
+            action_stats.max_commands = max(action_stats.max_commands, action_run.commands)
+            action_stats.commands_by_class[command_class] = action_stats.commands_by_class.get(command_class, 0) + 1
+
+
+def get_current_action() -> Optional[str]:
+    action_run = _current_action.get()
+    return action_run.name if action_run else None
+
+
+@contextmanager
+def action(name: str):
+    """Attributes to `name` every command started in this block, including the ones started by threads created in it"""
+    action_run = _ActionRun(name)
+
+    with _lock:
+        actions.setdefault(name, ActionStats()).runs += 1
+        recent_actions.append(action_run)
+
+    token = _current_action.set(action_run)
+
+    try:
+        with span(name, 'action'):
+            yield
+    finally:
+        _current_action.reset(token)
+
+        with _lock:
+            action_run.ended_at = max(action_run.ended_at, time.monotonic())
+
+
+def record_http(url: str, duration_ms: float, failed: bool):
+    with _lock:
+        http.setdefault(urllib.parse.urlparse(url).netloc, CommandStats()).add(duration_ms, failed)
+
+
+@contextmanager
+def http_request(url: str):
+    """Measures an HTTP request made in this block"""
+    started_at = time.monotonic()
+    failed = True
+
+    try:
+        with span('GET', 'http', {'url': url}):
+            yield
+
+        failed = False
+    finally:
+        record_http(url, (time.monotonic() - started_at) * 1000, failed)
+
+
+def tracked(name: str):
+    """Decorator version of action()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with action(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {
+            'commands': dict([(k, v.to_dict()) for k, v in commands.items()]),
+            'actions': dict([(k, v.to_dict()) for k, v in actions.items()]),
+            'http': dict([(k, v.to_dict()) for k, v in http.items()]),
+            'recent_actions': [a.to_dict() for a in recent_actions],
+        }
+
+
+def reset():
+    with _lock:
+        commands.clear()
+        actions.clear()
+        http.clear()
+        recent_actions.clear()
+
+
+def dump() -> str:
+    stats = get_stats()
+    rows = [f'Command metrics ({time.strftime("%Y-%m-%d %H:%M:%S")})', '']
+
+    rows.append(f'{"command":<16} {"count":>6} {"errors":>6} {"avg":>9} {"p50":>9} {"p95":>9} {"max":>9}')
+    for name, c in sorted(stats['commands'].items(), key=lambda c: c[1]['total_ms'], reverse=True):
+        rows.append(f'{name:<16} {c["count"]:>6} {c["errors"]:>6} {c["avg_ms"]:>7.1f}ms {c["p50_ms"]:>7.0f}ms {c["p95_ms"]:>7.0f}ms {c["max_ms"]:>7.1f}ms')
+
+    rows.extend(['', f'{"action":<24} {"runs":>6} {"commands/run":>13} {"max":>5} {"command time":>13}'])
+    for name, a in sorted(stats['actions'].items(), key=lambda a: a[1]['command_ms'], reverse=True):
+        rows.append(f'{name:<24} {a["runs"]:>6} {a["commands_per_run"]:>13} {a["max_commands"]:>5} {a["command_ms"]:>11.1f}ms')
+
+    rows.extend(['', f'{"http":<24} {"count":>6} {"errors":>6} {"avg":>9} {"max":>9}'])
+    for name, c in stats['http'].items():
+        rows.append(f'{name:<24} {c["count"]:>6} {c["errors"]:>6} {c["avg_ms"]:>7.1f}ms {c["max_ms"]:>7.1f}ms')
+
+    return '\n'.join(rows)
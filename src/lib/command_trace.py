@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from .utils import log
+
+# Records the commands run by terminal.py to a JSONL trace file and serves them back,
+# so that the workload of a real installation can be profiled and replayed offline.
+#
+# Every line of a trace contains a command: its arguments, when it was started (in seconds,
+# relative to the start of the recording), how long it took, its return code and its outputs.
+# Files read directly from the disk, like the native installation reader does, are not part of the trace.
+
+TRACE_VERSION = 1
+
+
+class TraceRecorder():
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'w', encoding='utf-8')
+        self._write({'trace_version': TRACE_VERSION, 'date': time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+
+    def _write(self, data: dict):
+        with self.lock:
+            self.file.write(json.dumps(data) + '\n')
+            self.file.flush()
+
+    def record(self, args: List[str], started_at: float, output: subprocess.CompletedProcess):
+        self._write({
+            'args': args,
+            'start': round(started_at - self.started_at, 6),
+            'duration': round(time.monotonic() - started_at, 6),
+            'returncode': output.returncode,
+            'stdout': output.stdout or '',
+            'stderr': output.stderr or '',
+        })
+
+
+class TraceReplay():
+    """
+        A backend for terminal.set_backend() that answers with the outputs found in a trace.
+        Identical commands are answered in the order they were recorded, the last answer is repeated
+        once they are exhausted. The original latency is multiplied by `latency_scale`: 1 keeps it, 0 removes it.
+    """
+
+    def __init__(self, path: str, latency_scale=1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.entries: Dict[Tuple[str, ...], Deque[dict]] = {}
+        self.missing: Dict[Tuple[str, ...], int] = {}
+        self.lock = threading.Lock()
+
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                entry = json.loads(line)
+                if 'args' in entry:
+                    self.entries.setdefault(tuple(entry['args']), deque()).append(entry)
+
+        log(f'Loaded {sum([len(e) for e in self.entries.values()])} commands from {path}')
+
+    def __call__(self, args: List[str]) -> subprocess.CompletedProcess:
+        key = tuple(args)
+
+        with self.lock:
+            queue = self.entries.get(key, None)
+            if not queue:
+                self.missing[key] = self.missing.get(key, 0) + 1
+                entry = None
+            else:
+                entry = queue.popleft() if len(queue) > 1 else queue[0]
+
+        if not entry:
+            log(f'Command not found in the trace: {args}')
+            return subprocess.CompletedProcess(args, 1, '', f'error: {" ".join(args)} was not recorded in {self.path}\n')
+
+        if self.latency_scale > 0:
+            time.sleep(entry['duration'] * self.latency_scale)
+
+        return subprocess.CompletedProcess(args, entry['returncode'], entry['stdout'], entry['stderr'])
+
+
+recorder: Optional[TraceRecorder] = None
+
+def start_recording(path: str):
+    global recorder
+
+    log(f'Recording commands to {path}')
+    recorder = TraceRecorder(path)
+
+def record(args: List[str], started_at: float, output: subprocess.CompletedProcess):
+    if recorder:
+        recorder.record(args, started_at, output)
@@ -0,0 +1,91 @@
+import time
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+from .utils import log
+from .tracing import span
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='fan-out')
+
+# how often, in seconds, the cancellation is checked while waiting for the tasks
+CANCELLATION_CHECK_INTERVAL = 0.05
+
+# the last durations (in seconds) of every task, by task name; None means the deadline expired
+timings: Dict[str, Deque[Optional[float]]] = {}
+_timings_lock = threading.Lock()
+
+
+def _record_timing(name: str, duration: Optional[float]):
+    with _timings_lock:
+        if not name in timings:
+            timings[name] = deque(maxlen=50)
+
+        timings[name].append(duration)
+
+
+def fan_out(tasks: Dict[str, Callable[[], Any]], deadline: float, on_result: Callable[[str, Any, Optional[Exception]], None],
+        is_cancelled: Callable[[], bool]=lambda: False) -> Dict[str, Optional[float]]:
+    """
+        Runs every task in parallel and calls on_result(name, result, error), in the calling thread,
+        as soon as each of them completes.
+        Tasks still running after `deadline` seconds, or when is_cancelled() returns True, are abandoned:
+        their result is discarded and the ones that haven't started yet are never run.
+        Returns the duration of every task, None for the ones that missed the deadline.
+    """
+    start = time.monotonic()
+    durations: Dict[str, Optional[float]] = dict([(name, None) for name in tasks.keys()])
+
+    def run_task(name: str, task: Callable[[], Any]):
+        if is_cancelled():
+            # queued behind other tasks in the shared pool until the search was already cancelled
+            return None
+
+        task_start = time.monotonic()
+
+        try:
+            with span(name, 'fan-out'):
+                return task()
+        finally:
+            duration = time.monotonic() - task_start
+            _record_timing(name, duration)
+            log(f'{name} completed in {round(duration * 1000)}ms')
+
+    futures: Dict[concurrent.futures.Future, str] = {}
+    for name, task in tasks.items():
+        futures[_executor.submit(contextvars.copy_context().run, run_task, name, task)] = name
+
+    pending = set(futures.keys())
+    while pending and not is_cancelled():
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+
+        done, pending = concurrent.futures.wait(pending, timeout=min(remaining, CANCELLATION_CHECK_INTERVAL), return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for future in done:
+            name = futures[future]
+            durations[name] = time.monotonic() - start
+
+            error = future.exception()
+            if error:
+                logging.error(f'{name} failed: {error}')
+
+            on_result(name, None if error else future.result(), error)
+
+    cancelled = is_cancelled()
+
+    for future in pending:
+        if not cancelled:
+            logging.warning(f'{futures[future]} missed the deadline of {deadline}s')
+
+        if not future.cancel():
+            # the task is already running, its late duration is recorded when it completes
+            continue
+
+        if not cancelled:
+            _record_timing(futures[future], None)
+
+    return durations
@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from gi.repository import GLib
+from .async_utils import _async
+from .utils import log
+
+# AppImages weigh hundreds of megabytes: they are hashed in chunks, so that the file is never loaded in memory at once,
+# and every digest is remembered until the file changes, which is detected with its device, inode, size and modification time.
+
+CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_digests: Dict[tuple, str] = {}
+
+# files being hashed in the background -> (callback, on_progress) waiting for the digest
+_pending: Dict[tuple, List[Tuple[Callable[[Optional[str]], None], Optional[Callable[[float], None]]]]] = {}
+
+
+def get_file_key(path: str) -> tuple:
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def get_cached_file_hash(path: str) -> Optional[str]:
+    """The digest of the file if it has been computed since the last time the file changed"""
+    try:
+        key = get_file_key(path)
+    except OSError:
+        return None
+
+    with _lock:
+        return _digests.get(key, None)
+
+
+def hash_file(path: str, on_progress: Optional[Callable[[int, int], None]]=None) -> str:
+    """The md5 of a file, on_progress is called after each chunk with the bytes read and the size of the file"""
+    key = get_file_key(path)
+
+    with _lock:
+        if key in _digests:
+            return _digests[key]
+
+    started_at = time.monotonic()
+    md5 = hashlib.md5()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    done = 0
+
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+
+            md5.update(view[:read])
+            done += read
+
+            if on_progress:
+                on_progress(done, key[2])
+
+    digest = md5.hexdigest()
+    log(f'Hashed {path} in {round((time.monotonic() - started_at) * 1000)}ms')
+
+    # if the file was modified while it was being read, the digest is not worth remembering
+    if get_file_key(path) == key:
+        with _lock:
+            _digests[key] = digest
+
+    return digest
+
+
+def hash_file_async(path: str, callback: Callable[[Optional[str]], None], on_progress: Optional[Callable[[float], None]]=None):
+    """
+        Hashes a file in a background thread; callback receives the digest, or None if the file can't be read,
+        and on_progress the fraction of the file that has been read. Both are called in the main loop.
+        A file that is already being hashed is not read twice.
+    """
+    try:
+        key = get_file_key(path)
+    except OSError as e:
+        logging.error(f'Cannot hash {path}: {e}')
+        GLib.idle_add(callback, None)
+        return
+
+    with _lock:
+        digest = _digests.get(key, None)
+
+        if not digest:
+            if key in _pending:
+                _pending[key].append((callback, on_progress))
+                return
+
+            _pending[key] = [(callback, on_progress)]
+
+    if digest:
+        GLib.idle_add(callback, digest)
+        return
+
+    _hash_in_background(path, key)
+
+
+@_async
+def _hash_in_background(path: str, key: tuple):
+    last_percent = -1
+
+    def report_progress(done: int, total: int):
+        nonlocal last_percent
+
+        # one update for each percent is more than enough for a progress bar
+        percent = (done * 100 // total) if total else 100
+        if percent == last_percent:
+            return
+
+        last_percent = percent
+
+        with _lock:
+            listeners = [*_pending.get(key, [])]
+
+        for callback, on_progress in listeners:
+            if on_progress:
+                GLib.idle_add(on_progress, percent / 100)
+
+    digest = None
+
+    try:
+        digest = hash_file(path, report_progress)
+    except OSError as e:
+        logging.error(f'Cannot hash {path}: {e}')
+
+    with _lock:
+        listeners = _pending.pop(key, [])
+
+    for callback, on_progress in listeners:
+        GLib.idle_add(callback, digest)
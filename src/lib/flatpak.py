@@ -1,16 +1,79 @@
 import re
+import asyncio
+import logging
 import urllib
-import requests
 from typing import List, Callable, Dict, Union, Literal, Optional
-from .terminal import sh, threaded_sh, sanitize
+from .terminal import sh, async_sh, sanitize
 from ..models.AppsListSection import AppsListSection
-from ..models.Models import FlatpakHistoryElement
-from .utils import key_in_dict, log
+from ..models.Models import FlatpakHistoryElement, FlatpakUpdateElement, TransactionProgress
+from .utils import key_in_dict, log, parse_size
+from .query_cache import QueryCache, cached
+from .command_metrics import http_request
+from . import flatpak_installation
+from . import appstream_index
+from .fuzzy_index import TrigramIndex
+from .flatpak_progress import TransactionProgressParser
+from .flatpak_installation import USER_INSTALLATION, SYSTEM_INSTALLATION
+from gi.repository import Gio
 
 API_BASEURL = 'https://flathub.org/api/v2'
 FLATHUB_REPO_URL = 'https://dl.flathub.org/repo/'
 _columns_query: List[str] = ['name', 'description', 'application', 'version', 'branch', 'arch', 'runtime', 'origin', 'installation', 'ref', 'active', 'latest', 'size']
 
+# Cache invalidation tokens:
+# INSTALLATION_TOKEN is used for anything that changes when a ref is installed, updated or removed,
+# REMOTES_TOKEN for anything that depends on the configured remotes,
+# UPDATES_TOKEN for the update plan, which also changes when new commits are published
+INSTALLATION_TOKEN = 'installation'
+REMOTES_TOKEN = 'remotes'
+UPDATES_TOKEN = 'updates'
+
+cache = QueryCache()
+
+# When enabled, the installation state is read from disk instead of running `flatpak list` and `flatpak info`;
+# the CLI is still used as a fallback whenever the installation directory can't be read
+native_reader_enabled = True
+
+# Seconds after which the read-only queries give up, so that a stuck command doesn't hang its caller;
+# the ones contacting the remotes get more time
+QUERY_TIMEOUT = 30
+REMOTE_QUERY_TIMEOUT = 120
+
+# Search the local appstream index instead of running `flatpak search`
+appstream_index_enabled = True
+_installation_monitors: List[Gio.FileMonitor] = []
+
+def invalidate_cache(*tokens: str):
+    cache.invalidate(*(tokens or (INSTALLATION_TOKEN, REMOTES_TOKEN)))
+
+def _on_installation_changed(monitor: Gio.FileMonitor, file: Gio.File, other_file: Optional[Gio.File], event: Gio.FileMonitorEvent, tokens: tuple):
+    if event in [Gio.FileMonitorEvent.CHANGED, Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_IN, Gio.FileMonitorEvent.MOVED_OUT, Gio.FileMonitorEvent.RENAMED]:
+        invalidate_cache(*tokens)
+
+def watch_installations():
+    """Invalidates the cache whenever the user or system installations, or their remotes, change on disk"""
+    if _installation_monitors:
+        return
+
+    installations = [flatpak_installation.get_installation_path(i) for i in [USER_INSTALLATION, SYSTEM_INSTALLATION]]
+
+    for installation in installations:
+        # flatpak touches the ".changed" file after every transaction
+        for path, tokens in [
+            ('.changed', (INSTALLATION_TOKEN, )),
+            ('app', (INSTALLATION_TOKEN, )),
+            ('runtime', (INSTALLATION_TOKEN, )),
+            ('repo/config', (REMOTES_TOKEN, )),
+        ]:
+            gfile = Gio.File.new_for_path(f'{installation}/{path}')
+
+            try:
+                monitor = gfile.monitor(Gio.FileMonitorFlags.WATCH_MOVES, None)
+                monitor.connect('changed', _on_installation_changed, tokens)
+                _installation_monitors.append(monitor)
+            except Exception as e:
+                log(f'Cannot monitor {gfile.get_path()}: {e}')
+
 def _parse_output(command_output: str, headers: List[str], to_sort=True) -> List[Dict]:
     output: List = []
     for row in command_output.split('\n'):
@@ -30,20 +93,67 @@ def _parse_output(command_output: str, headers: List[str], to_sort=True) -> List
 
     return output
 
+def _sort_by_name(output: List[Dict]) -> List[Dict]:
+    return sorted(output, key=lambda o: o['name'].lower())
+
+def _cli_list(installation: str, kinds: List[str]) -> List[Dict]:
+    kind_options = [] if len(kinds) > 1 else [f'--{kinds[0]}']
+    output_list: str = sh(['flatpak', 'list', f'--{installation}', *kind_options, f'--columns={",".join(_columns_query)}'], timeout=QUERY_TIMEOUT)
+
+    return _parse_output(output_list, _columns_query, False)
+
+def _native_list(installations: List[str], kinds: List[str]) -> Optional[List[Dict]]:
+    """
+        Reads the installations from disk; the system one can't be read from the sandbox,
+        so the refs of any installation that is not readable are asked to the CLI instead
+    """
+    if not native_reader_enabled:
+        return None
+
+    output = []
+    try:
+        for installation in installations:
+            if not flatpak_installation.is_readable(installation):
+                output.extend(_cli_list(installation, kinds))
+                continue
+
+            for kind in kinds:
+                output.extend(flatpak_installation.list_deploys(installation, kind))
+    except Exception as e:
+        log(f'Native installation reader failed, using the CLI: {e}')
+        return None
+
+    return _sort_by_name(output)
+
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def full_list() -> List:
-    output_list: str = sh(f'flatpak list --user --columns={",".join(_columns_query)}')
+    native_output = _native_list([USER_INSTALLATION], ['app', 'runtime'])
+    if native_output is not None:
+        return native_output
+
+    output_list: str = sh(f'flatpak list --user --columns={",".join(_columns_query)}', timeout=QUERY_TIMEOUT)
 
     output: List = _parse_output(output_list, _columns_query)
     return output
 
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def apps_list() -> List:
-    output_list: str = sh(f'flatpak list --app --user --columns={",".join(_columns_query)}')
+    native_output = _native_list([USER_INSTALLATION], ['app'])
+    if native_output is not None:
+        return native_output
+
+    output_list: str = sh(f'flatpak list --app --user --columns={",".join(_columns_query)}', timeout=QUERY_TIMEOUT)
 
     output: List = _parse_output(output_list, _columns_query)
     return output
 
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def libs_list() -> List:
-    output_list: str = sh(f'flatpak list --runtime --columns={",".join(_columns_query)}')
+    native_output = _native_list([USER_INSTALLATION, SYSTEM_INSTALLATION], ['runtime'])
+    if native_output is not None:
+        return native_output
+
+    output_list: str = sh(f'flatpak list --runtime --columns={",".join(_columns_query)}', timeout=QUERY_TIMEOUT)
 
     output: List = _parse_output(output_list, _columns_query)
     return output
@@ -56,72 +166,140 @@ def sectioned_list() -> List[AppsListSection]:
 
     return output
 
-_default_arch = None
+@cached(cache)
 def get_default_aarch() -> str:
-    global _default_arch
-
-    if not _default_arch:
-        _default_arch = sh('flatpak --default-arch')
-
-    return _default_arch
+    return sh('flatpak --default-arch', timeout=QUERY_TIMEOUT)
 
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def get_ref_origin(ref: str) -> str:
-    return sh(f'flatpak info {ref} -o')
+    deploy = _native_find_deploy(ref, [USER_INSTALLATION, SYSTEM_INSTALLATION])
+    if deploy:
+        return deploy['origin']
+
+    return sh(f'flatpak info {ref} -o', timeout=QUERY_TIMEOUT)
 
-def remove(ref: str, kill_id: str=None, callback: Callable=None):
+def remove(ref: str, kill_id: str=None):
     if kill_id:
         try:
             sh(f'flatpak kill {kill_id}')
         except Exception as e:
             pass
 
-    threaded_sh(f'flatpak remove {ref} --user -y --no-related', callback)
+    try:
+        sh(f'flatpak remove {ref} --user -y --no-related')
+    finally:
+        invalidate_cache(INSTALLATION_TOKEN)
+
+def run_transaction(command_args: List[str], on_progress: Optional[Callable[[TransactionProgress], None]]=None) -> str:
+    """
+        Runs a transaction in the current thread, streaming the progress of every ref to `on_progress`;
+        it must not be run with --noninteractive, which hides the progress
+    """
+    parser = TransactionProgressParser(on_progress)
 
-def install(repo: str, app_id: str):
-    sh(f'flatpak install --user -y {repo} {app_id}')
+    try:
+        output = asyncio.run(async_sh(command_args, on_stdout=parser.feed, on_stderr=parser.feed))
+        parser.finish()
+    finally:
+        invalidate_cache(INSTALLATION_TOKEN)
+
+    return output
+
+def install(repo: str, app_id: str, on_progress: Optional[Callable[[TransactionProgress], None]]=None):
+    run_transaction(['flatpak', 'install', '--user', '-y', repo, app_id], on_progress)
+
+def update(refs: List[str], on_progress: Optional[Callable[[TransactionProgress], None]]=None, no_pull=False):
+    """Updates the given refs, or every installed ref if the list is empty; with no_pull only the commits already downloaded are deployed"""
+    run_transaction(['flatpak', 'update', '--user', '-y', *(['--no-pull'] if no_pull else []), *refs], on_progress)
 
-def search(query: str) -> List[Dict]: 
+def pull_updates(refs: List[str]):
+    """Downloads the updates of the given refs without deploying them, with the lowest CPU priority"""
+    sh(['nice', '-n', '19', 'flatpak', 'update', '--user', '-y', '--noninteractive', '--no-deploy', *refs])
+
+def search(query: str, is_cancelled: Optional[Callable[[], bool]]=None) -> List[Dict]:
     query = query.strip()
+
+    if appstream_index_enabled:
+        try:
+            index = appstream_index.get_index()
+            index.update()
+
+            # remotes without appstream data, for example before it has been downloaded, are searched by the CLI
+            configured_remotes = set(remotes_list().keys())
+            missing_remotes = configured_remotes.difference(index.list_remotes(arch=get_default_aarch()))
+
+            if configured_remotes.difference(missing_remotes):
+                result = index.search(query, arch=get_default_aarch())
+
+                if not result:
+                    # nothing matched exactly, the query might contain a typo
+                    fuzzy_ids = [app_id for app_id, distance in _get_fuzzy_index().search(query)]
+                    result = index.get_apps(fuzzy_ids, arch=get_default_aarch())
+
+                if result or not missing_remotes:
+                    return result
+
+            log(f'No appstream data indexed for {", ".join(missing_remotes) or "any remote"}, using the CLI')
+        except Exception as e:
+            log(f'Appstream index search failed, using the CLI: {e}')
+
     query = sanitize(query)
 
     cols = ['name', 'description', 'application', 'version', 'branch', 'remotes']
-    res = sh(['flatpak', 'search', '--user', f'--columns={",".join(cols)}', *query.split(' ')])
+    res = sh(['flatpak', 'search', '--user', f'--columns={",".join(cols)}', *query.split(' ')], timeout=QUERY_TIMEOUT, is_cancelled=is_cancelled)
 
-    return _parse_output(res, cols, to_sort=False)
+    return _parse_output(res, cols, to_sort=False)[0:100]
 
-_cached_remotes: Union[Dict['str', Dict], None] = None
 def remotes_list(cache=True) -> Dict['str', Dict]:
-    global _cached_remotes
+    if not cache:
+        invalidate_cache(REMOTES_TOKEN)
 
-    if _cached_remotes and cache:
-        return _cached_remotes
+    return _remotes_list()
 
+@cached(cache, ttl=3600, tokens=[REMOTES_TOKEN])
+def _remotes_list() -> Dict['str', Dict]:
     cols = [ 'name','title','url','collection','subset','filter','priority','options','comment','description','homepage','icon' ]
-    result = _parse_output(sh(f'flatpak remotes --user --columns={",".join(cols)}'), cols, False)
+    result = _parse_output(sh(f'flatpak remotes --user --columns={",".join(cols)}', timeout=QUERY_TIMEOUT), cols, False)
 
     output = {}
     for r in result:
         output[r['name']] = r
         del output[r['name']]['name']
-    
-    _cached_remotes = output
+
     return output
 
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def is_installed(ref: str) -> bool:
-    try:
-        sh(['flatpak', 'info', '-r', ref])
+    if _native_find_deploy(ref, [USER_INSTALLATION, SYSTEM_INSTALLATION]):
         return True
-    except Exception as e:
-        return False
+
+    if not native_reader_enabled:
+        installation_options = [[]]
+    else:
+        # only ask the CLI about the installations that couldn't be read from disk
+        installation_options = [[f'--{i}'] for i in [USER_INSTALLATION, SYSTEM_INSTALLATION] if not flatpak_installation.is_readable(i)]
+
+    for options in installation_options:
+        try:
+            sh(['flatpak', 'info', *options, '-r', ref], timeout=QUERY_TIMEOUT)
+            return True
+        except Exception as e:
+            pass
+
+    return False
 
 def get_appstream(app_id, remote=None) -> dict:
     if remote == 'flathub':
-        return requests.get(API_BASEURL + f'/appstream/{ urllib.parse.quote(app_id, safe="") }').json()
+        import requests
+        url = API_BASEURL + f'/appstream/{ urllib.parse.quote(app_id, safe="") }'
+
+        with http_request(url):
+            return requests.get(url).json()
 
     return dict()
 
 def get_app_history(ref: str, remote: str):
-    log = sh(f'flatpak remote-info {remote} {ref} --log --user')
+    log = sh(f'flatpak remote-info {remote} {ref} --log --user', timeout=REMOTE_QUERY_TIMEOUT)
     history = log.split('History:', maxsplit=1)
 
     output: List[FlatpakHistoryElement] = []
@@ -143,9 +321,33 @@ def get_app_history(ref: str, remote: str):
 
     return output
 
+_fuzzy_index: Optional[TrigramIndex] = None
+# the generation of the appstream index the fuzzy index was built from
+_fuzzy_index_generation = -1
+
+def _get_fuzzy_index() -> TrigramIndex:
+    global _fuzzy_index, _fuzzy_index_generation
+
+    index = appstream_index.get_index()
+    generation = index.generation
+
+    if (not _fuzzy_index) or (_fuzzy_index_generation != generation):
+        fuzzy_index = TrigramIndex()
+
+        for app_id, name in index.list_names(arch=get_default_aarch()):
+            if not fuzzy_index.add(app_id, f'{name} {app_id}'):
+                log(f'Fuzzy search index is full, {len(fuzzy_index.keys)} apps indexed')
+                break
+
+        _fuzzy_index = fuzzy_index
+        _fuzzy_index_generation = generation
+
+    return _fuzzy_index
+
+@cached(cache, ttl=3600, tokens=[REMOTES_TOKEN])
 def list_remotes() -> List[Dict]:
     headers = [ 'name', 'title', 'url', 'collection', 'subset', 'filter', 'priority', 'options', 'comment', 'description', 'homepage', 'icon', ]
-    remotes = sh(['flatpak', 'remotes', ('--columns=' + ','.join(headers))])
+    remotes = sh(['flatpak', 'remotes', ('--columns=' + ','.join(headers))], timeout=QUERY_TIMEOUT)
     return _parse_output(remotes, headers)
 
 def find_remote_from_url(url: str) -> Optional[str]:
@@ -155,6 +357,7 @@ def find_remote_from_url(url: str) -> Optional[str]:
 
     return None
 
+@cached(cache, ttl=600, tokens=[INSTALLATION_TOKEN, REMOTES_TOKEN])
 def remote_ls(updates_only=False, cached=False, origin: Optional[str]=None):
     h = ['application', 'version', 'origin']
     command_args = ['flatpak', 'remote-ls', '--user']
@@ -170,11 +373,80 @@ def remote_ls(updates_only=False, cached=False, origin: Optional[str]=None):
 
     command_args.append(f'--columns={",".join(h)}')
 
-    output = sh(command_args)
+    output = sh(command_args, timeout=REMOTE_QUERY_TIMEOUT)
     return _parse_output(output, h, False)
 
+_update_columns = ['ref', 'origin', 'commit', 'version', 'download-size', 'installed-size']
+
+# not invalidated by local transactions: updating, installing or removing a ref doesn't change what the remotes offer
+@cached(cache, ttl=600, tokens=[REMOTES_TOKEN, UPDATES_TOKEN])
+def _remote_updates() -> List[Dict]:
+    output = sh(['flatpak', 'remote-ls', '--user', '--updates', f'--columns={",".join(_update_columns)}'], timeout=REMOTE_QUERY_TIMEOUT)
+    return _parse_output(output, _update_columns, False)
+
+@cached(cache, ttl=600, tokens=[INSTALLATION_TOKEN, REMOTES_TOKEN, UPDATES_TOKEN])
+def get_update_plan() -> List[FlatpakUpdateElement]:
+    """
+        Lists the refs of the user installation that have a newer commit on their remote:
+        the remote side comes from a single `remote-ls --updates`, the local side from the deployed refs.
+        After a local transaction only the local side is read again, refs that now match their remote are left out
+    """
+    deploys: Dict[str, Dict] = {}
+    for d in full_list():
+        deploys[d['ref']] = d
+
+    plan: List[FlatpakUpdateElement] = []
+    for remote_ref in _remote_updates():
+        ref: str = remote_ref['ref']
+        kind = None
+
+        # depending on the version, flatpak prints the ref with or without its kind
+        if ref.startswith(('app/', 'runtime/')):
+            kind, ref = ref.split('/', maxsplit=1)
+
+        deploy = deploys.get(ref, {})
+        local_commit = deploy.get('commit', None) or deploy.get('active', '')
+
+        # removed, or already updated, since the remote was listed; the CLI prints abbreviated commits
+        if (not local_commit) or (local_commit[0:12] == remote_ref['commit'][0:12]):
+            continue
+
+        if not kind:
+            kind = 'runtime' if (deploy and not deploy['runtime']) else 'app'
+
+        plan.append(FlatpakUpdateElement(
+            ref,
+            kind,
+            remote_ref['origin'],
+            local_commit,
+            remote_ref['commit'],
+            deploy.get('version', ''),
+            remote_ref['version'],
+            parse_size(remote_ref['download-size']),
+            parse_size(remote_ref['installed-size']),
+        ))
+
+    return plan
+
+@cached(cache, ttl=300, tokens=[INSTALLATION_TOKEN])
 def get_info(ref: str) -> Dict[str, str]:
-    command_output = sh(['flatpak', 'info', '--user', ref])
+    deploy = _native_find_deploy(ref, [USER_INSTALLATION])
+    if deploy:
+        return {
+            'id': deploy['application'],
+            'ref': ('app/' if deploy['runtime'] else 'runtime/') + deploy['ref'],
+            'arch': deploy['arch'],
+            'branch': deploy['branch'],
+            'version': deploy['version'],
+            'license': deploy['license'],
+            'origin': deploy['origin'],
+            'installation': deploy['installation'],
+            'installed': deploy['size'],
+            'runtime': deploy['runtime'],
+            'commit': deploy['commit'],
+        }
+
+    command_output = sh(['flatpak', 'info', '--user', ref], timeout=QUERY_TIMEOUT)
 
     command_output = command_output.split('ID:', maxsplit=2)[1]
     command_output = 'ID:' + command_output
@@ -190,3 +462,36 @@ def get_info(ref: str) -> Dict[str, str]:
         output[cols[0].strip().lower()] = cols[1].strip()
 
     return output
+
+def _native_find_deploy(ref: str, installations: List[str]) -> Optional[Dict[str, str]]:
+    if not native_reader_enabled:
+        return None
+
+    try:
+        return flatpak_installation.find_deploy(ref, installations)
+    except Exception as e:
+        log(f'Native installation reader failed, using the CLI: {e}')
+
+    return None
+
+def check_native_reader() -> bool:
+    """Compares the refs read from disk with the ones listed by the CLI, logging every difference"""
+    cols = ['ref', 'origin', 'active']
+    native_output = _native_list([USER_INSTALLATION], ['app', 'runtime'])
+
+    if native_output is None:
+        log('Native installation reader: installation not readable')
+        return False
+
+    cli_output = _parse_output(sh(f'flatpak list --user --columns={",".join(cols)}', timeout=QUERY_TIMEOUT), cols, False)
+
+    native_refs = set([tuple(o[c] for c in cols) for o in native_output])
+    cli_refs = set([tuple(o[c] for c in cols) for o in cli_output])
+
+    for r in native_refs.difference(cli_refs):
+        logging.warning(f'Native installation reader: {r} is not listed by the CLI')
+
+    for r in cli_refs.difference(native_refs):
+        logging.warning(f'Native installation reader: {r} is missing')
+
+    return native_refs == cli_refs
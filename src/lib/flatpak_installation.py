@@ -0,0 +1,168 @@
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+from .utils import log
+from gi.repository import GLib
+
+# Reads the state of a flatpak installation straight from the disk,
+# following the layout used by flatpak itself:
+# <installation>/{app,runtime}/<id>/<arch>/<branch>/active/{metadata,deploy}
+
+USER_INSTALLATION = 'user'
+SYSTEM_INSTALLATION = 'system'
+
+# The serialized format of the "deploy" file, see FLATPAK_DEPLOY_DATA_GVARIANT_FORMAT
+# (origin, commit, subpaths, installed size, metadata)
+_DEPLOY_DATA_FORMAT = '(ssasta{sv})'
+
+SYSTEM_INSTALLATION_PATH = '/var/lib/flatpak'
+
+# these refs are hidden by `flatpak list` unless --all is passed
+_HIDDEN_SUFFIXES = ('.Locale', '.Debug', '.Sources')
+
+
+def get_user_data_dir() -> str:
+    # inside the sandbox, XDG_DATA_HOME points to ~/.var/app/<app-id>/data,
+    # while the host installation is exposed under its usual path
+    if os.path.exists('/.flatpak-info'):
+        return os.path.expanduser('~/.local/share')
+
+    return GLib.get_user_data_dir()
+
+
+def get_installation_path(installation: str) -> str:
+    if installation == USER_INSTALLATION:
+        return f'{get_user_data_dir()}/flatpak'
+
+    return SYSTEM_INSTALLATION_PATH
+
+
+def is_readable(installation: str) -> bool:
+    path = get_installation_path(installation)
+    return os.path.isdir(f'{path}/app') or os.path.isdir(f'{path}/runtime')
+
+
+def _read_deploy_data(deploy_path: str) -> Tuple[str, str, int, Dict]:
+    with open(f'{deploy_path}/deploy', 'rb') as f:
+        data = f.read()
+
+    variant = GLib.Variant.new_from_bytes(GLib.VariantType.new(_DEPLOY_DATA_FORMAT), GLib.Bytes.new(data), False)
+    origin, commit, subpaths, installed_size, metadata = variant.unpack()
+
+    # flatpak stores the installed size big-endian (GUINT64_TO_BE), whatever the byte order of the host
+    installed_size = struct.unpack('>Q', struct.pack('=Q', installed_size))[0]
+
+    return origin, commit, installed_size, metadata
+
+
+def _read_metadata(deploy_path: str) -> GLib.KeyFile:
+    keyfile = GLib.KeyFile()
+    keyfile.load_from_file(f'{deploy_path}/metadata', GLib.KeyFileFlags.NONE)
+    return keyfile
+
+
+def _get_keyfile_string(keyfile: GLib.KeyFile, group: str, key: str) -> str:
+    try:
+        return keyfile.get_string(group, key)
+    except GLib.Error:
+        return ''
+
+
+def _read_remote_commit(installation_path: str, origin: str, kind: str, ref: str) -> Optional[str]:
+    try:
+        with open(f'{installation_path}/repo/refs/remotes/{origin}/{kind}/{ref}', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_deploy(installation: str, kind: str, app_id: str, arch: str, branch: str) -> Optional[Dict[str, str]]:
+    """Returns a dict with the same keys as `flatpak list --columns=...`, or None if the ref is not deployed"""
+    installation_path = get_installation_path(installation)
+    deploy_path = f'{installation_path}/{kind}/{app_id}/{arch}/{branch}/active'
+
+    if not os.path.exists(f'{deploy_path}/deploy'):
+        return None
+
+    origin, commit, installed_size, deploy_metadata = _read_deploy_data(deploy_path)
+    keyfile = _read_metadata(deploy_path)
+
+    ref = f'{app_id}/{arch}/{branch}'
+    latest = _read_remote_commit(installation_path, origin, kind, ref) or commit
+
+    return {
+        'name': deploy_metadata.get('appdata-name', None) or app_id,
+        'description': deploy_metadata.get('appdata-summary', ''),
+        'application': app_id,
+        'version': deploy_metadata.get('appdata-version', ''),
+        'branch': branch,
+        'arch': arch,
+        'runtime': _get_keyfile_string(keyfile, 'Application', 'runtime') if kind == 'app' else '',
+        'origin': origin,
+        'installation': installation,
+        'ref': ref,
+        'active': commit[0:12],
+        'latest': latest[0:12],
+        'size': GLib.format_size(installed_size),
+        'commit': commit,
+        'license': deploy_metadata.get('appdata-license', ''),
+        'installed_size': installed_size,
+    }
+
+
+def list_deploys(installation: str, kind: str) -> List[Dict[str, str]]:
+    output = []
+    kind_path = f'{get_installation_path(installation)}/{kind}'
+
+    if not os.path.isdir(kind_path):
+        return output
+
+    for app_id in os.listdir(kind_path):
+        if app_id.endswith(_HIDDEN_SUFFIXES):
+            continue
+
+        for arch in os.listdir(f'{kind_path}/{app_id}'):
+            arch_path = f'{kind_path}/{app_id}/{arch}'
+            if not os.path.isdir(arch_path):
+                continue
+
+            for branch in os.listdir(arch_path):
+                try:
+                    deploy = read_deploy(installation, kind, app_id, arch, branch)
+                except Exception as e:
+                    log(f'Cannot read {arch_path}/{branch}: {e}')
+                    continue
+
+                if deploy:
+                    output.append(deploy)
+
+    return output
+
+
+def find_deploy(ref: str, installations: List[str]) -> Optional[Dict[str, str]]:
+    """Finds a deployed ref, which can be a plain app id or an "id/arch/branch" ref"""
+    parts = ref.split('/')
+    if parts[0] in ['app', 'runtime']:
+        parts = parts[1:]
+
+    app_id = parts[0]
+    arch = parts[1] if len(parts) > 1 and parts[1] else None
+    branch = parts[2] if len(parts) > 2 and parts[2] else None
+
+    for installation in installations:
+        for kind in ['app', 'runtime']:
+            id_path = f'{get_installation_path(installation)}/{kind}/{app_id}'
+            if not os.path.isdir(id_path):
+                continue
+
+            for a in ([arch] if arch else sorted(os.listdir(id_path))):
+                if not os.path.isdir(f'{id_path}/{a}'):
+                    continue
+
+                for b in ([branch] if branch else sorted(os.listdir(f'{id_path}/{a}'))):
+                    deploy = read_deploy(installation, kind, app_id, a, b)
+
+                    if deploy:
+                        return deploy
+
+    return None
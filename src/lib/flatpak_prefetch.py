@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List
+from ..models.Models import FlatpakUpdateElement
+from .utils import log
+from gi.repository import GLib
+
+# Keeps track of the updates that have been downloaded ahead of time with `flatpak update --no-deploy`,
+# so that they can be applied with --no-pull. A prefetched commit is forgotten as soon as the remote
+# publishes a newer one: its objects are no longer referenced and are pruned by flatpak after the next transaction.
+
+_lock = threading.Lock()
+_prefetched: Dict[str, Dict] = {}
+_loaded = False
+
+
+def get_state_path() -> str:
+    return f'{GLib.get_user_cache_dir()}/boutique/prefetched-updates.json'
+
+
+def _load():
+    global _loaded
+
+    if _loaded:
+        return
+
+    _loaded = True
+
+    try:
+        with open(get_state_path(), 'r') as f:
+            _prefetched.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f'Cannot load the prefetched updates: {e}')
+
+
+def _save():
+    path = get_state_path()
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path + '.part', 'w') as f:
+            json.dump(_prefetched, f)
+
+        os.replace(path + '.part', path)
+    except Exception as e:
+        logging.warning(f'Cannot save the prefetched updates: {e}')
+
+
+def sync(plan: List[FlatpakUpdateElement]) -> int:
+    """Forgets the prefetched commits that are not pending anymore, returns the size of the ones left"""
+    pending = dict([(upd.ref, upd.to_commit) for upd in plan])
+
+    with _lock:
+        _load()
+
+        superseded = [ref for ref, p in _prefetched.items() if pending.get(ref, None) != p['commit']]
+        for ref in superseded:
+            del _prefetched[ref]
+
+        if superseded:
+            log(f'Prefetched updates superseded or applied: {", ".join(superseded)}')
+            _save()
+
+        return sum([p['size'] for p in _prefetched.values()])
+
+
+def select(plan: List[FlatpakUpdateElement], max_bytes: int) -> List[FlatpakUpdateElement]:
+    """The updates to prefetch, smallest first, without going over `max_bytes` including the ones already downloaded"""
+    total = sync(plan)
+    output = []
+
+    for upd in sorted(plan, key=lambda u: u.download_size):
+        if is_prefetched(upd):
+            continue
+
+        if total + upd.download_size > max_bytes:
+            break
+
+        total += upd.download_size
+        output.append(upd)
+
+    return output
+
+
+def is_prefetched(upd: FlatpakUpdateElement) -> bool:
+    with _lock:
+        _load()
+        return (upd.ref in _prefetched) and (_prefetched[upd.ref]['commit'] == upd.to_commit)
+
+
+def add(updates: List[FlatpakUpdateElement]):
+    with _lock:
+        _load()
+
+        for upd in updates:
+            _prefetched[upd.ref] = {'commit': upd.to_commit, 'size': upd.download_size}
+
+        _save()
+
+
+def forget(refs: List[str]):
+    with _lock:
+        _load()
+
+        for ref in refs:
+            _prefetched.pop(ref, None)
+
+        _save()
+
+
+def get_stats() -> dict:
+    with _lock:
+        _load()
+        return {'refs': len(_prefetched), 'size_bytes': sum([p['size'] for p in _prefetched.values()])}
@@ -0,0 +1,122 @@
+import re
+import copy
+import time
+from typing import Callable, Dict, Optional, Tuple
+from ..models.Models import TransactionProgress
+from .utils import parse_size
+
+# Parses the output of `flatpak install/update/remove -y` while it is being printed.
+#
+# Flatpak first prints the table of the operations:
+#    1.	org.gnome.Maps	stable	u	flathub	< 3.4 MB
+# then the progress of each one, rewriting the same line with \r:
+#    Updating 1/2… ████▍     45%  1.2 MB/s  00:04
+# with --noninteractive only the name of the ref being processed is printed:
+#    Updating app/org.gnome.Maps/x86_64/stable
+
+_OPERATIONS = {'Installing': 'install', 'Updating': 'update', 'Uninstalling': 'uninstall'}
+
+_TABLE_ROW = re.compile(r'^\s*([0-9]+)\.\s+(.*)$')
+_STATUS_CELL = re.compile(r'^\s*\[[^\]]*\]\s*')
+_DOWNLOAD_SIZE = re.compile(r'<\s*([0-9.,]+\s*(?:[kMGTP]?B|bytes?))')
+_PROGRESS = re.compile(r'^(Installing|Updating|Uninstalling)\s+([0-9]+)/([0-9]+)(?:\D*?([0-9]{1,3})%)?(?:\s+([0-9.,]+\s*[kMGTP]?B/s))?')
+_REF = re.compile(r'^(Installing|Updating|Uninstalling)\s+((?:app|runtime)/\S+)')
+
+
+class TransactionProgressParser():
+    """
+        Receives the output of a transaction line by line, and calls on_progress with a copy of the progress of the current ref.
+        Calls are throttled to one every `interval` seconds, except when a ref starts or ends.
+    """
+
+    def __init__(self, on_progress: Optional[Callable[[TransactionProgress], None]], interval=0.1):
+        self.on_progress = on_progress
+        self.interval = interval
+        self.last_emit = 0.0
+
+        # index in the table -> (ref, download size in bytes)
+        self.table: Dict[int, Tuple[str, Optional[int]]] = {}
+        self.current: Optional[TransactionProgress] = None
+        self.refs_count = 0
+
+    def feed(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+
+        match = re.match(_TABLE_ROW, line)
+        if match:
+            self.parse_table_row(int(match.group(1)), match.group(2))
+            return
+
+        match = re.match(_PROGRESS, line)
+        if match:
+            operation, index, total, percent, speed = match.groups()
+            self.set_current(int(index), int(total), _OPERATIONS[operation])
+
+            if percent:
+                self.current.percent = min(100, int(percent))
+
+            if speed:
+                self.current.speed = speed
+
+            if self.current.bytes_total:
+                self.current.bytes_done = round(self.current.bytes_total * self.current.percent / 100)
+
+            self.emit()
+            return
+
+        match = re.match(_REF, line)
+        if match:
+            self.refs_count += 1
+            ref = match.group(2).split('/', maxsplit=1)[1]
+            self.set_current(self.refs_count, max(self.refs_count, len(self.table)), _OPERATIONS[match.group(1)], ref)
+
+    def parse_table_row(self, index: int, row: str):
+        # the first column is the id, in the fancy output a status column like "[✓]" or "[ ]" comes before it
+        row = re.sub(_STATUS_CELL, '', row)
+        columns = [c for c in re.split(r'\s+', row) if c]
+        if not columns:
+            return
+
+        ref = columns[0]
+        size = re.search(_DOWNLOAD_SIZE, row)
+
+        self.table[index] = (ref, parse_size(size.group(1)) if size else None)
+
+    def set_current(self, index: int, total: int, operation: str, ref: Optional[str]=None):
+        if self.current and self.current.index == index:
+            return
+
+        self.finish_current()
+
+        table_ref, size = self.table.get(index, (ref or '', None))
+        self.current = TransactionProgress(ref or table_ref, operation, index, total)
+        self.current.bytes_total = size
+
+        self.emit(force=True)
+
+    def finish_current(self):
+        if self.current and not self.current.finished:
+            self.current.finished = True
+            self.current.percent = 100
+
+            if self.current.bytes_total:
+                self.current.bytes_done = self.current.bytes_total
+
+            self.emit(force=True)
+
+    def finish(self):
+        """Called when the transaction completes successfully"""
+        self.finish_current()
+
+    def emit(self, force=False):
+        if not self.on_progress or not self.current:
+            return
+
+        now = time.monotonic()
+        if not force and (now - self.last_emit < self.interval):
+            return
+
+        self.last_emit = now
+        self.on_progress(copy.copy(self.current))
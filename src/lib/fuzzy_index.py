@@ -0,0 +1,113 @@
+import re
+import sys
+from array import array
+from typing import Dict, List, Tuple
+
+# Rough size of the python objects kept for each indexed key, used to enforce the memory budget
+_KEY_OVERHEAD_BYTES = 120
+
+
+def _normalize(text: str) -> List[str]:
+    return re.findall(r'[0-9a-z]+', text.lower())
+
+
+def _trigrams(word: str) -> List[str]:
+    padded = f' {word} '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, gives up and returns max_distance + 1 as soon as it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+
+        if min(current) > max_distance:
+            return max_distance + 1
+
+        previous = current
+
+    return previous[-1]
+
+
+class TrigramIndex():
+    """
+        A typo tolerant index: every word of the indexed texts is split into trigrams
+        and each trigram points to the list of keys containing it.
+        Candidates are the keys sharing the most trigrams with the query, then ranked by edit distance.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.keys: List[str] = []
+        self.words: List[Tuple[str, ...]] = []
+        self.postings: Dict[str, array] = {}
+        self.full = False
+
+    def add(self, key: str, text: str) -> bool:
+        """Adds a key to the index, returns False if the memory budget has been reached"""
+        if self.full:
+            return False
+
+        words = tuple(set(_normalize(text)))
+        grams = set([g for w in words for g in _trigrams(w)])
+
+        cost = _KEY_OVERHEAD_BYTES + sys.getsizeof(key) + sum([sys.getsizeof(w) for w in words]) + (len(grams) * 4)
+        if (self.size_bytes + cost) > self.max_bytes:
+            self.full = True
+            return False
+
+        doc_id = len(self.keys)
+        self.keys.append(key)
+        self.words.append(words)
+
+        for g in grams:
+            if not g in self.postings:
+                self.postings[g] = array('I')
+                self.size_bytes += _KEY_OVERHEAD_BYTES
+
+            self.postings[g].append(doc_id)
+
+        self.size_bytes += cost
+        return True
+
+    def search(self, query: str, limit=20, max_candidates=200) -> List[Tuple[str, int]]:
+        """Returns a list of (key, distance) tuples, best matches first"""
+        query_words = _normalize(query)
+        if not query_words:
+            return []
+
+        # only the posting lists of the query trigrams are visited
+        overlap: Dict[int, int] = {}
+        for w in query_words:
+            for g in set(_trigrams(w)):
+                for doc_id in self.postings.get(g, ()):
+                    overlap[doc_id] = overlap.get(doc_id, 0) + 1
+
+        candidates = sorted(overlap.items(), key=lambda o: o[1], reverse=True)[0:max_candidates]
+
+        results: List[Tuple[str, int, int]] = []
+        for doc_id, shared_grams in candidates:
+            total_distance = 0
+
+            for qw in query_words:
+                max_distance = max(1, len(qw) // 4)
+                best = min([edit_distance(qw, w, max_distance) for w in self.words[doc_id]] or [max_distance + 1])
+
+                if best > max_distance:
+                    total_distance = -1
+                    break
+
+                total_distance += best
+
+            if total_distance >= 0:
+                results.append((self.keys[doc_id], total_distance, shared_grams))
+
+        results.sort(key=lambda r: (r[1], -r[2]))
+        return [(key, distance) for key, distance, shared_grams in results[0:limit]]
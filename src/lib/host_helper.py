@@ -0,0 +1,205 @@
+import os
+import time
+import json
+import struct
+import logging
+import threading
+import subprocess
+from typing import Callable, Dict, List, Optional
+from .utils import log
+
+# How many times in a row the helper is allowed to die before
+# we stop using it and go back to one flatpak-spawn per command
+MAX_FAILED_STARTS = 3
+
+# how often, in seconds, a request checks if it has been cancelled while waiting for its command
+CANCELLATION_CHECK_INTERVAL = 0.05
+
+
+class HostHelperError(Exception):
+    """The request never reached the helper, the command can safely be run in another way"""
+    pass
+
+
+class HostHelperExitedError(subprocess.SubprocessError):
+    """The helper exited after receiving the request: the command may have run, so it must not be run again"""
+    pass
+
+
+class CommandCancelledError(subprocess.SubprocessError):
+    """The command was killed because its caller doesn't need the result anymore"""
+    def __init__(self, cmd: List[str]):
+        super().__init__(f'Command {cmd} was cancelled')
+        self.cmd = cmd
+
+
+class _PendingRequest():
+    def __init__(self, process: subprocess.Popen):
+        self.process = process
+        self.event = threading.Event()
+        self.response: Optional[Dict] = None
+
+
+class HostHelper():
+    """
+        A long-lived python process started on the host with a single flatpak-spawn call.
+        Commands are sent to it through its stdin and the results are read from its stdout
+        (see host_helper_server.py), so that every command doesn't pay the D-Bus round trip.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.process: Optional[subprocess.Popen] = None
+        self.pending: Dict[int, _PendingRequest] = {}
+        self.next_id = 0
+        self.failed_starts = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        return self.enabled and (self.failed_starts < MAX_FAILED_STARTS)
+
+    def run(self, args: List[str], timeout: Optional[float]=None, is_cancelled: Optional[Callable[[], bool]]=None) -> subprocess.CompletedProcess:
+        try:
+            return self._request(args, timeout, is_cancelled)
+        except HostHelperError as e:
+            # the helper died before our request could be sent, try once more with a fresh one
+            log(f'Host helper failed ({e}), restarting it')
+            return self._request(args, timeout, is_cancelled)
+
+    def stop(self):
+        with self.lock:
+            if self.process:
+                process = self.process
+                self.process = None
+                process.stdin.close()
+
+    def _write_frame(self, process: subprocess.Popen, payload: Dict):
+        data = json.dumps(payload).encode('utf-8')
+
+        with self.write_lock:
+            process.stdin.write(struct.pack('>I', len(data)) + data)
+            process.stdin.flush()
+
+    def _cancel(self, process: subprocess.Popen, request_id: int):
+        log(f'Cancelling host helper request {request_id}')
+
+        try:
+            self._write_frame(process, {'id': request_id, 'cancel': True})
+        except (OSError, ValueError) as e:
+            # the helper is gone, and so is the command
+            logging.warning(f'Cannot cancel host helper request {request_id}: {e}')
+
+    def _ensure_started(self) -> subprocess.Popen:
+        with self.lock:
+            if self.process and (self.process.poll() is None):
+                return self.process
+
+            if not self.is_available():
+                raise HostHelperError('Host helper is not available')
+
+            with open(os.path.join(os.path.dirname(__file__), 'host_helper_server.py'), 'r') as f:
+                source = f.read()
+
+            log('Starting host helper')
+            self.process = subprocess.Popen(
+                ['flatpak-spawn', '--host', 'python3', '-c', source],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+
+            threading.Thread(target=self._read_responses, args=(self.process, ), daemon=True).start()
+            return self.process
+
+    def _request(self, args: List[str], timeout: Optional[float]=None, is_cancelled: Optional[Callable[[], bool]]=None) -> subprocess.CompletedProcess:
+        process = self._ensure_started()
+        pending = _PendingRequest(process)
+
+        with self.lock:
+            self.next_id += 1
+            request_id = self.next_id
+            self.pending[request_id] = pending
+
+        try:
+            self._write_frame(process, {'id': request_id, 'args': args})
+        except (OSError, ValueError) as e:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+            raise HostHelperError(str(e))
+
+        deadline = (time.monotonic() + timeout) if (timeout is not None) else None
+
+        while not pending.event.is_set():
+            cancelled = bool(is_cancelled and is_cancelled())
+            remaining = (deadline - time.monotonic()) if (deadline is not None) else None
+
+            if cancelled or ((remaining is not None) and remaining <= 0):
+                with self.lock:
+                    self.pending.pop(request_id, None)
+
+                # only the command is killed, the other requests keep running in the same helper
+                self._cancel(process, request_id)
+
+                if cancelled:
+                    raise CommandCancelledError(args)
+
+                raise subprocess.TimeoutExpired(args, timeout, '', '')
+
+            wait_time = remaining
+            if is_cancelled:
+                wait_time = CANCELLATION_CHECK_INTERVAL if (remaining is None) else min(remaining, CANCELLATION_CHECK_INTERVAL)
+
+            pending.event.wait(wait_time)
+
+        if pending.response is None:
+            raise HostHelperExitedError('Host helper exited while running the command')
+
+        # a request went through, the helper works on this host
+        self.failed_starts = 0
+
+        return subprocess.CompletedProcess(
+            args,
+            pending.response['returncode'],
+            pending.response['stdout'],
+            pending.response['stderr']
+        )
+
+    def _read_responses(self, process: subprocess.Popen):
+        while True:
+            try:
+                header = process.stdout.read(4)
+                if len(header) < 4:
+                    break
+
+                (size, ) = struct.unpack('>I', header)
+                response = json.loads(process.stdout.read(size).decode('utf-8'))
+            except Exception as e:
+                logging.error(e)
+                break
+
+            with self.lock:
+                pending = self.pending.pop(response['id'], None)
+
+            if pending:
+                pending.response = response
+                pending.event.set()
+
+        process.wait()
+        logging.warning(f'Host helper exited with code {process.returncode}')
+
+        with self.lock:
+            if self.process is process:
+                self.process = None
+                self.failed_starts += 1
+
+            # wake up every request that was waiting for this process
+            orphans = [k for k, p in self.pending.items() if p.process is process]
+            orphans = [self.pending.pop(k) for k in orphans]
+
+        for pending in orphans:
+            pending.event.set()
+
+
+host_helper = HostHelper()
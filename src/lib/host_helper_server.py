@@ -0,0 +1,109 @@
+# This script is not imported by Boutique: its source is sent to the host with
+# `flatpak-spawn --host python3 -c`, so it must only depend on the standard library.
+#
+# Every message is a frame made of a 4 bytes big-endian length followed by a JSON payload.
+# Requests:  {"id": int, "args": [str, ...]}
+# Cancel:    {"id": int, "cancel": true}, kills the command started by the request with the same id
+# Responses: {"id": int, "returncode": int, "stdout": str, "stderr": str}
+
+import os
+import json
+import signal
+import struct
+import subprocess
+import sys
+import threading
+
+_write_lock = threading.Lock()
+
+# request id -> running process; ids of the requests cancelled before their process started
+_lock = threading.Lock()
+_processes = {}
+_cancelled = set()
+
+
+def read_frame(stream):
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+
+    (size, ) = struct.unpack('>I', header)
+    return json.loads(stream.read(size).decode('utf-8'))
+
+
+def write_frame(stream, payload):
+    data = json.dumps(payload).encode('utf-8')
+
+    with _write_lock:
+        stream.write(struct.pack('>I', len(data)) + data)
+        stream.flush()
+
+
+def kill(process):
+    # the command runs in its own process group, so that its children are killed too
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def cancel_request(request):
+    with _lock:
+        process = _processes.get(request['id'], None)
+
+        if not process:
+            _cancelled.add(request['id'])
+
+    if process:
+        kill(process)
+
+
+def run_request(request, stream):
+    try:
+        process = subprocess.Popen(request['args'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+
+        with _lock:
+            _processes[request['id']] = process
+            cancelled = request['id'] in _cancelled
+            _cancelled.discard(request['id'])
+
+        if cancelled:
+            kill(process)
+
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            with _lock:
+                _processes.pop(request['id'], None)
+
+        response = {
+            'id': request['id'],
+            'returncode': process.returncode,
+            'stdout': stdout.decode('utf-8', errors='replace'),
+            'stderr': stderr.decode('utf-8', errors='replace'),
+        }
+    except OSError as e:
+        response = {'id': request['id'], 'returncode': 127, 'stdout': '', 'stderr': str(e)}
+
+    write_frame(stream, response)
+
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    while True:
+        request = read_frame(stdin)
+        if request is None:
+            break
+
+        if request.get('cancel', False):
+            cancel_request(request)
+            continue
+
+        # requests are independent from each other, a slow command must not delay the others
+        threading.Thread(target=run_request, args=(request, stdout), daemon=True).start()
+
+
+if __name__ == '__main__':
+    main()
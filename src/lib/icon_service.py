@@ -0,0 +1,157 @@
+import os
+import logging
+import threading
+import concurrent.futures
+from typing import Callable, Dict, List, Optional
+from .utils import log
+from .command_metrics import http_request
+from gi.repository import GLib
+
+
+class IconService():
+    """
+        Downloads app icons with a fixed number of workers and a single keep-alive HTTP session.
+        Icons are saved on disk, by remote and app id, and evicted least recently used first
+        when the cache grows over max_cache_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_cache_bytes=50 * 1024 * 1024, workers=4):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='icons')
+        self.session = None
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self.cache_bytes: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.errors = 0
+
+    def get_cache_path(self, remote: str, app_id: str) -> str:
+        return f'{self.cache_dir}/{remote}/{app_id}.png'
+
+    def fetch(self, remote: str, app_id: str, url: str, callback: Callable[[Optional[str]], None]):
+        """Calls callback(path) in the main loop once the icon is on disk, or callback(None) if it could not be downloaded"""
+        path = self.get_cache_path(remote, app_id)
+
+        if os.path.exists(path):
+            # the modification time is used to sort icons by last use
+            os.utime(path)
+
+            with self.lock:
+                self.hits += 1
+
+            GLib.idle_add(callback, path)
+            return
+
+        with self.lock:
+            self.misses += 1
+
+            if path in self.in_flight:
+                self.in_flight[path].append(callback)
+                return
+
+            self.in_flight[path] = [callback]
+
+        self.executor.submit(self._download, url, path)
+
+    def _get_session(self):
+        with self.lock:
+            if not self.session:
+                import requests
+                self.session = requests.Session()
+
+            return self.session
+
+    def _download(self, url: str, path: str):
+        result: Optional[str] = None
+
+        try:
+            with http_request(url):
+                response = self._get_session().get(url, timeout=10)
+                response.raise_for_status()
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.part', 'wb') as f:
+                f.write(response.content)
+
+            os.replace(path + '.part', path)
+            result = path
+
+            with self.lock:
+                self.downloads += 1
+
+            self._add_to_cache_size(len(response.content))
+        except Exception as e:
+            logging.warning(f'Cannot download icon {url}: {e}')
+
+            with self.lock:
+                self.errors += 1
+
+        with self.lock:
+            callbacks = self.in_flight.pop(path, [])
+
+        for callback in callbacks:
+            GLib.idle_add(callback, result)
+
+    def _list_cached_files(self) -> List[os.DirEntry]:
+        output = []
+
+        if not os.path.isdir(self.cache_dir):
+            return output
+
+        for remote_entry in os.scandir(self.cache_dir):
+            if remote_entry.is_dir():
+                output.extend([e for e in os.scandir(remote_entry.path) if e.is_file()])
+
+        return output
+
+    def _add_to_cache_size(self, size: int):
+        with self.lock:
+            if self.cache_bytes is None:
+                self.cache_bytes = sum([e.stat().st_size for e in self._list_cached_files()])
+            else:
+                self.cache_bytes += size
+
+            if self.cache_bytes <= self.max_cache_bytes:
+                return
+
+            # remove the least recently used icons until we are comfortably under the limit
+            entries = sorted(self._list_cached_files(), key=lambda e: e.stat().st_mtime)
+            target = self.max_cache_bytes * 0.8
+
+            for entry in entries:
+                if self.cache_bytes <= target:
+                    break
+
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self.cache_bytes -= size
+                except OSError:
+                    pass
+
+            log(f'Icon cache evicted, {self.cache_bytes} bytes left')
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'errors': self.errors,
+                'cache_bytes': self.cache_bytes or 0,
+            }
+
+
+_icon_service: Optional[IconService] = None
+
+def get_icon_service() -> IconService:
+    global _icon_service
+
+    if not _icon_service:
+        _icon_service = IconService(f'{GLib.get_user_cache_dir()}/boutique/icons')
+
+    return _icon_service
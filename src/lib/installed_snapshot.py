@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+from typing import Any, Dict, List
+from ..models.AppListElement import AppListElement, InstalledStatus
+from gi.repository import GLib
+
+# bump this when the format changes, older snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+_BASE_ATTRIBUTES = ['name', 'description', 'id', 'provider', 'installed_status', 'size', 'alt_sources', 'extra_data']
+
+
+def get_snapshot_path() -> str:
+    return f'{GLib.get_user_cache_dir()}/boutique/installed-apps.json'
+
+
+def _is_serializable(value: Any) -> bool:
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def serialize(el: AppListElement) -> Dict:
+    # provider specific attributes, like the file path of an AppImage, are saved as well;
+    # the ones that can't be saved (e.g. a parsed desktop entry) are restored as None
+    attributes = {}
+    for k, v in vars(el).items():
+        if not k in _BASE_ATTRIBUTES:
+            attributes[k] = v if _is_serializable(v) else None
+
+    return {
+        'name': el.name,
+        'description': el.description,
+        'id': el.id,
+        'provider': el.provider,
+        'installed_status': el.installed_status.name,
+        'extra_data': dict([(k, v) for k, v in el.extra_data.items() if _is_serializable(v)]),
+        'attributes': attributes,
+    }
+
+
+def deserialize(data: Dict) -> AppListElement:
+    el = AppListElement(data['name'], data['description'], data['id'], data['provider'], InstalledStatus[data['installed_status']], **data['extra_data'])
+
+    for k, v in data['attributes'].items():
+        setattr(el, k, v)
+
+    return el
+
+
+def get_key(el: AppListElement) -> tuple:
+    """Identifies the same installed app across snapshots"""
+    return (el.provider, el.id, getattr(el, 'file_path', None) or el.extra_data.get('ref', None))
+
+
+def get_fingerprint(el: AppListElement) -> str:
+    """Changes whenever something displayed in the list changes"""
+    return json.dumps(serialize(el), sort_keys=True)
+
+
+def save(elements: List[AppListElement]):
+    path = get_snapshot_path()
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path + '.part', 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'apps': [serialize(el) for el in elements]}, f)
+
+        os.replace(path + '.part', path)
+    except Exception as e:
+        logging.warning(f'Cannot save the installed apps snapshot: {e}')
+
+
+def load() -> List[AppListElement]:
+    try:
+        with open(get_snapshot_path(), 'r') as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('version', None) != SNAPSHOT_VERSION:
+            return []
+
+        return [deserialize(data) for data in snapshot['apps']]
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        logging.warning(f'Cannot load the installed apps snapshot: {e}')
+        return []
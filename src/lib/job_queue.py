@@ -0,0 +1,224 @@
+import time
+import logging
+import threading
+import contextvars
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+from gi.repository import GObject, GLib
+from .utils import log
+
+# Every change to an installation (install, update, downgrade, remove...) goes through this queue.
+# Jobs of the same domain, like "flatpak", run one at a time in the order of their priority,
+# so that two transactions never fight for the repository lock; different domains run in parallel.
+
+PRIORITY_LOW = -10
+PRIORITY_DEFAULT = 0
+PRIORITY_HIGH = 10
+
+
+class JobState(Enum):
+    QUEUED = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+    CANCELLED = 5
+
+
+class Job():
+    """
+        A unit of work for the queue: `run` receives the list of jobs it has to complete,
+        which contains more than this job when compatible jobs are batched together, and returns True on success.
+        Jobs with `batchable` set are batched with the queued jobs of the same domain and kind that have the same `run`.
+    """
+
+    def __init__(self, domain: str, kind: str, ref: str, run: Callable[[List['Job']], bool],
+            priority=PRIORITY_DEFAULT, batchable=False, title: Optional[str]=None):
+
+        self.domain = domain
+        self.kind = kind
+        self.ref = ref
+        self.run = run
+        self.priority = priority
+        self.batchable = batchable
+        self.title = title or ref
+        self.state = JobState.QUEUED
+        self.created_at = time.time()
+        self.error: Optional[str] = None
+
+        # when the same job is submitted again, its callbacks are added to the existing one
+        self.callbacks: List[Callable[[bool], None]] = []
+        self.progress_callbacks: List[Callable[[Any], None]] = []
+
+        # the job runs with the context of the code that submitted it, see command_metrics.action()
+        self.context = contextvars.copy_context()
+        self.seq = 0
+
+    def get_key(self) -> tuple:
+        return (self.domain, self.kind, self.ref)
+
+    def add_callback(self, callback: Optional[Callable[[bool], None]]):
+        if callback:
+            self.callbacks.append(callback)
+
+    def add_progress_callback(self, on_progress: Optional[Callable[[Any], None]]):
+        if on_progress:
+            self.progress_callbacks.append(on_progress)
+
+    def report_progress(self, progress: Any):
+        for on_progress in self.progress_callbacks:
+            on_progress(progress)
+
+    def to_dict(self) -> dict:
+        return {
+            'domain': self.domain,
+            'kind': self.kind,
+            'ref': self.ref,
+            'title': self.title,
+            'state': self.state.name.lower(),
+            'priority': self.priority,
+            'error': self.error,
+        }
+
+
+class JobQueue(GObject.Object):
+    __gsignals__ = {
+        # emitted in the main loop every time a job changes state
+        "job-changed": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object, )),
+    }
+
+    def __init__(self):
+        super().__init__()
+
+        self.queued: Dict[str, List[Job]] = {}
+        self.running: Dict[str, List[Job]] = {}
+        self.workers: Dict[str, threading.Thread] = {}
+        self.condition = threading.Condition()
+        self.seq = 0
+
+    def submit(self, job: Job, callback: Optional[Callable[[bool], None]]=None, on_progress: Optional[Callable[[Any], None]]=None) -> Job:
+        """
+            Queues a job, or returns the one already queued or running for the same domain, kind and ref.
+            Callbacks are called in the worker thread with the result; they are not called if the job is cancelled.
+        """
+        with self.condition:
+            existing = self.find(*job.get_key())
+
+            if existing:
+                existing.add_callback(callback)
+                existing.add_progress_callback(on_progress)
+                existing.priority = max(existing.priority, job.priority)
+
+                log(f'Job {job.kind} {job.ref} is already {existing.state.name.lower()}, merged')
+                return existing
+
+            self.seq += 1
+            job.seq = self.seq
+            job.add_callback(callback)
+            job.add_progress_callback(on_progress)
+
+            self.queued.setdefault(job.domain, []).append(job)
+            self.start_worker(job.domain)
+            self.condition.notify_all()
+
+        self.notify_changed(job)
+        return job
+
+    def find(self, domain: str, kind: str, ref: str) -> Optional[Job]:
+        with self.condition:
+            for job in [*self.running.get(domain, []), *self.queued.get(domain, [])]:
+                if job.get_key() == (domain, kind, ref):
+                    return job
+
+        return None
+
+    def cancel(self, job: Job) -> bool:
+        """Removes a job from the queue, jobs that are already running can't be cancelled"""
+        with self.condition:
+            if job.state != JobState.QUEUED:
+                return False
+
+            self.queued[job.domain].remove(job)
+            job.state = JobState.CANCELLED
+
+        log(f'Job {job.kind} {job.ref} cancelled')
+        self.notify_changed(job)
+        return True
+
+    def get_jobs(self) -> List[Job]:
+        """The running jobs, followed by the queued ones in the order they will run"""
+        with self.condition:
+            output = []
+            for domain in set([*self.running.keys(), *self.queued.keys()]):
+                output.extend(self.running.get(domain, []))
+                output.extend(sorted(self.queued.get(domain, []), key=self._sort_key))
+
+            return output
+
+    def start_worker(self, domain: str):
+        if domain in self.workers:
+            return
+
+        self.workers[domain] = threading.Thread(target=self._work, args=(domain, ), daemon=True, name=f'jobs-{domain}')
+        self.workers[domain].start()
+
+    def _sort_key(self, job: Job) -> tuple:
+        return (-job.priority, job.seq)
+
+    def _next_batch(self, domain: str) -> List[Job]:
+        queued = sorted(self.queued.get(domain, []), key=self._sort_key)
+        if not queued:
+            return []
+
+        batch = [queued[0]]
+        if queued[0].batchable:
+            batch.extend([j for j in queued[1:] if j.batchable and (j.kind == queued[0].kind) and (j.run == queued[0].run)])
+
+        for job in batch:
+            self.queued[domain].remove(job)
+            job.state = JobState.RUNNING
+
+        return batch
+
+    def _work(self, domain: str):
+        while True:
+            with self.condition:
+                while not self.queued.get(domain, None):
+                    self.condition.wait()
+
+                batch = self._next_batch(domain)
+                self.running[domain] = batch
+
+            for job in batch:
+                self.notify_changed(job)
+
+            log(f'Running {batch[0].kind} job for {", ".join([j.ref for j in batch])}')
+            success = False
+
+            try:
+                success = bool(batch[0].context.run(batch[0].run, batch))
+            except Exception as e:
+                logging.error(f'Job {batch[0].kind} {batch[0].ref} failed: {e}')
+
+                for job in batch:
+                    job.error = str(e)
+
+            with self.condition:
+                self.running[domain] = []
+
+                for job in batch:
+                    job.state = JobState.DONE if success else JobState.FAILED
+
+            for job in batch:
+                self.notify_changed(job)
+
+                for callback in job.callbacks:
+                    try:
+                        callback(success)
+                    except Exception as e:
+                        logging.error(e)
+
+    def notify_changed(self, job: Job):
+        GLib.idle_add(self.emit, 'job-changed', job)
+
+
+job_queue = JobQueue()
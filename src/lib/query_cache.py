@@ -0,0 +1,160 @@
+import sys
+import copy
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from .utils import log
+
+
+def _deep_sizeof(value: Any, seen: set) -> int:
+    if id(value) in seen:
+        return 0
+
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum([_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in value.items()])
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum([_deep_sizeof(v, seen) for v in value])
+    elif hasattr(value, '__dict__'):
+        size += _deep_sizeof(value.__dict__, seen)
+
+    return size
+
+
+def _copy_value(value: Any) -> Any:
+    """Copies the lists and dicts of a cached value, so that callers can modify what they get without touching the cache"""
+    if isinstance(value, dict):
+        return dict([(k, _copy_value(v)) for k, v in value.items()])
+    elif isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    elif isinstance(value, (str, bytes, int, float, bool, tuple, type(None))):
+        return value
+
+    return copy.copy(value)
+
+
+class _CacheEntry():
+    def __init__(self, value: Any, expires_at: Optional[float], tokens: Tuple[str, ...], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.tokens = tokens
+        self.size = size
+
+
+class QueryCache():
+    """
+        Stores the result of expensive queries.
+        Every entry can expire after a given ttl (in seconds) and is tagged with a list of
+        invalidation tokens: calling invalidate(token) drops every entry tagged with it.
+        Callers always get their own copy of the cached lists and dicts
+    """
+
+    def __init__(self):
+        self.entries: Dict[Any, _CacheEntry] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+
+        # incremented every time a token is invalidated, or the cache is cleared:
+        # a value computed while one of its tokens changed is returned but not stored
+        self.generations: Dict[Optional[str], int] = {}
+
+    def _get_generation(self, tokens: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple([self.generations.get(t, 0) for t in (None, *tokens)])
+
+    def get(self, key: Any, compute: Callable[[], Any], ttl: Optional[float]=None, tokens: Iterable[str]=()) -> Any:
+        tokens = tuple(tokens)
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            hit = entry and ((entry.expires_at is None) or (entry.expires_at > time.monotonic()))
+
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                generation = self._get_generation(tokens)
+
+        # copied outside of the lock, the stored value is never modified
+        if hit:
+            return _copy_value(entry.value)
+
+        value = compute()
+
+        # measured once, in the thread that computed the value, so that reading the size is free
+        size = _deep_sizeof(value, set())
+
+        with self.lock:
+            if self._get_generation(tokens) != generation:
+                return value
+
+            self._evict_expired()
+
+            if key in self.entries:
+                self.size_bytes -= self.entries.pop(key).size
+
+            expires_at = (time.monotonic() + ttl) if ttl else None
+            self.entries[key] = _CacheEntry(value, expires_at, tokens, size)
+            self.size_bytes += size
+
+        return _copy_value(value)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+
+        for k in [k for k, e in self.entries.items() if (e.expires_at is not None) and (e.expires_at <= now)]:
+            self.size_bytes -= self.entries.pop(k).size
+
+    def invalidate(self, *tokens: str):
+        with self.lock:
+            to_remove = [k for k, e in self.entries.items() if set(tokens).intersection(e.tokens)]
+
+            for k in to_remove:
+                self.size_bytes -= self.entries.pop(k).size
+
+            for token in tokens:
+                self.generations[token] = self.generations.get(token, 0) + 1
+
+            self.invalidations += 1
+
+        log(f'Cache invalidated: {", ".join(tokens)} ({len(to_remove)} entries)')
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_bytes = 0
+            self.generations[None] = self.generations.get(None, 0) + 1
+
+    def estimate_size(self) -> int:
+        """An estimate of the memory used by the cached values, in bytes; values shared by several entries are counted more than once"""
+        with self.lock:
+            return self.size_bytes
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+def cached(cache: QueryCache, ttl: Optional[float]=None, tokens: Iterable[str]=()):
+    """Decorator, caches the return value of a function by its arguments"""
+    tokens = tuple(tokens)
+
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: func(*args, **kwargs), ttl, tokens)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    return decorator
@@ -1,9 +1,14 @@
 import subprocess
 import re
+import codecs
+import time
 import asyncio
 import threading
-from typing import Callable, List, Union
+import contextvars
+from typing import Callable, List, Union, Optional
 from .utils import log
+from .host_helper import host_helper, HostHelperError, CommandCancelledError, CANCELLATION_CHECK_INTERVAL
+from . import command_trace, command_metrics, tracing
 
 _sanitizer = None
 def sanitize(_input: str) -> str:
@@ -14,14 +19,84 @@ def sanitize(_input: str) -> str:
 
     return re.sub(_sanitizer, " ", _input)
 
-def sh(command: Union[str, List[str]], return_stderr=False) -> str:
+# When set, commands are passed to this function instead of being run on the host;
+# it receives the command arguments and returns a CompletedProcess with str outputs
+_backend: Optional[Callable[[List[str]], subprocess.CompletedProcess]] = None
+
+def set_backend(backend: Optional[Callable[[List[str]], subprocess.CompletedProcess]]):
+    global _backend
+    _backend = backend
+
+def _command_args(command: Union[str, List[str]]) -> List[str]:
+    return command.split(' ') if isinstance(command, str) else [*command]
+
+def _host_command(command: Union[str, List[str]]) -> List[str]:
+    return ['flatpak-spawn', '--host', *_command_args(command)]
+
+def _run_on_host(command: Union[str, List[str]], timeout: Optional[float]=None, is_cancelled: Optional[Callable[[], bool]]=None) -> subprocess.CompletedProcess:
+    started_at = time.monotonic()
+    output = _run(command, timeout, is_cancelled)
+
+    _on_command_done(_command_args(command), started_at, output)
+    return output
+
+def _on_command_done(args: List[str], started_at: float, output: subprocess.CompletedProcess):
+    duration_ms = (time.monotonic() - started_at) * 1000
+    log(f'{" ".join(args)} exited with {output.returncode} in {round(duration_ms)}ms')
+
+    command_metrics.record_command(args, duration_ms, output.returncode != 0)
+    tracing.add_span(command_metrics.get_command_class(args), 'subprocess', started_at, args={'command': ' '.join(args), 'returncode': output.returncode})
+    command_trace.record(args, started_at, output)
+
+def _run(command: Union[str, List[str]], timeout: Optional[float]=None, is_cancelled: Optional[Callable[[], bool]]=None) -> subprocess.CompletedProcess:
+    if _backend:
+        return _backend(_command_args(command))
+
+    if host_helper.is_available():
+        try:
+            return host_helper.run(_command_args(command), timeout, is_cancelled)
+        except HostHelperError as e:
+            log(f'Host helper unavailable: {e}')
+
+    if not is_cancelled:
+        return subprocess.run(_host_command(command), encoding='utf-8', shell=False, capture_output=True, timeout=timeout)
+
+    return _run_cancellable(_host_command(command), timeout, is_cancelled)
+
+def _run_cancellable(cmd: List[str], timeout: Optional[float], is_cancelled: Callable[[], bool]) -> subprocess.CompletedProcess:
+    """Like subprocess.run(), but the process is killed as soon as is_cancelled() returns True"""
+    deadline = (time.monotonic() + timeout) if (timeout is not None) else None
+
+    with subprocess.Popen(cmd, encoding='utf-8', stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CANCELLATION_CHECK_INTERVAL)
+                return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                pass
+
+            # flatpak-spawn forwards SIGTERM to the command running on the host, a SIGKILL would leave it running
+            if is_cancelled():
+                process.terminate()
+                process.communicate()
+                raise CommandCancelledError(cmd)
+
+            if (deadline is not None) and (time.monotonic() > deadline):
+                process.terminate()
+                stdout, stderr = process.communicate()
+                raise subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+
+def sh(command: Union[str, List[str]], return_stderr=False, timeout: Optional[float]=None, is_cancelled: Optional[Callable[[], bool]]=None) -> str:
+    """
+        Runs a command on the host and returns its stdout. The command is killed when `timeout` (in seconds) expires,
+        raising subprocess.TimeoutExpired, or as soon as is_cancelled() returns True, raising CommandCancelledError
+    """
     to_check = command if isinstance(command, str) else ' '.join(command)
 
     try:
         log(f'Running {command}')
 
-        cmd = f'flatpak-spawn --host {command}'.split(' ') if isinstance(command, str) else ['flatpak-spawn', '--host', *command]
-        output = subprocess.run(cmd, encoding='utf-8', shell=False, check=True, capture_output=True)
+        output = _run_on_host(command, timeout, is_cancelled)
         output.check_returncode()
     except subprocess.CalledProcessError as e:
         print(e.stderr)
@@ -47,5 +122,107 @@ def threaded_sh(command: Union[str, List[str]], callback: Callable[[str], None]=
             log(e.stderr)
             raise e
 
-    thread = threading.Thread(target=run_command, daemon=True, args=(command, callback, ))
-    thread.start()
\ No newline at end of file
+    # the thread inherits the context, so that the command is attributed to the current action
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, daemon=True, args=(run_command, command, callback, ))
+    thread.start()
+
+# progress bars are redrawn with \r, so a carriage return ends a line too
+_line_separator = re.compile(r'\r\n|\r|\n')
+
+async def _read_stream(stream: asyncio.StreamReader, chunks: List[str], on_line: Optional[Callable[[str], None]]):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+
+    while True:
+        data = await stream.read(4096)
+        if not data:
+            break
+
+        text = decoder.decode(data)
+        chunks.append(text)
+
+        if on_line:
+            lines = re.split(_line_separator, pending + text)
+            pending = lines.pop()
+
+            for line in lines:
+                on_line(line)
+
+    if on_line and pending:
+        on_line(pending)
+
+async def async_sh(command: Union[str, List[str]], return_stderr=False, timeout: Optional[float]=None,
+        on_stdout: Optional[Callable[[str], None]]=None, on_stderr: Optional[Callable[[str], None]]=None) -> str:
+    """
+        Coroutine version of sh(): stdout and stderr are streamed line by line to the optional callbacks,
+        the process is killed when `timeout` (in seconds) expires or when the awaiting task is cancelled.
+    """
+    log(f'Running async {command}')
+
+    if _backend:
+        return await _async_sh_backend(command, return_stderr, timeout, on_stdout, on_stderr)
+
+    started_at = time.monotonic()
+    cmd = _host_command(command)
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+    stdout: List[str] = []
+    stderr: List[str] = []
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                _read_stream(process.stdout, stdout, on_stdout),
+                _read_stream(process.stderr, stderr, on_stderr),
+                process.wait()
+            ),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout, ''.join(stdout), ''.join(stderr))
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        raise
+
+    _on_command_done(_command_args(command), started_at, subprocess.CompletedProcess(cmd, process.returncode, ''.join(stdout), ''.join(stderr)))
+
+    if process.returncode != 0:
+        error = subprocess.CalledProcessError(process.returncode, cmd, ''.join(stdout), ''.join(stderr))
+        print(error.stderr)
+
+        if return_stderr:
+            return error.output
+
+        raise error
+
+    return re.sub(r'\n$', '', ''.join(stdout))
+
+async def _async_sh_backend(command: Union[str, List[str]], return_stderr: bool, timeout: Optional[float],
+        on_stdout: Optional[Callable[[str], None]], on_stderr: Optional[Callable[[str], None]]) -> str:
+    loop = asyncio.get_running_loop()
+    started_at = time.monotonic()
+    output = await asyncio.wait_for(loop.run_in_executor(None, _backend, _command_args(command)), timeout)
+    _on_command_done(_command_args(command), started_at, output)
+
+    for stream, on_line in [(output.stdout, on_stdout), (output.stderr, on_stderr)]:
+        if on_line and stream:
+            for line in re.split(_line_separator, stream.rstrip('\n')):
+                on_line(line)
+
+    if output.returncode != 0:
+        if return_stderr:
+            return output.stdout
+
+        output.check_returncode()
+
+    return re.sub(r'\n$', '', output.stdout)
+
+def _kill(process: asyncio.subprocess.Process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,79 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from .tracing import span
+from gi.repository import Gdk, GdkPixbuf
+
+
+class TextureCache():
+    """
+        Keeps decoded icons in memory, so that the same file is decoded once
+        and shared by every widget showing it. The least recently used textures
+        are dropped when the decoded size goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.textures: OrderedDict[Tuple, Tuple[Gdk.Texture, int]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_from_file(self, path: str, size: int) -> Optional[Gdk.Texture]:
+        try:
+            # the modification time is part of the key, so an updated icon is decoded again
+            key = (path, size, os.stat(path).st_mtime_ns)
+        except OSError:
+            return None
+
+        with self.lock:
+            if key in self.textures:
+                self.hits += 1
+                self.textures.move_to_end(key)
+                return self.textures[key][0]
+
+            self.misses += 1
+
+        try:
+            with span('decode icon', 'icon', {'path': path, 'size': size}):
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, size, size)
+                texture = Gdk.Texture.new_for_pixbuf(pixbuf)
+        except Exception as e:
+            logging.warning(f'Cannot decode {path}: {e}')
+            return None
+
+        texture_bytes = pixbuf.get_rowstride() * pixbuf.get_height()
+
+        with self.lock:
+            if not key in self.textures:
+                self.textures[key] = (texture, texture_bytes)
+                self.size_bytes += texture_bytes
+
+            while (self.size_bytes > self.max_bytes) and (len(self.textures) > 1):
+                _, (_, evicted_bytes) = self.textures.popitem(last=False)
+                self.size_bytes -= evicted_bytes
+
+        return texture
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.textures),
+                'size_bytes': self.size_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_texture_cache: Optional[TextureCache] = None
+
+def get_texture_cache() -> TextureCache:
+    global _texture_cache
+
+    if not _texture_cache:
+        _texture_cache = TextureCache()
+
+    return _texture_cache
@@ -0,0 +1,154 @@
+import json
+import time
+import atexit
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from .utils import log
+from gi.repository import GLib
+
+# Records spans of a Boutique session (provider calls, subprocesses, HTTP requests,
+# icon decodes, idle callbacks...) in the Chrome trace event format, which can be
+# opened with chrome://tracing or https://ui.perfetto.dev
+#
+# Tracing is off by default, when it is off every function of this module does nothing.
+
+MAX_EVENTS = 500000
+
+enabled = False
+_events: List[dict] = []
+_thread_names: Dict[int, str] = {}
+_lock = threading.Lock()
+_started_at = time.monotonic()
+_path: Optional[str] = None
+_original_idle_add = GLib.idle_add
+
+
+def _to_us(t: float) -> float:
+    return round((t - _started_at) * 1000000, 1)
+
+
+def _add_event(event: dict):
+    thread = threading.current_thread()
+
+    with _lock:
+        if len(_events) >= MAX_EVENTS:
+            return
+
+        _thread_names[thread.ident] = thread.name
+        _events.append(event)
+
+
+def add_span(name: str, category: str, started_at: float, ended_at: Optional[float]=None, args: Optional[dict]=None):
+    """Adds a span, the times are the ones returned by time.monotonic()"""
+    if not enabled:
+        return
+
+    _add_event({
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': _to_us(started_at),
+        'dur': round(((ended_at or time.monotonic()) - started_at) * 1000000, 1),
+        'pid': 1,
+        'tid': threading.get_ident(),
+        'args': args or {},
+    })
+
+
+def instant(name: str, category: str, args: Optional[dict]=None):
+    if not enabled:
+        return
+
+    _add_event({'name': name, 'cat': category, 'ph': 'i', 's': 't', 'ts': _to_us(time.monotonic()), 'pid': 1, 'tid': threading.get_ident(), 'args': args or {}})
+
+
+@contextmanager
+def span(name: str, category='app', args: Optional[dict]=None):
+    if not enabled:
+        yield
+        return
+
+    started_at = time.monotonic()
+
+    try:
+        yield
+    finally:
+        add_span(name, category, started_at, args=args)
+
+
+def traced(name: str, category='app'):
+    """Decorator version of span()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(obj, category: str, prefix: str, names: List[str]):
+    """Replaces the given methods of an object with traced versions, without changing its type"""
+    if not enabled:
+        return
+
+    for name in names:
+        method = getattr(obj, name, None)
+        if callable(method):
+            setattr(obj, name, traced(f'{prefix}.{name}', category)(method))
+
+
+def _traced_idle_add(function: Callable, *args, **kwargs):
+    queued_at = time.monotonic()
+    name = getattr(function, '__qualname__', repr(function))
+
+    def run_idle(*args):
+        started_at = time.monotonic()
+
+        try:
+            return function(*args)
+        finally:
+            add_span(name, 'idle', started_at, args={'queued_ms': round((started_at - queued_at) * 1000, 3)})
+
+    return _original_idle_add(run_idle, *args, **kwargs)
+
+
+def start(path: str):
+    """Starts recording, the trace is written to `path` when Boutique exits"""
+    global enabled, _path
+
+    if enabled:
+        return
+
+    enabled = True
+    _path = path
+
+    # every GLib.idle_add() call in Boutique goes through here
+    GLib.idle_add = _traced_idle_add
+
+    atexit.register(save)
+    log(f'Tracing to {path}')
+
+
+def save():
+    if not _path:
+        return
+
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+
+    metadata = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'boutique'}}]
+    for tid, thread_name in thread_names.items():
+        metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread_name}})
+
+    try:
+        with open(_path, 'w') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+
+        log(f'Trace saved to {_path}, {len(events)} events')
+    except OSError as e:
+        logging.error(f'Cannot save the trace: {e}')
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import logging
+from typing import List, Optional, Set
+from gi.repository import GObject, GLib, Gio
+
+from ..providers.providers_list import providers
+from ..models.Models import AppUpdateElement
+from . import installed_snapshot
+from .utils import log, get_gsettings, send_notification
+from .async_utils import _async
+from .command_metrics import tracked
+
+# bump this when the format changes, older states are ignored
+STATE_VERSION = 1
+
+# the first scheduled check waits a bit, so that it does not slow down the startup
+STARTUP_DELAY = 30
+
+# after a failed check, like when the computer is offline, the next one waits at least this long
+RETRY_DELAY = 300
+
+
+def get_state_path() -> str:
+    return f'{GLib.get_user_cache_dir()}/boutique/updates.json'
+
+
+class UpdateChecker(GObject.Object):
+    """
+        Checks for updates every `updates-check-interval` minutes while Boutique is running.
+        The last result is kept in memory and saved to disk, so that it can be shown immediately,
+        even after a restart; a notification is sent when updates that were not seen before show up.
+    """
+
+    __gsignals__ = {
+        "updates-changed": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (object, )),
+        "checking": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, (bool, )),
+        # the last known updates are kept when a check fails
+        "check-failed": (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, ()),
+    }
+
+    def __init__(self):
+        super().__init__()
+
+        # None until the first check completes, or a saved state is loaded
+        self.updates: Optional[List[AppUpdateElement]] = None
+        self.checked_at = 0.0
+        self.notified_ids: Set[str] = set()
+        self.checking = False
+        self.failed = False
+        self.timeout_id: Optional[int] = None
+        self.settings: Optional[Gio.Settings] = None
+
+    def start(self):
+        self.load()
+
+        self.settings = get_gsettings()
+        self.settings.connect('changed::updates-check-interval', lambda settings, key: self.schedule())
+        self.schedule()
+
+    def get_interval(self) -> int:
+        """The interval between two checks in seconds, 0 if the automatic check is disabled"""
+        return self.settings.get_int('updates-check-interval') * 60 if self.settings else 0
+
+    def is_stale(self) -> bool:
+        interval = self.get_interval() or 3600
+        return (self.updates is None) or (time.time() - self.checked_at > interval)
+
+    def schedule(self):
+        if self.timeout_id:
+            GLib.source_remove(self.timeout_id)
+            self.timeout_id = None
+
+        interval = self.get_interval()
+        if interval <= 0:
+            return
+
+        delay = max(STARTUP_DELAY, self.checked_at + interval - time.time())
+        if self.failed:
+            delay = max(delay, min(interval, RETRY_DELAY))
+
+        self.timeout_id = GLib.timeout_add_seconds(int(delay), self.on_timeout)
+
+    def on_timeout(self):
+        self.timeout_id = None
+        self.check_now(notify=True)
+        return False
+
+    @tracked('check-updates')
+    def check_now(self, notify=False, refresh_remotes=True):
+        """Without refresh_remotes, the updates are only compared again with the installed refs, for example after a transaction"""
+        if self.checking:
+            return
+
+        self.checking = True
+        self.emit('checking', True)
+        self.check_updates(notify, refresh_remotes)
+
+    @_async
+    def check_updates(self, notify: bool, refresh_remotes: bool):
+        updatable_elements: List[AppUpdateElement] = []
+        failed = False
+
+        for p, provider in providers.items():
+            try:
+                if refresh_remotes:
+                    provider.invalidate_updatables()
+
+                apps = provider.list_installed()
+
+                for upg in provider.list_updatables():
+                    for a in apps:
+                        if (a.id == upg.id):
+                            upg.extra_data['app_list_element'] = a
+
+                            if a.extra_data and upg.to_version:
+                                if ('version' in a.extra_data) and (a.extra_data['version'] != upg.to_version):
+                                    upg.to_version = a.extra_data['version'] + ' > ' + upg.to_version
+
+                            updatable_elements.append(upg)
+                            break
+            except Exception as e:
+                logging.error(f'Cannot check for updates of {p}: {e}')
+                failed = True
+
+        GLib.idle_add(self.on_check_completed, updatable_elements, notify, failed)
+
+    def on_check_completed(self, updatable_elements: List[AppUpdateElement], notify: bool, failed: bool):
+        self.checking = False
+        self.failed = failed
+
+        if failed:
+            # an incomplete result would look like the updates have been installed, and be notified again later
+            log('Update check failed, the previous result is kept')
+
+            self.emit('checking', False)
+            self.emit('check-failed')
+            self.schedule()
+            return False
+
+        self.updates = updatable_elements
+        self.checked_at = time.time()
+
+        ids = set([upg.id for upg in updatable_elements])
+        new_updates = [upg for upg in updatable_elements if not upg.id in self.notified_ids]
+
+        if notify and new_updates:
+            self.send_updates_notification(new_updates)
+
+        # updates that are installed are forgotten, so they are notified again if they come back
+        self.notified_ids = ids
+        log(f'Update check completed, {len(updatable_elements)} updates, {len(new_updates)} new')
+
+        self.save()
+        self.emit('checking', False)
+        self.emit('updates-changed', updatable_elements)
+        self.schedule()
+
+        if updatable_elements:
+            self.prefetch_updates()
+
+        return False
+
+    def prefetch_updates(self):
+        if not (self.settings and self.settings.get_boolean('predownload-updates')):
+            return
+
+        if Gio.NetworkMonitor.get_default().get_network_metered():
+            log('Metered connection, the updates are not downloaded in advance')
+            return
+
+        max_bytes = self.settings.get_int('predownload-max-size') * 1000 * 1000
+        for p, provider in providers.items():
+            provider.prefetch_updates(max_bytes)
+
+    def send_updates_notification(self, new_updates: List[AppUpdateElement]):
+        application = Gio.Application.get_default()
+        window = application.get_active_window() if application else None
+
+        if window and window.is_active():
+            return
+
+        names = [upg.extra_data['app_list_element'].name for upg in new_updates]
+        body = ', '.join(names[0:5]) + (f' and {len(names) - 5} more' if len(names) > 5 else '')
+
+        notification = Gio.Notification.new('Updates available' if len(names) > 1 else 'An update is available')
+        notification.set_body(body)
+        notification.set_default_action('app.show_updates')
+
+        send_notification(notification, 'updates')
+
+    def save(self):
+        path = get_state_path()
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path + '.part', 'w') as f:
+                json.dump({
+                    'version': STATE_VERSION,
+                    'checked_at': self.checked_at,
+                    'notified': list(self.notified_ids),
+                    'updates': [{
+                        'id': upg.id,
+                        'size': upg.size,
+                        'to_version': upg.to_version,
+                        'app_list_element': installed_snapshot.serialize(upg.extra_data['app_list_element']),
+                    } for upg in self.updates or []],
+                }, f)
+
+            os.replace(path + '.part', path)
+        except Exception as e:
+            logging.warning(f'Cannot save the update state: {e}')
+
+    def load(self):
+        try:
+            with open(get_state_path(), 'r') as f:
+                state = json.load(f)
+
+            if state.get('version', None) != STATE_VERSION:
+                return
+
+            updates = []
+            for data in state['updates']:
+                upg = AppUpdateElement(data['id'], data['size'], data['to_version'])
+                upg.extra_data['app_list_element'] = installed_snapshot.deserialize(data['app_list_element'])
+                updates.append(upg)
+
+            self.updates = updates
+            self.checked_at = state['checked_at']
+            self.notified_ids = set(state['notified'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f'Cannot load the update state: {e}')
+
+
+update_checker = UpdateChecker()
@@ -3,8 +3,6 @@ import os
 import time
 import logging
 import gi
-import requests
-import hashlib
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
@@ -54,12 +52,18 @@ def cleanhtml(raw_html: str) -> str:
 
 
 def gtk_image_from_url(url: str, image: Gtk.Image) -> Gtk.Image:
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
+    import requests
+    from .tracing import span
+    from .command_metrics import http_request
 
-    loader = GdkPixbuf.PixbufLoader()
-    loader.write_bytes(GLib.Bytes.new(response.content))
-    loader.close()
+    with http_request(url):
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+
+    with span('decode image', 'icon', {'url': url}):
+        loader = GdkPixbuf.PixbufLoader()
+        loader.write_bytes(GLib.Bytes.new(response.content))
+        loader.close()
 
     image.clear()
     image.set_from_pixbuf(loader.get_pixbuf())
@@ -95,9 +99,14 @@ def gio_copy(file: Gio.File, destination: Gio.File):
     )
 
 
-def get_file_hash(file: Gio.File):
-    with open(file.get_path(), 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+def parse_size(size: str) -> int:
+    """Converts a size printed by flatpak (with g_format_size) back to bytes"""
+    match = re.match(r'^([0-9]+(?:[.,][0-9]+)?)\s*([kMGTP]?B|bytes?)$', size.strip())
+    if not match:
+        return 0
+
+    units = {'B': 1, 'byte': 1, 'bytes': 1, 'kB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4, 'PB': 1000 ** 5}
+    return round(float(match.group(1).replace(',', '.')) * units[match.group(2)])
 
 
 def send_notification(notification=Gio.Notification, tag=None):
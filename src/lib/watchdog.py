@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Deque, List, Optional
+from .utils import log
+from gi.repository import GLib
+
+# The folder of the boutique package, used to tell our frames apart from the ones of the libraries
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stall():
+    def __init__(self, callback: str, stack: List[str]):
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        # the function called by the main loop, a signal handler or an idle/timeout callback
+        self.callback = callback
+        self.stack = stack
+        # the innermost frame of every sample, the most common one is where the time was spent
+        self.samples: Counter = Counter()
+
+    def get_hot_frame(self) -> str:
+        return self.samples.most_common(1)[0][0] if self.samples else ''
+
+    def to_dict(self) -> dict:
+        return {
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration_ms, 1),
+            'callback': self.callback,
+            'hot_frame': self.get_hot_frame(),
+            'stack': self.stack,
+        }
+
+
+class MainLoopWatchdog():
+    """
+        A timeout on the GLib main loop updates a heartbeat every `interval_ms`,
+        while a background thread checks that the heartbeat keeps moving.
+        When the main loop does not run for more than `threshold_ms`, the stack of the main thread
+        is sampled until it is free again, then the stall is logged with the callback that caused it.
+    """
+
+    def __init__(self, threshold_ms=200, interval_ms=50):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.main_thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        self.max_latency_ms = 0.0
+        self.current_stall: Optional[Stall] = None
+        self.stalls: Deque[Stall] = deque(maxlen=20)
+        self.stalls_count = 0
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """Must be called from the thread running the GLib main loop"""
+        if self.running:
+            return
+
+        self.running = True
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+
+        GLib.timeout_add(int(self.interval * 1000), self._beat)
+        threading.Thread(target=self._watch, daemon=True, name='main-loop-watchdog').start()
+
+        log(f'Main loop watchdog started, threshold: {round(self.threshold * 1000)}ms')
+
+    def stop(self):
+        self.running = False
+
+    def _beat(self) -> bool:
+        now = time.monotonic()
+
+        with self.lock:
+            # how late this timeout was dispatched
+            latency_ms = max(0, (now - self.last_beat - self.interval) * 1000)
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            self.last_beat = now
+
+            stall = self.current_stall
+            self.current_stall = None
+
+        if stall:
+            stall.duration_ms = latency_ms + self.interval * 1000
+            self.stalls.append(stall)
+            self.stalls_count += 1
+
+            logging.warning(
+                f'Main loop blocked for {round(stall.duration_ms)}ms by {stall.callback}, most of the time in {stall.get_hot_frame()}\n'
+                + ''.join(stall.stack)
+            )
+
+        return self.running
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.interval / 2)
+
+            with self.lock:
+                blocked = time.monotonic() - self.last_beat - self.interval
+                if blocked < self.threshold:
+                    continue
+
+                frame = sys._current_frames().get(self.main_thread_id, None)
+                if not frame:
+                    continue
+
+                stack = traceback.extract_stack(frame)
+                del frame
+
+                if not self.current_stall:
+                    self.current_stall = Stall(self._find_callback(stack), traceback.format_list(stack))
+
+                self.current_stall.samples[self._format_frame(stack[-1])] += 1
+
+    def _format_frame(self, frame: traceback.FrameSummary) -> str:
+        filename = os.path.relpath(frame.filename, _PACKAGE_DIR) if frame.filename.startswith(_PACKAGE_DIR) else frame.filename
+        return f'{frame.name} ({filename}:{frame.lineno})'
+
+    def _find_callback(self, stack: traceback.StackSummary) -> str:
+        # The main loop is run by app.run() in main.main(), every frame after it has been called
+        # by GLib: the first one is the handler that is blocking the loop
+        for i, frame in enumerate(stack):
+            if frame.name == 'main' and frame.filename.endswith('main.py') and i + 1 < len(stack):
+                return self._format_frame(stack[i + 1])
+
+        for frame in stack:
+            if frame.filename.startswith(_PACKAGE_DIR):
+                return self._format_frame(frame)
+
+        return self._format_frame(stack[-1])
+
+    def get_stats(self) -> dict:
+        return {
+            'running': self.running,
+            'threshold_ms': round(self.threshold * 1000),
+            'max_latency_ms': round(self.max_latency_ms, 1),
+            'stalls': self.stalls_count,
+            'recent_stalls': [s.to_dict() for s in self.stalls],
+        }
+
+
+watchdog = MainLoopWatchdog()
@@ -15,13 +15,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from .lib.terminal import sh
+import time
+import signal
+
+# used to log how long it takes to show the first window
+_startup_time = time.monotonic()
+
+from .lib.terminal import sh, set_backend
 from .lib.utils import log
+from .lib import command_trace, command_metrics, tracing
 from .providers.providers_list import providers
-from .AboutDialog import AboutDialog
-from .BoutiqueWindow import BoutiqueWindow
+import os
 import sys
+import json
 import gi
+import threading
 import logging
 import subprocess
 
@@ -40,6 +48,9 @@ class BoutiqueApplication(Adw.Application):
         self.create_action('preferences', self.on_preferences_action)
         self.create_action('open_file', self.on_open_file_chooser)
         self.create_action('open_log_file', self.on_open_log_file)
+        self.create_action('dump_metrics', self.on_dump_metrics)
+        self.create_action('diagnostics', self.on_diagnostics_action)
+        self.create_action('show_updates', self.on_show_updates_action)
         self.win = None
 
     def do_startup(self):
@@ -50,6 +61,41 @@ class BoutiqueApplication(Adw.Application):
         css_provider.load_from_resource('/it/mijorus/boutique/assets/style.css')
         Gtk.StyleContext.add_provider_for_display(Gdk.Display.get_default(), css_provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
+        # BOUTIQUE_TRACE_RECORD=<file> records every command and its output,
+        # BOUTIQUE_TRACE_REPLAY=<file> answers the commands from a recorded trace instead of running them;
+        # in both cases the installation and the search go through the command line, so that they are part of the trace
+        if os.getenv('BOUTIQUE_TRACE_RECORD') or os.getenv('BOUTIQUE_TRACE_REPLAY'):
+            from .lib import flatpak
+
+            flatpak.native_reader_enabled = False
+            flatpak.appstream_index_enabled = False
+
+        if os.getenv('BOUTIQUE_TRACE_RECORD'):
+            command_trace.start_recording(os.getenv('BOUTIQUE_TRACE_RECORD'))
+
+        if os.getenv('BOUTIQUE_TRACE_REPLAY'):
+            latency_scale = float(os.getenv('BOUTIQUE_TRACE_REPLAY_LATENCY', '1'))
+            set_backend(command_trace.TraceReplay(os.getenv('BOUTIQUE_TRACE_REPLAY'), latency_scale))
+
+        # BOUTIQUE_TRACE_FILE=<file> writes a Chrome trace of the session when Boutique exits
+        if os.getenv('BOUTIQUE_TRACE_FILE'):
+            tracing.start(os.getenv('BOUTIQUE_TRACE_FILE'))
+
+        # BOUTIQUE_WATCHDOG=<ms> logs every callback that blocks the main loop for longer than <ms>
+        if os.getenv('BOUTIQUE_WATCHDOG'):
+            from .lib.watchdog import watchdog
+
+            watchdog.threshold = int(os.getenv('BOUTIQUE_WATCHDOG')) / 1000
+            watchdog.start()
+
+        # `kill -USR1 <pid>` writes the command metrics to the log
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self.on_dump_metrics_signal)
+
+        if os.getenv('BOUTIQUE_CHECK_NATIVE_READER'):
+            from .lib import flatpak
+
+            threading.Thread(target=flatpak.check_native_reader, daemon=True).start()
+
     def do_activate(self):
         """Called when the application is activated.
 
@@ -59,10 +105,28 @@ class BoutiqueApplication(Adw.Application):
         self.win = self.props.active_window
 
         if not self.win:
+            from .BoutiqueWindow import BoutiqueWindow
+
             self.win = BoutiqueWindow(application=self)
+            self.win.connect('map', self.on_first_window_mapped)
 
         self.win.present()
 
+    def on_first_window_mapped(self, window):
+        window.disconnect_by_func(self.on_first_window_mapped)
+        log(f'Startup completed in {round((time.monotonic() - _startup_time) * 1000)}ms')
+
+        GLib.idle_add(self.start_background_services)
+
+    def start_background_services(self):
+        """The installation monitors and the update checker are not needed to show the first frame"""
+        from .lib import flatpak
+        from .lib.update_checker import update_checker
+
+        flatpak.watch_installations()
+        update_checker.start()
+        return False
+
     def do_open(self, files: list[Gio.File], n_files: int, _):
         if files:
             for p, provider in providers.items():
@@ -81,9 +145,22 @@ class BoutiqueApplication(Adw.Application):
 
     def on_about_action(self, widget, _):
         """Callback for the app.about action."""
+        from .AboutDialog import AboutDialog
+
         about = AboutDialog(self.props.active_window)
         about.present()
 
+    def on_show_updates_action(self, widget, _):
+        """Called when the notification of the update checker is clicked"""
+        self.activate()
+        self.win.app_lists_stack.set_visible_child_name('updates')
+
+    def on_diagnostics_action(self, widget, _):
+        from .DiagnosticsWindow import DiagnosticsWindow
+
+        diagnostics = DiagnosticsWindow(self.props.active_window)
+        diagnostics.present()
+
     def on_preferences_action(self, widget, _):
         """Callback for the app.preferences action."""
         print('app.preferences action activated')
@@ -107,6 +184,8 @@ class BoutiqueApplication(Adw.Application):
         if not self.win:
             return
 
+        from .BoutiqueWindow import BoutiqueWindow
+
         def on_open_file_chooser_reponse(widget, id):
             selected_file = widget.get_file()
 
@@ -129,6 +208,22 @@ class BoutiqueApplication(Adw.Application):
         sh(['xdg-open',  GLib.get_user_cache_dir() + '/boutique.log'])
 
 
+    def on_dump_metrics(self, widget, _):
+        report = command_metrics.dump()
+        metrics_file = GLib.get_user_cache_dir() + '/boutique/command-metrics.json'
+
+        os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+        with open(metrics_file, 'w') as f:
+            json.dump(command_metrics.get_stats(), f, indent=2)
+
+        log(report)
+        log(f'Command metrics saved to {metrics_file}')
+
+    def on_dump_metrics_signal(self):
+        self.on_dump_metrics(None, None)
+        return True
+
+
 def main(version):
     """The application's entry point."""
 
@@ -0,0 +1,10 @@
+from gi.repository import GObject
+from .AppListElement import AppListElement
+
+
+class AppListItem(GObject.Object):
+    """Wraps an AppListElement, so that it can be stored in a Gio.ListStore"""
+
+    def __init__(self, list_element: AppListElement):
+        super().__init__()
+        self.app: AppListElement = list_element
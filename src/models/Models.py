@@ -18,6 +18,50 @@ class AppUpdateElement():
         for k, v in kwargs.items():
             self.extra_data[k] = v
 
+class FlatpakUpdateElement():
+    """A ref that can be updated, comparing the commit deployed locally with the one on the remote"""
+    def __init__(self, ref: str, kind: str, origin: str, from_commit: str, to_commit: str, from_version: str, to_version: str,
+            download_size: int, installed_size: int):
+
+        # ref is in the "id/arch/branch" form, kind is "app" or "runtime"
+        self.ref: str = ref
+        self.id: str = ref.split('/')[0]
+        self.kind: str = kind
+        self.origin: str = origin
+        self.from_commit: str = from_commit
+        self.to_commit: str = to_commit
+        self.from_version: str = from_version
+        self.to_version: str = to_version
+        self.download_size: int = download_size
+        self.installed_size: int = installed_size
+
+    def is_app(self) -> bool:
+        return self.kind == 'app'
+
+class TransactionProgress():
+    """The progress of a single ref inside an install, update or uninstall transaction"""
+    def __init__(self, ref: str, operation: str, index: int, total: int):
+        # ref can be a plain app id, or an "id/arch/branch" ref
+        self.ref: str = ref
+        self.id: str = ref.split('/')[0]
+        # install, update or uninstall
+        self.operation: str = operation
+        # position of the ref in the transaction, starting from 1
+        self.index: int = index
+        self.total: int = total
+        self.percent: int = 0
+        self.bytes_done: Optional[int] = None
+        self.bytes_total: Optional[int] = None
+        self.speed: str = ''
+        self.finished: bool = False
+
+    def get_fraction(self) -> float:
+        """The progress of the whole transaction, between 0 and 1"""
+        if not self.total:
+            return 0
+
+        return min(1, ((self.index - 1) + (1 if self.finished else self.percent / 100)) / self.total)
+
 class SearchResultsItems():
     def __init__(self, app_id: str, list_elements: list[AppListElement]):
         self.id: str = app_id
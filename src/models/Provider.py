@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import List, Callable, Dict, Tuple, Optional, TypeVar
 from .AppListElement import AppListElement
-from .Models import AppUpdateElement, ProviderMessage
+from .Models import AppUpdateElement, ProviderMessage, TransactionProgress
 from .AppListElement import InstalledStatus
 from gi.repository import Gtk, Gio
 
@@ -30,11 +30,13 @@ class Provider(ABC):
         pass
 
     @abstractmethod
-    def install(self, el: AppListElement, c: Callable[[bool], None]):
+    def install(self, el: AppListElement, c: Callable[[bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
+        """on_progress, when supported, is called in the main loop while the app is being installed"""
         pass
 
     @abstractmethod
-    def search(self, query: str) -> List[AppListElement]:
+    def search(self, query: str, is_cancelled: Optional[Callable[[], bool]]=None) -> List[AppListElement]:
+        """Commands run by the search are killed as soon as is_cancelled() returns True"""
         pass
 
     @abstractmethod
@@ -50,11 +52,21 @@ class Provider(ABC):
         pass
 
     @abstractmethod
-    def update(self, el: AppListElement, callback: Callable[[bool], None]):
+    def invalidate_updatables(self):
+        """Drops the cached update state, so that the next call to list_updatables() checks again"""
+        pass
+
+    @abstractmethod
+    def prefetch_updates(self, max_bytes: int):
+        """Downloads the pending updates in the background without applying them, using at most `max_bytes`"""
+        pass
+
+    @abstractmethod
+    def update(self, el: AppListElement, callback: Callable[[bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
         pass
     
     @abstractmethod
-    def update_all(self, callback: Callable[[bool, str, bool], None]):
+    def update_all(self, callback: Callable[[bool, str, bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
         pass
 
     @abstractmethod
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import random
 import string
 import threading
@@ -5,24 +7,23 @@ import logging
 import urllib
 import re
 import os
-import shutil
 import time
-import hashlib
-import html2text
 import subprocess
-import filecmp
-from xdg import DesktopEntry
 
-from ..lib import flatpak, terminal
+from ..lib import flatpak, terminal, file_hash
 from ..models.AppListElement import AppListElement, InstalledStatus
-from ..lib.async_utils import _async
-from ..lib.utils import log, cleanhtml, key_in_dict, gtk_image_from_url, qq, get_application_window, get_giofile_content_type, get_gsettings, create_dict, gio_copy, get_file_hash
+from ..lib.job_queue import job_queue, Job, PRIORITY_HIGH
+from ..lib.texture_cache import get_texture_cache
+from ..lib.utils import log, cleanhtml, key_in_dict, gtk_image_from_url, qq, get_application_window, get_giofile_content_type, get_gsettings, create_dict, gio_copy
 from ..components.CustomComponents import LabelStart
 from ..models.Provider import Provider
-from ..models.Models import FlatpakHistoryElement, AppUpdateElement
-from typing import List, Callable, Union, Dict, Optional, List, TypedDict
+from ..models.Models import FlatpakHistoryElement, AppUpdateElement, TransactionProgress
+from typing import List, Callable, Union, Dict, Optional, List, TypedDict, TYPE_CHECKING
 from gi.repository import GLib, Gtk, Gdk, GdkPixbuf, Gio, GObject, Pango, Adw
 
+if TYPE_CHECKING:
+    from xdg import DesktopEntry
+
 
 class ExtractedAppImage():
     desktop_entry: Optional[DesktopEntry.DesktopEntry]
@@ -53,8 +54,11 @@ class AppImageProvider(Provider):
 
         self.modal_gfile: Optional[Gio.File] = None
         self.modal_gfile_createshortcut_check: Optional[Gtk.CheckButton] = None
+        self.refresh_installed_status_callback: Optional[Callable] = None
 
     def list_installed(self) -> List[AppListElement]:
+        from xdg import DesktopEntry
+
         default_folder_path = self.get_appimages_default_destination_path()
         output = []
 
@@ -93,18 +97,78 @@ class AppImageProvider(Provider):
         return output
 
     def is_installed(self, el: AppImageListElement, alt_sources: list[AppListElement] = []) -> tuple[bool, Optional[AppListElement]]:
-        if el.file_path:
-            for file_name in os.listdir(self.get_appimages_default_destination_path()):
-                installed_gfile = Gio.File.new_for_path(self.get_appimages_default_destination_path() + '/' + file_name)
-                loaded_gfile = Gio.File.new_for_path(el.file_path)
+        """
+            Compares the memoized checksums of the installed AppImages having the same size as the file.
+            Files that haven't been hashed yet are hashed in the background, and the status is refreshed when they are done
+        """
+        if not el.file_path:
+            return False, None
+
+        installed_path, unhashed = self.find_installed_file(el.file_path)
+
+        if installed_path:
+            el.file_path = installed_path
+            return True, None
+
+        if unhashed:
+            remaining = len(unhashed)
+
+            def on_hashed(digest: Optional[str]):
+                nonlocal remaining
+                remaining -= 1
+
+                if remaining:
+                    return
+
+                installed_path, _ = self.find_installed_file(el.file_path)
+                if installed_path:
+                    el.file_path = installed_path
+                    el.set_installed_status(InstalledStatus.INSTALLED)
+
+                    if self.refresh_installed_status_callback:
+                        self.refresh_installed_status_callback()
 
-                if get_giofile_content_type(installed_gfile) == 'application/vnd.appimage':
-                    if filecmp.cmp(installed_gfile.get_path(), loaded_gfile.get_path(), shallow=False):
-                        el.file_path = installed_gfile.get_path()
-                        return True, None
+            for path in unhashed:
+                file_hash.hash_file_async(path, on_hashed)
 
         return False, None
 
+    def find_installed_file(self, file_path: str) -> tuple[Optional[str], List[str]]:
+        """Returns the installed copy of a file, if any, and the files whose checksum is needed but not memoized yet"""
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return None, []
+
+        candidates = []
+        for file_name in os.listdir(self.get_appimages_default_destination_path()):
+            installed_path = self.get_appimages_default_destination_path() + '/' + file_name
+
+            try:
+                if os.path.getsize(installed_path) != size:
+                    continue
+            except OSError:
+                continue
+
+            if get_giofile_content_type(Gio.File.new_for_path(installed_path)) == 'application/vnd.appimage':
+                candidates.append(installed_path)
+
+        if not candidates:
+            return None, []
+
+        digest = file_hash.get_cached_file_hash(file_path)
+        unhashed = [] if digest else [file_path]
+
+        for installed_path in candidates:
+            installed_digest = file_hash.get_cached_file_hash(installed_path)
+
+            if not installed_digest:
+                unhashed.append(installed_path)
+            elif installed_digest == digest:
+                return installed_path, []
+
+        return None, unhashed
+
     def get_icon(self, el: AppImageListElement, repo: str = None, load_from_network: bool = False) -> Gtk.Image:
         icon_path = None
 
@@ -112,9 +176,13 @@ class AppImageProvider(Provider):
         #     icon_path = el.extra_data['tmp_icon'].get_path()
         if el.desktop_entry:
             icon_path = el.desktop_entry.getIcon()
+        elif getattr(el, 'icon', None):
+            icon_path = el.icon
 
-        if icon_path and os.path.exists(icon_path):
-            return Gtk.Image.new_from_file(icon_path)
+        texture = get_texture_cache().get_from_file(icon_path, 128) if icon_path else None
+
+        if texture:
+            return Gtk.Image.new_from_paintable(texture)
         else:
             icon_theme = Gtk.IconTheme.get_for_display(Gdk.Display.get_default())
 
@@ -134,25 +202,52 @@ class AppImageProvider(Provider):
             logging.error(e)
             callback(False)
 
-    def install(self, el: AppListElement, c: Callable[[bool], None]):
+    def install(self, el: AppListElement, c: Callable[[bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
         pass
 
-    def search(self, query: str) -> List[AppListElement]:
+    def search(self, query: str, is_cancelled: Optional[Callable[[], bool]]=None) -> List[AppListElement]:
         return []
 
     def get_long_description(self, el: AppListElement) -> str:
         return ''
 
     def load_extra_data_in_appdetails(self, widget: Gtk.Widget, list_element: AppListElement):
-        pass
+        # installed apps come with a desktop entry, the id of a sideloaded file is its checksum instead,
+        # which takes a while for the larger AppImages
+        if list_element.id or list_element.desktop_entry or not list_element.file_path:
+            return
+
+        checksum_label = LabelStart(label='Computing checksum...', css_classes=['dim-label', 'caption'], selectable=True)
+        widget.append(checksum_label)
+
+        def on_progress(fraction: float):
+            checksum_label.set_label(f'Computing checksum... {round(fraction * 100)}%')
+
+        def on_hashed(digest: Optional[str]):
+            checksum_label.set_label(f'MD5: {digest}' if digest else 'Couldn\'t compute the checksum')
+
+            if digest:
+                list_element.id = digest
+
+                # redraws the details page, which shows the new id
+                if self.refresh_installed_status_callback:
+                    self.refresh_installed_status_callback()
+
+        file_hash.hash_file_async(list_element.file_path, on_hashed, on_progress)
 
     def list_updatables(self) -> List[AppUpdateElement]:
         return []
 
-    def update(self, el: AppListElement, callback: Callable[[bool], None]):
+    def invalidate_updatables(self):
+        pass
+
+    def prefetch_updates(self, max_bytes: int):
         pass
 
-    def update_all(self, callback: Callable[[bool, str, bool], None]):
+    def update(self, el: AppListElement, callback: Callable[[bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
+        pass
+
+    def update_all(self, callback: Callable[[bool, str, bool], None], on_progress: Optional[Callable[[TransactionProgress], None]]=None):
         pass
 
     def updates_need_refresh(self) -> bool:
@@ -168,8 +263,14 @@ class AppImageProvider(Provider):
     def is_updatable(self, app_id: str) -> bool:
         return False
 
-    @_async
     def install_file(self, list_element: AppImageListElement, callback: Callable[[bool], None]) -> bool:
+        job = Job('appimage', 'install', list_element.file_path, lambda jobs: self.run_install_file(list_element), PRIORITY_HIGH, title=list_element.name)
+        job_queue.submit(job, callback)
+        return True
+
+    def run_install_file(self, list_element: AppImageListElement) -> bool:
+        from xdg import DesktopEntry
+
         logging.info('Installing appimage: ' + list_element.file_path)
         list_element.installed_status = InstalledStatus.INSTALLING
         extracted_appimage = None
@@ -263,8 +364,7 @@ class AppImageProvider(Provider):
         list_element.installed_status = InstalledStatus.ERROR
 
         terminal.sh(['update-desktop-database'])
-        callback(list_element.installed_status == InstalledStatus.INSTALLED)
-        return True
+        return list_element.installed_status == InstalledStatus.INSTALLED
 
     def create_list_element_from_file(self, file: Gio.File) -> AppListElement:
         app_name: str = file.get_parse_name().split('/')[-1]
@@ -272,7 +372,8 @@ class AppImageProvider(Provider):
         return AppImageListElement(
             name=app_name,
             description='',
-            app_id=hashlib.md5(open(file.get_path(), 'rb').read()).hexdigest(),
+            # the checksum is computed in the background by load_extra_data_in_appdetails()
+            app_id=file_hash.get_cached_file_hash(file.get_path()) or '',
             provider=self.name,
             installed_status=InstalledStatus.NOT_INSTALLED,
             file_path=file.get_path(),
@@ -320,7 +421,7 @@ class AppImageProvider(Provider):
                 l = AppListElement(
                     name=self.modal_gfile.get_path(), 
                     description='', 
-                    app_id=get_file_hash(self.modal_gfile), 
+                    app_id=file_hash.get_cached_file_hash(self.modal_gfile.get_path()) or '',
                     provider=self.name,
                     installed_status=InstalledStatus.NOT_INSTALLED, 
                     file_path=self.modal_gfile.get_path()
@@ -339,14 +440,19 @@ class AppImageProvider(Provider):
         pass
 
     def set_refresh_installed_status_callback(self, callback: Optional[Callable]):
-        pass
+        self.refresh_installed_status_callback = callback
 
     def post_file_extraction_cleanup(self, extraction: ExtractedAppImage):
+        import shutil
+
         print(extraction.container_folder.get_path())
         if extraction.container_folder.query_exists():
             shutil.rmtree(extraction.container_folder.get_path())
 
     def extract_appimage(self, file_path: str) -> ExtractedAppImage:
+        import shutil
+        from xdg import DesktopEntry
+
         file = Gio.File.new_for_path(file_path)
 
         if get_giofile_content_type(file) in ['application/x-iso9660-appimage']:
@@ -361,7 +467,7 @@ class AppImageProvider(Provider):
         temp_file = None
 
         # hash file
-        temp_file = 'boutique_appimage_' + get_file_hash(file)
+        temp_file = 'boutique_appimage_' + file_hash.hash_file(file_path)
         folder = Gio.File.new_for_path(GLib.get_tmp_dir() + f'/it.mijorus.boutique/appimages/{temp_file}')
 
         if folder.query_exists():
@@ -4,25 +4,29 @@ import string
 import threading
 import urllib
 import re
-import requests
-import html2text
 import time
 import subprocess
 from typing import TypedDict
-from xdg import DesktopEntry
 
-from ..lib import flatpak, terminal
+from ..lib import flatpak, flatpak_prefetch, terminal
 from ..lib.async_utils import _async
+from ..lib.job_queue import job_queue, Job, PRIORITY_HIGH, PRIORITY_LOW
+from ..lib.icon_service import get_icon_service
+from ..lib.texture_cache import get_texture_cache
 from ..lib.utils import log, cleanhtml, key_in_dict, gtk_image_from_url, qq, get_application_window, get_giofile_content_type
 from ..models.AppListElement import AppListElement, InstalledStatus
 from ..models.Models import ProviderMessage
 from ..components.CustomComponents import LabelStart
 from ..models.Provider import Provider
-from ..models.Models import FlatpakHistoryElement, AppUpdateElement
+from ..models.Models import FlatpakHistoryElement, AppUpdateElement, TransactionProgress, FlatpakUpdateElement
 from typing import List, Callable, Union, Dict, Optional, List
 from gi.repository import GLib, Gtk, Gdk, GdkPixbuf, Gio, GObject, Adw
 
 
+# icons are decoded once at this size and shared between the lists and the details page
+ICON_TEXTURE_SIZE = 128
+
+
 class FlatpakState(TypedDict):
     installed_status: InstalledStatus
 
@@ -36,9 +40,7 @@ class FlatpakProvider(Provider):
         logging.info('Activating ' + self.name + ' provider')
 
         self.refresh_installed_status_callback: Optional[Callable] = None
-        self.remote_ls_updatable_cache: Optional[List] = None
-        self.list_updatables_cache: Optional[str] = None
-        self.update_section_cache = None
+        self.refresh_appstream = True
         self.list_installed_cache = None
         self.do_updates_need_refresh = True
         self.ignored_patterns = [
@@ -115,83 +117,82 @@ class FlatpakProvider(Provider):
             pref_remote_data = key_in_dict(remotes, pref_remote)
 
             if pref_remote_data and ('url' in pref_remote_data):
-                try:
-                    url = re.sub(r'\/$', '', pref_remote_data['url'])
-                    image = gtk_image_from_url(f'{url}/appstream/x86_64/icons/128x128/{urllib.parse.quote(list_element.id, safe="")}.png', image)
-                    image.set_pixel_size(pixel_size)
-                    return image
+                url = re.sub(r'\/$', '', pref_remote_data['url'])
+
+                # the placeholder is returned immediately and replaced once the icon has been downloaded
+                def on_icon_fetched(path: Optional[str]):
+                    texture = get_texture_cache().get_from_file(path, ICON_TEXTURE_SIZE) if path else None
+                    if texture:
+                        image.set_from_paintable(texture)
+
+                get_icon_service().fetch(
+                    pref_remote,
+                    list_element.id,
+                    f'{url}/appstream/x86_64/icons/128x128/{urllib.parse.quote(list_element.id, safe="")}.png',
+                    on_icon_fetched
+                )
 
-                except Exception as e:
-                    logging.warn(e)
+                image.set_pixel_size(pixel_size)
+                return image
 
         if ('origin' in list_element.extra_data) and ('arch' in list_element.extra_data):
             repo = list_element.extra_data['origin']
             aarch = list_element.extra_data['arch']
             local_file_path = f'{GLib.get_user_data_dir()}/flatpak/appstream/{repo}/{aarch}/active/icons/128x128/{list_element.id}.png'
 
-            if GLib.file_test(local_file_path, GLib.FileTest.EXISTS):
-                image = Gtk.Image.new_from_file(local_file_path)
+            texture = get_texture_cache().get_from_file(local_file_path, ICON_TEXTURE_SIZE)
+            if texture:
+                image = Gtk.Image.new_from_paintable(texture)
         elif Gtk.IconTheme.get_for_display(Gdk.Display.get_default()).has_icon(list_element.id):
             image = Gtk.Image(icon_name=list_element.id)
 
         image.set_pixel_size(pixel_size)
         return image
 
-    def uninstall(self, list_element: AppListElement, callback: Callable[[bool], None] = None):
-        success = False
+    def uninstall(self, list_element: AppListElement, callback: Callable[[bool], None] = None) -> Job:
+        ref = self.get_ref(list_element)
+
+        def run_uninstall(jobs: List[Job]) -> bool:
+            flatpak.remove(ref, list_element.id)
+            return True
 
-        def after_uninstall(_: bool):
-            list_element.set_installed_status(InstalledStatus.NOT_INSTALLED)
+        def after_uninstall(success: bool):
+            list_element.set_installed_status(qq(success, InstalledStatus.NOT_INSTALLED, InstalledStatus.ERROR))
 
             if callback:
-                callback(_)
+                callback(success)
 
-        try:
-            flatpak.remove(
-                self.get_ref(list_element),
-                list_element.id,
-                lambda _: after_uninstall(True)
-            )
+        job = Job('flatpak', 'uninstall', ref, run_uninstall, PRIORITY_HIGH, title=list_element.name)
+        return job_queue.submit(job, after_uninstall)
 
-            success = True
-        except Exception as e:
-            logging.error(e)
-            after_uninstall(False)
-            list_element.set_installed_status(InstalledStatus.ERROR)
-
-        return success
+    def install(self, list_element: AppListElement, callback: Callable[[bool], None] = None, on_progress: Optional[Callable[[TransactionProgress], None]] = None) -> Job:
+        if not 'origin' in list_element.extra_data:
+            raise Exception('Missing "origin" in list_element')
 
-    def install(self, list_element: AppListElement, callback: Callable[[bool], None] = None):
-        def install_thread(list_element: AppListElement, callback: Callable):
-            try:
-                ref = self.get_ref(list_element)
-                list_element.extra_data['ref'] = ref
-                flatpak.install(list_element.extra_data['origin'], ref)
-                list_element.set_installed_status(InstalledStatus.INSTALLED)
+        ref = self.get_ref(list_element)
+        list_element.extra_data['ref'] = ref
 
-                if callback:
-                    callback(True)
+        def run_install(jobs: List[Job]) -> bool:
+            flatpak.install(list_element.extra_data['origin'], ref, jobs[0].report_progress)
+            return True
 
-            except Exception as e:
-                logging.error(e)
-                list_element.set_installed_status(InstalledStatus.ERROR)
-                if callback:
-                    callback(False)
+        def after_install(success: bool):
+            list_element.set_installed_status(qq(success, InstalledStatus.INSTALLED, InstalledStatus.ERROR))
 
-        if not 'origin' in list_element.extra_data:
-            raise Exception('Missing "origin" in list_element')
+            if callback:
+                callback(success)
 
-        thread = threading.Thread(target=install_thread, args=(list_element, callback, ), daemon=True)
-        thread.start()
+        job = Job('flatpak', 'install', ref, run_install, PRIORITY_HIGH, title=list_element.name)
+        return job_queue.submit(job, after_install, self.get_progress_callback(on_progress))
 
-    def search(self, query: str) -> List[AppListElement]:
+    def search(self, query: str, is_cancelled: Optional[Callable[[], bool]]=None) -> List[AppListElement]:
         installed_apps = flatpak.apps_list()
-        result = flatpak.search(query)
+        result = flatpak.search(query, is_cancelled)
 
         output = []
 
         apps: Dict[str, list] = {}
-        for app in result[0:100]:
+        for app in result:
             skip = False
             for i in self.ignored_patterns:
                 if i in app['application']:
@@ -263,6 +264,7 @@ class FlatpakProvider(Provider):
 
         output = ''
         if key_in_dict(appstream, 'description'):
+            import html2text
             output = html2text.html2text(appstream['description'])
 
         return f'<b>{el.description}</b>\n\n{output}'.replace("&", "&amp;")
@@ -372,81 +374,39 @@ class FlatpakProvider(Provider):
         threading.Thread(target=self.async_load_app_history, args=(expander, )).start()
 
     def list_updatables(self) -> List[AppUpdateElement]:
-        # if not self.do_updates_need_refresh and (self.list_updatables_cache is not None):
-        #     update_output = self.list_updatables_cache
-        # else:
-        #     self.update_remote_ls_updatable_cache()
-        #     update_output = terminal.sh(['flatpak', 'update', '--user'], return_stderr=True)
-        #     self.list_updatables_cache = update_output
-
-        latest_remote_upstream = []
-        if self.list_updatables_cache == None:
+        if self.refresh_appstream:
+            self.refresh_appstream = False
+
             try:
                 terminal.sh(['flatpak', 'update', '--appstream'])
-                latest_remote_upstream = flatpak.remote_ls(updates_only=True, origin='flathub')
             except Exception as e:
                 logging.error(e)
                 self.update_messages.append(ProviderMessage('There was an error', 'warn'))
 
-            self.list_updatables_cache = terminal.sh(['flatpak', 'update', '--user'], return_stderr=True)
-
-        if (not self.list_updatables_cache) or (not '1.\t' in self.list_updatables_cache):
-            return []
-
-        update_table_section = ''
-        update_sections = self.list_updatables_cache.split('1.\t', maxsplit=1)
-
-        if len(update_sections) > 1:
-            update_table_section = '1.\t' + update_sections[1]
-            update_table_section = update_table_section
-
-        start_pattern = re.compile(r'^([0-9]+\.)')
         output = []
+        for upd in flatpak.get_update_plan():
+            output.append(AppUpdateElement(upd.id, GLib.format_size(upd.download_size), upd.to_version or None, update=upd))
 
-        if update_table_section:
-            for row in update_table_section.split('\n'):
-                row = row.strip()
-                if not re.match(start_pattern, row):
-                    break
-                else:
-                    cols = []
-                    for i, col in enumerate(row.split('\t')):
-                        col = col.strip()
-                        if (i > 0) and len(col) > 0:
-                            cols.append(col)
-
-                    update_size = ''.join(re.findall(r'([0-9]|,)', cols[4], flags=re.A)) if len(cols) > 3 else '0'
-                    app_update_element = AppUpdateElement(cols[0], update_size, None)
-                    output.append(app_update_element)
-
-                    for rc in latest_remote_upstream:
-                        if rc['application'] == app_update_element.id:
-                            app_update_element.to_version = rc['version']
-                            break
-
-        # self.do_updates_need_refresh = False
         return output
 
-    def update(self, list_element: AppListElement, callback: Callable):
-        self.list_updatables_cache = None
+    def invalidate_updatables(self):
+        self.refresh_appstream = True
+        flatpak.invalidate_cache(flatpak.UPDATES_TOKEN)
 
-        def update_task():
-            ref = self.get_ref(list_element)
-            success = False
+    def get_progress_callback(self, on_progress: Optional[Callable[[TransactionProgress], None]]) -> Optional[Callable[[TransactionProgress], None]]:
+        """Wraps on_progress, so that it is called in the main loop"""
+        if not on_progress:
+            return None
+
+        return lambda progress: GLib.idle_add(on_progress, progress)
 
+    def update(self, list_element: AppListElement, callback: Callable, on_progress: Optional[Callable[[TransactionProgress], None]] = None) -> Job:
+        def after_update(success: bool):
+            list_element.set_installed_status(qq(success, InstalledStatus.INSTALLED, InstalledStatus.ERROR))
             self.flatpaks_state[list_element.id] = {'installed_status': list_element.installed_status}
 
-            try:
-                terminal.sh(['flatpak', 'update', '--user', '--noninteractive', ref])
-                list_element.set_installed_status(InstalledStatus.INSTALLED)
-                self.remote_ls_updatable_cache = None
+            if success:
                 self.do_updates_need_refresh = True
-                success = True
-            except Exception as e:
-                logging.error(e)
-                list_element.set_installed_status(InstalledStatus.ERROR)
-
-            self.flatpaks_state[list_element.id] = {'installed_status': list_element.installed_status}
 
             if self.refresh_installed_status_callback:
                 self.refresh_installed_status_callback(final=True)
@@ -455,39 +415,93 @@ class FlatpakProvider(Provider):
                 callback(success)
 
         list_element.set_installed_status(InstalledStatus.UPDATING)
-        threading.Thread(target=update_task, daemon=True).start()
+        self.flatpaks_state[list_element.id] = {'installed_status': list_element.installed_status}
+
+        # updates queued while another transaction is running are applied together
+        job = Job('flatpak', 'update', self.get_ref(list_element), self.run_update_job, batchable=True, title=list_element.name)
+        return job_queue.submit(job, after_update, self.get_progress_callback(on_progress))
+
+    def run_update_job(self, jobs: List[Job]) -> bool:
+        def on_progress(progress: TransactionProgress):
+            for job in jobs:
+                job.report_progress(progress)
+
+        refs = [job.ref for job in jobs]
+
+        flatpak.update(refs, on_progress, no_pull=self.are_updates_prefetched(refs))
+        flatpak_prefetch.forget(refs)
+        return True
+
+    def are_updates_prefetched(self, refs: Optional[List[str]]=None) -> bool:
+        """Whether the updates of the given refs, or all the pending updates, have already been downloaded"""
+        updates = [upd for upd in flatpak.get_update_plan() if (refs is None) or (upd.ref in refs)]
+
+        if (not updates) or (refs is not None and len(updates) != len(refs)):
+            return False
+
+        return all([flatpak_prefetch.is_prefetched(upd) for upd in updates])
+
+    def prefetch_updates(self, max_bytes: int) -> Job:
+        def run_prefetch(jobs: List[Job]) -> bool:
+            # every ref is downloaded by its own job, so that the jobs started by the user don't wait for all of them
+            for upd in flatpak_prefetch.select(flatpak.get_update_plan(), max_bytes):
+                job_queue.submit(Job('flatpak', 'prefetch', upd.ref, self.get_prefetch_runner(upd), PRIORITY_LOW, title=f'Download of {upd.id}'))
+
+            return True
+
+        job = Job('flatpak', 'prefetch', '', run_prefetch, PRIORITY_LOW, title='Updates download')
+        return job_queue.submit(job)
+
+    def get_prefetch_runner(self, upd: FlatpakUpdateElement) -> Callable[[List[Job]], bool]:
+        def run_prefetch_ref(jobs: List[Job]) -> bool:
+            # the update might have been installed, or superseded, while the job was waiting
+            if not [u for u in flatpak.get_update_plan() if (u.ref == upd.ref) and (u.to_commit == upd.to_commit)]:
+                return True
+
+            flatpak.pull_updates([upd.ref])
+            flatpak_prefetch.add([upd])
+            return True
+
+        return run_prefetch_ref
 
     def run(self, el: AppListElement):
         terminal.threaded_sh(['flatpak', 'run', '--user', el.id])
 
-    def update_all(self, callback: Callable):
-        def update_task(callback):
-            success = False
+    def update_all(self, callback: Callable, on_progress: Optional[Callable[[TransactionProgress], None]] = None) -> Job:
+        def run_update_all(jobs: List[Job]) -> bool:
+            updates = flatpak.get_update_plan()
 
-            try:
-                terminal.sh(['flatpak', 'update', '--user', '-y', '--noninteractive'])
-                self.do_updates_need_refresh = True
-                success = True
-            except Exception as e:
-                log(e)
+            flatpak.update([], jobs[0].report_progress, no_pull=self.are_updates_prefetched())
+            flatpak_prefetch.forget([upd.ref for upd in updates])
+            self.do_updates_need_refresh = True
+            return True
 
+        def after_update_all(success: bool):
             if callback:
-                callback(success, 'flatpak')
+                # queued after the last progress update
+                GLib.idle_add(callback, success, 'flatpak')
 
-        threading.Thread(target=update_task, daemon=True, args=(callback, )).start()
+        job = Job('flatpak', 'update-all', '', run_update_all, title='All updates')
+        return job_queue.submit(job, after_update_all, self.get_progress_callback(on_progress))
 
     def can_install_file(self, file: Gio.File):
         return get_giofile_content_type(file) in ['application/vnd.flatpak.ref']
 
-    def install_file(self, file, callback):
-        def install_ref(path):
+    def install_file(self, file, callback) -> Job:
+        path = file.get_path()
+
+        def install_ref(jobs: List[Job]) -> bool:
             log('installing ', path)
-            terminal.sh(['flatpak', 'install', '--from', path, '--noninteractive', '--user'])
-            if callback:
-                callback(True)
+
+            try:
+                terminal.sh(['flatpak', 'install', '--from', path, '--noninteractive', '--user'])
+            finally:
+                flatpak.invalidate_cache(flatpak.INSTALLATION_TOKEN)
+
             log('Installed!')
+            return True
 
-        threading.Thread(target=install_ref, args=(file.get_path(), ), daemon=True).start()
+        return job_queue.submit(Job('flatpak', 'install', path, install_ref, PRIORITY_HIGH), callback)
 
     def create_list_element_from_file(self, file: Gio.File) -> AppListElement:
         res = file.load_contents(None)
@@ -527,21 +541,28 @@ class FlatpakProvider(Provider):
     def show_downgrade_dialog(self, button: Gtk.Button, data: dict):
         list_element: AppListElement = data['list_element']
 
-        def install_old_version():
+        def install_old_version(jobs: List[Job]) -> bool:
             terminal.sh(['flatpak', 'kill', list_element.id], return_stderr=True)
             self.refresh_installed_status_callback(status=InstalledStatus.UPDATING)
 
+            success = False
+
             try:
                 terminal.sh(['flatpak', 'update', f'--commit={data["commit"]}', '-y', '--noninteractive', list_element.id])
                 self.do_updates_need_refresh = True
                 self.refresh_installed_status_callback(status=InstalledStatus.INSTALLED)
+                success = True
             except Exception as e:
                 logging.error(e)
                 self.refresh_installed_status_callback(final=True, status=InstalledStatus.ERROR)
 
+            flatpak.invalidate_cache(flatpak.INSTALLATION_TOKEN)
+            return success
+
         def on_downgrade_dialog_response(dialog: Gtk.Dialog, response: int):
             if response == Gtk.ResponseType.YES:
-                threading.Thread(target=install_old_version, daemon=True).start()
+                ref = f'{self.get_ref(list_element)}@{data["commit"]}'
+                job_queue.submit(Job('flatpak', 'downgrade', ref, install_old_version, PRIORITY_HIGH, title=list_element.name))
 
             dialog.destroy()
 
@@ -573,21 +594,11 @@ class FlatpakProvider(Provider):
         raise Exception('Missing list_element source!')
 
     def is_updatable(self, app_id: str) -> bool:
-        if self.update_section_cache == None:
-            update_output = terminal.sh(['flatpak', 'update', '--user'], return_stderr=True)
-            self.refresh_update_section_cache(update_output)
-
-        return (app_id in self.update_section_cache)
-
-    def refresh_update_section_cache(self, update_output: Optional[str]):
-        self.update_section_cache = ''
-
-        if update_output:
-            update_sections = update_output.split('1.\t', maxsplit=1)
+        for upd in flatpak.get_update_plan():
+            if upd.id == app_id:
+                return True
 
-            if len(update_sections) > 1:
-                update_section = '1.\t' + update_sections[1]
-                self.update_section_cache = update_section
+        return False
 
     def get_source_details(self, list_element: AppListElement):
         return (
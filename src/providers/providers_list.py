@@ -1,11 +1,48 @@
-from typing import Dict
+import threading
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator
 from ..models.Provider import Provider
-from .FlatpakProvider import FlatpakProvider
-from .AppImageProvider import AppImageProvider
+from ..lib import tracing
+
+
+class _LazyProviders(Mapping):
+    """Imports and creates every provider the first time it is accessed, not at import time"""
+
+    def __init__(self, factories: Dict[str, Callable[[], Provider]]):
+        self._factories = factories
+        self._instances: Dict[str, Provider] = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name: str) -> Provider:
+        with self._lock:
+            if not name in self._instances:
+                provider = self._factories[name]()
+                tracing.trace_methods(provider, 'provider', name, [m for m in dir(Provider) if not m.startswith('_')])
+
+                self._instances[name] = provider
+
+            return self._instances[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._factories)
+
+    def __len__(self) -> int:
+        return len(self._factories)
+
+
+def _create_flatpak_provider() -> Provider:
+    from .FlatpakProvider import FlatpakProvider
+    return FlatpakProvider()
+
+
+def _create_appimage_provider() -> Provider:
+    from .AppImageProvider import AppImageProvider
+    return AppImageProvider()
+
 
 # A list containing all the "Providers" currently only Flatpak is supported
 # but I might need to add other ones in the future
-providers: Dict[str, Provider] = { 
-    'flatpak': FlatpakProvider(),
-    'appimage': AppImageProvider()
-}
\ No newline at end of file
+providers: Dict[str, Provider] = _LazyProviders({
+    'flatpak': _create_flatpak_provider,
+    'appimage': _create_appimage_provider
+})
@@ -0,0 +1,8 @@
+import os
+import sys
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+# the sources are imported as the "src" package, the fake host from the benchmarks
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'build-aux', 'benchmarks'))
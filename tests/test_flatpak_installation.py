@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('gi')
+
+from fake_flatpak import FakeFlatpakHost
+from src.lib import flatpak, flatpak_installation, terminal
+
+
+class CommandLog():
+    def __init__(self, backend):
+        self.backend = backend
+        self.commands = []
+
+    def __call__(self, args):
+        self.commands.append(args)
+        return self.backend(args)
+
+
+@pytest.fixture
+def mixed_host(tmp_path, monkeypatch):
+    """The user installation is on disk, the system one can only be read through the CLI"""
+    host = FakeFlatpakHost(apps=3, runtimes=2, remote_apps=3)
+    host.write_installation(f'{tmp_path}/flatpak')
+
+    system_runtime = dict(host.installed_refs[-1], branch='system', ref='org.fake.Platform/x86_64/system', installation='system')
+    host.installed_refs.append(system_runtime)
+
+    backend = CommandLog(host)
+    monkeypatch.setattr(flatpak_installation, 'get_user_data_dir', lambda: str(tmp_path))
+    monkeypatch.setattr(flatpak_installation, 'SYSTEM_INSTALLATION_PATH', f'{tmp_path}/missing')
+    monkeypatch.setattr(flatpak, 'native_reader_enabled', True)
+
+    terminal.set_backend(backend)
+    flatpak.invalidate_cache()
+    yield backend
+
+    terminal.set_backend(None)
+    flatpak.invalidate_cache()
+
+
+def test_libs_list_reads_only_the_system_installation_with_the_cli(mixed_host):
+    libs = flatpak.libs_list()
+
+    assert sorted([(r['ref'], r['installation']) for r in libs]) == [
+        ('org.fake.Platform/x86_64/0', 'user'),
+        ('org.fake.Platform/x86_64/1', 'user'),
+        ('org.fake.Platform/x86_64/system', 'system'),
+    ]
+
+    assert [c[0:3] for c in mixed_host.commands] == [['flatpak', 'list', '--system']]
+
+
+def test_apps_list_does_not_run_the_cli(mixed_host):
+    assert len(flatpak.apps_list()) == 3
+    assert mixed_host.commands == []
+
+
+def test_is_installed_asks_the_cli_only_for_the_system_installation(mixed_host):
+    assert flatpak.is_installed('org.fake.App00000')
+    assert mixed_host.commands == []
+
+    assert flatpak.is_installed('org.fake.Platform/x86_64/system')
+    assert not flatpak.is_installed('org.fake.Missing')
+    assert [c[0:3] for c in mixed_host.commands] == [['flatpak', 'info', '--system'], ['flatpak', 'info', '--system']]
+
+
+def test_installed_size_is_read_big_endian(mixed_host):
+    app = [r for r in flatpak.apps_list() if r['application'] == 'org.fake.App00001'][0]
+
+    # the fake host installs the n-th app with a size of n + 1 MiB
+    assert app['installed_size'] == 2 * 1024 * 1024
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip('gi')
+
+from src.lib.flatpak_progress import TransactionProgressParser
+
+
+def parse_table(rows):
+    parser = TransactionProgressParser(None)
+    for row in rows:
+        parser.feed(row)
+
+    return parser.table
+
+
+def test_table_row_without_status():
+    assert parse_table(['1.\torg.gnome.Maps\tstable\tu\tflathub\t< 3.4 MB']) == {1: ('org.gnome.Maps', 3400000)}
+
+
+def test_table_row_with_pending_status():
+    assert parse_table([' 1. [ ] org.gnome.Maps  stable  u  flathub  < 3.4 MB']) == {1: ('org.gnome.Maps', 3400000)}
+
+
+def test_table_row_with_done_status():
+    assert parse_table([' 2. [✓] org.gnome.Maps.Locale  stable  u  flathub  < 12.1 kB']) == {2: ('org.gnome.Maps.Locale', 12100)}
+
+
+def test_progress_uses_the_ref_of_its_table_row():
+    progress = []
+    parser = TransactionProgressParser(progress.append, interval=0)
+
+    for line in [
+        ' 1. [✓] org.gnome.Platform  44  u  flathub  < 100 MB',
+        ' 2. [ ] org.gnome.Maps  stable  u  flathub  < 3.4 MB',
+        'Updating 2/2… ████▍     45%  1.2 MB/s  00:04',
+    ]:
+        parser.feed(line)
+
+    assert (progress[-1].ref, progress[-1].bytes_total, progress[-1].percent) == ('org.gnome.Maps', 3400000, 45)